@@ -0,0 +1,143 @@
+"""Сравнение памяти: записи как словари из JSON против компактных записей bot.py.
+
+Генерирует синтетические данные в формате файлов бота (пользователи,
+отправки и заказы; с --legacy - в старом денормализованном виде), затем измеряет
+через tracemalloc объем памяти коллекций в обоих представлениях.
+
+    python bench_memory.py --users 2000 --submissions 50000 --orders 5000
+"""
+import argparse
+import gc
+import json
+import random
+import tracemalloc
+from datetime import datetime, timedelta
+
+import bot
+
+
+def synthetic_data(n_users, n_submissions, n_orders, n_tasks=40, n_products=15, seed=1, legacy=False):
+    """Данные в том же JSON-формате, что пишет бот.
+
+    legacy=True - старый формат с копиями пользователя/задания/товара
+    в каждой отправке и заказе (до migrate_data.py normalize).
+    """
+    rnd = random.Random(seed)
+    start = datetime(2025, 9, 1)
+    users = {}
+    for i in range(n_users):
+        telegram_id = str(100_000_000 + i)
+        users[telegram_id] = {
+            'first_name': f"Имя{i}",
+            'surname': f"Фамилия{i}",
+            'name': f"Имя{i} Фамилия{i}",
+            'unique_id': i + 1,
+            'points': rnd.randint(0, 500),
+            'total_earned': rnd.randint(500, 2000),
+            'registered_at': (start + timedelta(minutes=i)).isoformat(),
+        }
+    user_ids = list(users)
+    tasks = {
+        str(t): {
+            'title': f"Задание {t}",
+            'description': f"Описание задания номер {t}: " + "сделайте фото и расскажите об этом " * 3,
+            'points': rnd.choice([5, 10, 20, 50]),
+            'type': rnd.choice(['once', 'daily']),
+        }
+        for t in range(1, n_tasks + 1)
+    }
+    submissions = {}
+    for s in range(1, n_submissions + 1):
+        user_id = rnd.choice(user_ids)
+        task_id = str(rnd.randint(1, n_tasks))
+        task = tasks[task_id]
+        user = users[user_id]
+        text = f"Ответ {s}"
+        submission = {
+            'user_id': user_id,
+            'task_id': task_id,
+            'task_points': task['points'],
+            'content_type': 'photo',
+            'files': [{'type': 'photo', 'file_id': f"AgACAgIAAxkBAAI{s:012d}", 'caption': ''}],
+            'text_content': text,
+            'submission_time': (start + timedelta(seconds=37 * s)).isoformat(),
+            'status': rnd.choice(['pending', 'approved', 'approved', 'rejected']),
+        }
+        if legacy:
+            submission.update({
+                'user_name': f"{user['first_name']} {user['surname']}",
+                'user_unique_id': user['unique_id'],
+                'task_title': task['title'],
+                'task_description': task['description'],
+                'task_type': task['type'],
+                'content': text,
+            })
+        submissions[str(s)] = submission
+    orders = {}
+    for o in range(1, n_orders + 1):
+        user_id = rnd.choice(user_ids)
+        product_id = str(rnd.randint(1, n_products))
+        order = {
+            'user_id': user_id,
+            'product_id': product_id,
+            'price': rnd.randint(10, 100),
+            'order_time': (start + timedelta(minutes=7 * o)).isoformat(),
+            'status': 'completed',
+        }
+        if legacy:
+            order.update({
+                'user_name': users[user_id]['name'],
+                'user_unique_id': users[user_id]['unique_id'],
+                'product_name': f"Товар {product_id}",
+                'product_description': f"Описание товара {product_id}, очень подробное и длинное",
+            })
+        orders[str(o)] = order
+    return {'users': users, 'submissions': submissions, 'orders': orders}
+
+
+def measure(build):
+    """Память (байт), удерживаемая результатом build()"""
+    gc.collect()
+    tracemalloc.start()
+    result = build()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, result
+
+
+RECORD_CLASSES = {
+    'users': bot.UserRecord,
+    'submissions': bot.SubmissionRecord,
+    'orders': bot.OrderRecord,
+}
+
+
+def main(args):
+    data = synthetic_data(args.users, args.submissions, args.orders, legacy=args.legacy)
+    print(f"{'коллекция':<14}{'записей':>10}{'dict, КБ':>12}{'records, КБ':>14}{'экономия':>10}")
+    for name, record_class in RECORD_CLASSES.items():
+        # Каждая сторона разбирает JSON заново, как при load_data()
+        raw = json.dumps(data[name], ensure_ascii=False)
+        dict_size, dicts = measure(lambda: json.loads(raw))
+        record_size, records = measure(lambda: bot.records_from_json(json.loads(raw), record_class))
+        assert bot.records_to_json(records) == dicts, f"{name}: преобразование с потерями"
+        saving = 1 - record_size / dict_size if dict_size else 0
+        print(
+            f"{name:<14}{len(dicts):>10}{dict_size / 1024:>12.0f}"
+            f"{record_size / 1024:>14.0f}{saving:>10.0%}"
+        )
+        del dicts, records
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарк памяти записей бота")
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--submissions', type=int, default=30000)
+    parser.add_argument('--orders', type=int, default=5000)
+    parser.add_argument('--legacy', action='store_true', help="старый денормализованный формат записей")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -1,3 +1,6 @@
+import time
+# Отметка начала импорта модуля для отчета о запуске (StartupReport)
+IMPORT_STARTED = time.perf_counter()
 import logging
 from telegram import Update, ReplyKeyboardMarkup, KeyboardButton, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import (
@@ -7,18 +10,290 @@ from telegram.ext import (
     ConversationHandler,
     ContextTypes,
     filters,
-    CallbackQueryHandler
+    CallbackQueryHandler,
+    TypeHandler,
+    ApplicationHandlerStop
 )
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
+import abc
+import asyncio
+import atexit
+import contextvars
+import csv
+import functools
+import gc
+import gzip
+import hashlib
+import heapq
+import html
+import io
 import json
+import logging.handlers
+import math
 import os
-from datetime import datetime
+import pickle
+import queue
+import random
+import re
+import signal
+import struct
+import sqlite3
+import sys
+import tempfile
+import threading
+from collections import Counter, OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from types import MappingProxyType
+
+IMPORT_FINISHED = time.perf_counter()
+
+# Настройка логирования: записи уходят в очередь, а в поток вывода их пишет
+# отдельный поток QueueListener, чтобы ввод-вывод не блокировал event loop
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json')  # json или text
+# Доля сохраняемых INFO/DEBUG записей для отдельных логгеров: "логгер=доля,..."
+LOG_SAMPLING = os.environ.get('LOG_SAMPLING', 'bot.storage=0.01,bot.handlers=0.1,httpx=0.01,apscheduler=0.01')
+# Обработчики медленнее этого порога логируются всегда (уровень WARNING)
+SLOW_HANDLER_MS = float(os.environ.get('SLOW_HANDLER_MS', '500'))
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
-)
 logger = logging.getLogger(__name__)
+storage_logger = logging.getLogger('bot.storage')
+handler_logger = logging.getLogger('bot.handlers')
+
+# Контекст текущего обработчика для структурированных логов
+current_handler = contextvars.ContextVar('current_handler', default=None)
+current_user_id = contextvars.ContextVar('current_user_id', default=None)
+# Сообщество, которое обслуживает текущий обработчик или задачу (Tenant)
+current_tenant = contextvars.ContextVar('current_tenant', default=None)
+
+class ContextFilter(logging.Filter):
+    """Добавляет в запись сообщество, имя обработчика и ID пользователя из контекста"""
+
+    def filter(self, record):
+        if not hasattr(record, 'tenant'):
+            tenant = current_tenant.get()
+            record.tenant = tenant.name if tenant is not None else None
+        if not hasattr(record, 'handler'):
+            record.handler = current_handler.get()
+        if not hasattr(record, 'user_id'):
+            record.user_id = current_user_id.get()
+        return True
+
+class SamplingFilter(logging.Filter):
+    """Сэмплирование записей уровня INFO и ниже по имени логгера"""
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno > logging.INFO:
+            return True
+        rate = self.rates.get(record.name)
+        if rate is None:
+            return True
+        return random.random() < rate
+
+class JsonFormatter(logging.Formatter):
+    """Форматирование записи в одну строку JSON"""
+
+    def format(self, record):
+        entry = {
+            'time': datetime.fromtimestamp(record.created).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key in ('tenant', 'handler', 'user_id', 'duration_ms'):
+            value = getattr(record, key, None)
+            if value is not None:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+def parse_sampling(spec):
+    """Разбор строки вида "bot.storage=0.01,httpx=0.1" """
+    rates = {}
+    for item in spec.split(','):
+        name, _, rate = item.partition('=')
+        if name.strip() and rate.strip():
+            rates[name.strip()] = float(rate)
+    return rates
+
+def setup_logging():
+    """Неблокирующий конвейер логирования: QueueHandler -> QueueListener -> stderr"""
+    log_queue = queue.SimpleQueue()
+    queue_handler = logging.handlers.QueueHandler(log_queue)
+    # Фильтры работают в потоке, создавшем запись: там доступны contextvars,
+    # а отброшенные записи даже не попадают в очередь
+    queue_handler.addFilter(ContextFilter())
+    queue_handler.addFilter(SamplingFilter(parse_sampling(LOG_SAMPLING)))
+
+    stream_handler = logging.StreamHandler()
+    if LOG_FORMAT == 'json':
+        stream_handler.setFormatter(JsonFormatter())
+    else:
+        stream_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+
+    root = logging.getLogger()
+    root.handlers = [queue_handler]
+    root.setLevel(LOG_LEVEL)
+
+    listener = logging.handlers.QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+def log_timing(callback):
+    """Обертка обработчика: контекст для логов, сообщество приложения и время выполнения"""
+    name = getattr(callback, '__name__', None) or repr(callback)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        user = getattr(update, 'effective_user', None)
+        tenant = context.bot_data['tenant']
+        handler_token = current_handler.set(name)
+        user_token = current_user_id.set(user.id if user else None)
+        started = time.perf_counter()
+        with using_tenant(tenant):
+            try:
+                return await callback(update, context)
+            finally:
+                duration = time.perf_counter() - started
+                metrics.observe_handler(tenant.name, name, duration)
+                duration_ms = round(duration * 1000, 2)
+                level = logging.WARNING if duration_ms >= SLOW_HANDLER_MS else logging.INFO
+                handler_logger.log(level, "Обработчик выполнен", extra={'duration_ms': duration_ms})
+                current_handler.reset(handler_token)
+                current_user_id.reset(user_token)
+
+    return wrapper
+
+def tenant_job(callback):
+    """Обертка задачи job_queue: на время ее выполнения текущее сообщество - сообщество приложения"""
+    @functools.wraps(callback)
+    async def wrapper(context):
+        with using_tenant(context.bot_data['tenant']):
+            return await callback(context)
+
+    return wrapper
+
+def instrument_handlers(application):
+    """Оборачивает колбэки всех зарегистрированных обработчиков в log_timing"""
+    def instrument(handler):
+        if isinstance(handler, ConversationHandler):
+            for nested in handler.entry_points + handler.fallbacks:
+                instrument(nested)
+            for state_handlers in handler.states.values():
+                for nested in state_handlers:
+                    instrument(nested)
+        elif not getattr(handler.callback, '__wrapped__', None):
+            handler.callback = log_timing(handler.callback)
+
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            instrument(handler)
+
+class StartupReport:
+    """Сколько времени заняли этапы запуска: импорт, загрузка данных, индексы, обработчики"""
+
+    def __init__(self):
+        self.phases = {'импорт': IMPORT_FINISHED - IMPORT_STARTED}
+
+    def record(self, name, started):
+        """Этап name, начатый в момент started (time.perf_counter()) и закончившийся сейчас"""
+        self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - started
+
+    @contextmanager
+    def phase(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, started)
+
+    def log(self, tenants):
+        parts = ", ".join(f"{name} {seconds * 1000:.0f} мс" for name, seconds in self.phases.items())
+        total = sum(self.phases.values())
+        storages = "; ".join(f"{tenant.name}: {tenant.storage.describe()}" for tenant in tenants)
+        logger.info(f"Запуск за {total * 1000:.0f} мс: {parts}; хранилища: {storages}")
+
+startup_report = StartupReport()
+
+class Metrics:
+    """Метрики процесса для эндпоинта /metrics (формат Prometheus), общие для всех сообществ"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self.tenants = []
+        self.handler_calls = Counter()  # (сообщество, обработчик) -> число вызовов
+        self.handler_seconds = Counter()  # (сообщество, обработчик) -> суммарное время, с
+        self.user_data_bytes = {}  # (сообщество, диалог) -> байт в context.user_data (report_user_data)
+
+    def observe_handler(self, tenant, handler, seconds):
+        self.handler_calls[tenant, handler] += 1
+        self.handler_seconds[tenant, handler] += seconds
+
+    def render(self):
+        def labels(**values):
+            escaped = (
+                f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                for key, value in values.items()
+            )
+            return "{" + ",".join(escaped) + "}"
+
+        lines = [
+            "# TYPE bot_uptime_seconds gauge",
+            f"bot_uptime_seconds {time.time() - self.started_at:.3f}",
+            "# TYPE bot_tenants gauge",
+            f"bot_tenants {len(self.tenants)}",
+            "# TYPE bot_handler_calls_total counter",
+        ]
+        lines.extend(
+            f"bot_handler_calls_total{labels(tenant=tenant, handler=handler)} {count}"
+            for (tenant, handler), count in sorted(self.handler_calls.items())
+        )
+        lines.append("# TYPE bot_handler_seconds_total counter")
+        lines.extend(
+            f"bot_handler_seconds_total{labels(tenant=tenant, handler=handler)} {seconds:.6f}"
+            for (tenant, handler), seconds in sorted(self.handler_seconds.items())
+        )
+        lines.append("# TYPE bot_user_data_bytes gauge")
+        lines.extend(
+            f"bot_user_data_bytes{labels(tenant=tenant, flow=flow)} {size}"
+            for (tenant, flow), size in sorted(self.user_data_bytes.items())
+        )
+        return "\n".join(lines) + "\n"
+
+metrics = Metrics()
+
+async def serve_metrics(reader, writer):
+    """Минимальный HTTP-ответ на GET /metrics для сборщика метрик"""
+    try:
+        request_line = await reader.readline()
+        # Заголовки запроса не нужны, но их нужно дочитать до пустой строки
+        while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+            pass
+        parts = request_line.split()
+        if len(parts) >= 2 and parts[1] == b'/metrics':
+            status, body = "200 OK", metrics.render().encode('utf-8')
+        else:
+            status, body = "404 Not Found", b"not found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\n"
+            f"Content-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(body)}\r\n"
+            f"Connection: close\r\n\r\n".encode('ascii') + body
+        )
+        await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
 
 # Состояния для ConversationHandler
 WAITING_FOR_FIRST_NAME = 1
@@ -44,37 +319,1149 @@ ADMIN_SET_PRODUCT_QUANTITY = 7
 ADMIN_CREATE_TASK_TITLE = 8
 ADMIN_CREATE_TASK_TYPE = 9
 USER_SEND_MORE_FILES = 103
-
-# Файлы для хранения данных
+ADMIN_BULK_POINTS_INPUT = 1
+ADMIN_BULK_POINTS_CONFIRM = 2
+ADMIN_CREATE_TASK_RULES = 10
+
+# Данные хранятся в хранилище (Storage), которое выбирается при сборке приложения:
+# json - файлы в DATA_DIR, memory - в памяти процесса (для тестов и бенчмарков),
+# sqlite - одна база SQLITE_PATH
+STORAGE_BACKEND = os.environ.get('STORAGE_BACKEND', 'json')
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-DATA_FILE = os.path.join(BASE_DIR, 'users_data.json')
-TASKS_FILE = os.path.join(BASE_DIR, 'tasks_data.json')
-SUBMISSIONS_FILE = os.path.join(BASE_DIR, 'submissions_data.json')
-PRODUCTS_FILE = os.path.join(BASE_DIR, 'products_data.json')
-ORDERS_FILE = os.path.join(BASE_DIR, 'orders_data.json')
+# Каталог с данными можно переопределить (например, для тестовых запусков)
+DATA_DIR = os.environ.get('BOT_DATA_DIR', BASE_DIR)
+# По умолчанию - bot_data.sqlite3 в каталоге данных сообщества
+SQLITE_PATH = os.environ.get('SQLITE_PATH')
+SQLITE_FILE = 'bot_data.sqlite3'
+
+# Имена документов хранилища (для json - имена файлов в DATA_DIR)
+DATA_FILE = 'users_data.json'
+TASKS_FILE = 'tasks_data.json'
+SUBMISSIONS_FILE = 'submissions_data.json'
+PRODUCTS_FILE = 'products_data.json'
+ORDERS_FILE = 'orders_data.json'
+# Подписки на напоминания о снова доступных ежедневных заданиях
+REMINDERS_FILE = 'reminders_data.json'
+# Почасовые и дневные счетчики событий для статистики
+STATS_FILE = 'stats_rollups.json'
+# Индекс file_unique_id -> ID отправок для поиска повторно отправленных файлов
+FILE_INDEX_FILE = 'file_index.json'
+# Журнал незавершенной транзакции (UnitOfWork) хранилища json
+JOURNAL_FILE = 'transaction.journal'
+# Новые версии документов транзакции до замены ими файлов
+TRANSACTION_SUFFIX = '.txn'
+# Сколько раз сразу повторять замену файлов по записанному журналу транзакции
+JOURNAL_APPLY_ATTEMPTS = 3
+# Журнал начислений и списаний баллов (JSON Lines, только дописывается) и индекс по пользователям
+POINTS_LEDGER_FILE = 'points_ledger.jsonl'
+POINTS_LEDGER_INDEX_FILE = 'points_ledger.index.json'
+# Снимки данных: каталог хранилища с манифестом и сжатыми версиями документов (blobs)
+SNAPSHOT_DIR_NAME = 'snapshots'
+SNAPSHOT_MANIFEST_NAME = 'manifest.json'
+SNAPSHOT_BLOB_DIR_NAME = 'blobs'
+SNAPSHOT_FILES = (
+    DATA_FILE, TASKS_FILE, SUBMISSIONS_FILE, PRODUCTS_FILE, ORDERS_FILE,
+    REMINDERS_FILE, STATS_FILE, FILE_INDEX_FILE, POINTS_LEDGER_FILE,
+)
+# Двоичные копии файлов коллекций (pickle, протокол 5) рядом с JSON: разбираются
+# в разы быстрее, чем JSON с отступами, и используются, пока JSON не изменился
+BINARY_CACHE = os.environ.get('BINARY_CACHE', '1') != '0'
+BINARY_CACHE_SUFFIX = '.bin'
 
 # ID администратора (замените на ваши Telegram ID)
 ADMIN_IDS = [424081501, 421897893]  # Два администратора
 
+# Подключение к Bot API (переопределяется через окружение, например для fake_bot_api.py)
+# Токен бота задается только через окружение (или BOT_TENANTS_FILE), в коде его нет
+BOT_TOKEN = os.environ.get('BOT_TOKEN', '')
+# Формат как у PTB: токен дописывается в конец, например http://127.0.0.1:8081/bot
+BOT_API_BASE_URL = os.environ.get('BOT_API_BASE_URL')
+BOT_API_BASE_FILE_URL = os.environ.get('BOT_API_BASE_FILE_URL')
+
+# Несколько сообществ (учебных групп) в одном процессе: JSON-список
+# [{"name", "token", "admin_ids", "data_dir", "storage", "api_base_url", "api_base_file_url"}, ...];
+# без файла работает одно сообщество с настройками выше
+BOT_TENANTS_FILE = os.environ.get('BOT_TENANTS_FILE')
+# Общий для всех сообществ пул соединений к Bot API и пул потоков для ввода-вывода
+HTTP_POOL_SIZE = int(os.environ.get('HTTP_POOL_SIZE', '256'))
+IO_THREADS = int(os.environ.get('IO_THREADS', '8'))
+# Порт HTTP-эндпоинта /metrics (формат Prometheus); 0 - не запускать
+METRICS_PORT = int(os.environ.get('METRICS_PORT', '0'))
+METRICS_HOST = os.environ.get('METRICS_HOST', '127.0.0.1')
+
+# Повторно ежедневное задание можно выполнить через сутки после отправки
+DAILY_COOLDOWN_SECONDS = 24 * 3600
+# Как часто проверять наступившие сроки и рассылать напоминания
+REMINDER_INTERVAL_SECONDS = float(os.environ.get('REMINDER_INTERVAL_SECONDS', '60'))
+# Массовые рассылки идут пачками, чтобы не упираться в лимит Bot API (~30 сообщений/с)
+SEND_BATCH_SIZE = 25
+SEND_BATCH_PAUSE_SECONDS = 1.0
+# Массовая проверка: отправок на странице и кнопок в списках фильтров
+BULK_REVIEW_PAGE_SIZE = 8
+BULK_REVIEW_FILTER_LIMIT = 15
+# Проверка несколькими администраторами: сколько отправок закрепляется за
+# администратором за раз и на сколько секунд (потом они возвращаются в очередь)
+REVIEW_CLAIM_SIZE = int(os.environ.get('REVIEW_CLAIM_SIZE', '10'))
+REVIEW_LEASE_SECONDS = float(os.environ.get('REVIEW_LEASE_SECONDS', '900'))
+# На сколько секунд товар ограниченного количества бронируется за покупателем,
+# открывшим подтверждение покупки
+STOCK_RESERVATION_SECONDS = float(os.environ.get('STOCK_RESERVATION_SECONDS', '300'))
+# Флеш-распродажи: сколько секунд копятся заявки на покупку перед решением пакета
+# и сколько заявок решается и записывается одной транзакцией
+FLASH_SALE_BATCH_SECONDS = float(os.environ.get('FLASH_SALE_BATCH_SECONDS', '0.05'))
+FLASH_SALE_BATCH_SIZE = int(os.environ.get('FLASH_SALE_BATCH_SIZE', '100'))
+# Сколько недавних решений по отправкам помнить для ответа на повторные нажатия
+IDEMPOTENCY_CACHE_SIZE = 4096
+# Максимальный размер CSV со списком начислений
+BULK_POINTS_MAX_FILE_BYTES = 1024 * 1024
+# Снимки данных по расписанию и сколько дней их хранить
+SNAPSHOT_INTERVAL_SECONDS = float(os.environ.get('SNAPSHOT_INTERVAL_SECONDS', '3600'))
+SNAPSHOT_RETENTION_DAYS = float(os.environ.get('SNAPSHOT_RETENTION_DAYS', '14'))
+SNAPSHOT_REASON_TITLES = {
+    'schedule': "по расписанию",
+    'manual': "вручную",
+    'reset': "перед сбросом",
+    'restore': "перед восстановлением",
+}
+# Сколько последних операций с баллами показывать в истории
+POINTS_HISTORY_LIMIT = 20
+LEDGER_SOURCE_TITLES = {
+    'opening': "Остаток на момент запуска журнала",
+    'submission': "Задание принято",
+    'auto_review': "Задание принято автоматически",
+    'admin': "Начисление администратора",
+    'bulk_points': "Начисление списком",
+    'purchase': "Покупка",
+}
+# Автопроверка: ответы длиннее этого всегда уходят на ручную проверку
+AUTO_REVIEW_MAX_TEXT_LENGTH = 1000
+# Ограничение частоты апдейтов от пользователя: "вид=токенов_в_секунду:запас,..."
+RATE_LIMITS = os.environ.get('RATE_LIMITS', 'menu=1:10,upload=1:15,callback=2:10')
+RATE_KIND_TITLES = {
+    'menu': "💬 Сообщения и кнопки меню",
+    'upload': "📎 Файлы",
+    'callback': "🔘 Inline-кнопки",
+}
+# Сколько корзин держать в памяти, прежде чем удалять уже пополнившиеся
+RATE_LIMIT_MAX_BUCKETS = 10000
+# Ограничения одной отправки задания
+MAX_FILES_PER_SUBMISSION = int(os.environ.get('MAX_FILES_PER_SUBMISSION', '10'))
+MAX_SUBMISSION_TEXT_LENGTH = 4000
+
+# События, по которым ведутся счетчики статистики (StatsRollup)
+STAT_EVENTS = (
+    'registrations', 'submissions', 'approvals', 'rejections',
+    'points_credited', 'points_spent', 'orders',
+)
+STAT_EVENT_TITLES = {
+    'registrations': "👥 Регистраций",
+    'submissions': "📨 Отправок",
+    'approvals': "✅ Принято",
+    'rejections': "❌ Отклонено",
+    'points_credited': "⭐ Начислено баллов",
+    'points_spent': "💳 Потрачено баллов",
+    'orders': "🛒 Покупок",
+}
+# Как часто сбрасывать счетчики на диск и сколько хранить почасовые корзины
+STATS_FLUSH_INTERVAL_SECONDS = float(os.environ.get('STATS_FLUSH_INTERVAL_SECONDS', '60'))
+STATS_HOURLY_RETENTION_DAYS = 14
+
+# Незавершенный диалог (ConversationHandler) завершается после стольких секунд
+# бездействия, а его данные в context.user_data освобождаются; 0 - без тайм-аута
+CONVERSATION_TIMEOUT_SECONDS = float(os.environ.get('CONVERSATION_TIMEOUT_SECONDS', '900'))
+# Тайм-ауты отдельных диалогов: "имя=секунды,...", например "shop=300,task_submission=3600"
+CONVERSATION_TIMEOUTS = os.environ.get('CONVERSATION_TIMEOUTS', '')
+# Ключи context.user_data, которые заполняет каждый диалог: освобождаются при его тайм-ауте
+CONVERSATION_USER_DATA = {
+    'registration': ('first_name',),
+    'product_create': ('product_name', 'product_description', 'product_price'),
+    'shop': ('selected_product', 'selected_product_id'),
+    'points': ('selected_user', 'selected_user_id'),
+    'bulk_points': ('bulk_awards',),
+    'task_create': ('task_title', 'task_description', 'task_points', 'task_type'),
+    'fix_id': ('selected_user', 'selected_user_id'),
+    'reset': (),
+    'review': (),
+    'task_submission': ('selected_task', 'files', 'text_content'),
+}
+# Диалоги администраторов: после тайм-аута возвращается клавиатура панели администратора
+ADMIN_CONVERSATIONS = {'product_create', 'points', 'bulk_points', 'task_create', 'fix_id', 'reset', 'review'}
+# Ключи context.user_data вне диалогов (для отчета о памяти)
+USER_DATA_FLOWS = {
+    'bulk_review': ('bulk_review',),
+}
+# Как часто отчитываться о памяти context.user_data и освобождать пустые записи пользователей
+USER_DATA_REPORT_INTERVAL_SECONDS = float(os.environ.get('USER_DATA_REPORT_INTERVAL_SECONDS', '600'))
+
+class Record:
+    """Компактная запись: известные поля хранятся в __slots__, прочие ключи - в extra.
+
+    Неустановленное поле ведет себя как отсутствующий ключ словаря
+    (AttributeError), поэтому to_dict(from_dict(d)) == d без потерь.
+    """
+    __slots__ = ('extra',)
+    FIELDS = ()
+    # Строковые поля с большим числом повторов, которые интернируются при загрузке
+    INTERNED = ()
+
+    def __init__(self, **fields):
+        self.extra = None
+        for key, value in fields.items():
+            self._set(key, value)
+
+    def _set(self, key, value):
+        if key in self.FIELDS:
+            if key in self.INTERNED and isinstance(value, str):
+                value = sys.intern(value)
+            setattr(self, key, value)
+        else:
+            if self.extra is None:
+                self.extra = {}
+            self.extra[key] = value
+
+    @classmethod
+    def from_dict(cls, data):
+        record = cls.__new__(cls)
+        record.extra = None
+        for key, value in data.items():
+            record._set(key, value)
+        return record
+
+    def to_dict(self):
+        data = {}
+        for key in self.FIELDS:
+            try:
+                data[key] = getattr(self, key)
+            except AttributeError:
+                continue
+        if self.extra:
+            data.update(self.extra)
+        return data
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self.to_dict()!r})"
+
+class UserRecord(Record):
+    """Пользователь"""
+    FIELDS = ('first_name', 'surname', 'name', 'unique_id', 'points', 'total_earned', 'registered_at')
+    __slots__ = FIELDS
+
+class SubmissionRecord(Record):
+    """Отправка задания на проверку.
+
+    Пользователь и задание хранятся ссылками (user_id, task_id); task_points -
+    снимок награды на момент отправки, именно столько начисляется при принятии.
+    """
+    FIELDS = (
+        'user_id', 'task_id', 'task_points', 'content_type', 'content', 'file_id', 'files',
+        'text_content', 'submission_time', 'status',
+    )
+    INTERNED = ('user_id', 'task_id', 'content_type', 'status')
+    __slots__ = FIELDS
+
+class OrderRecord(Record):
+    """Заказ в магазине: ссылки на пользователя и товар и снимок названия и уплаченной цены.
+
+    Название хранится в заказе, потому что товар могут удалить, а история
+    покупок и выгрузка должны показывать, что было куплено.
+    """
+    FIELDS = ('user_id', 'product_id', 'product_name', 'price', 'order_time', 'status')
+    INTERNED = ('user_id', 'product_id', 'status')
+    __slots__ = FIELDS
+
+def records_from_json(data, record_class):
+    """Словарь {id: dict} из JSON -> {id: запись}"""
+    return {key: record_class.from_dict(value) for key, value in data.items()}
+
+def records_to_json(records):
+    """{id: запись} -> словарь {id: dict} для JSON"""
+    return {key: record.to_dict() for key, record in records.items()}
+
+# Копии данных пользователя, задания и товара, которые раньше дублировались
+# в каждой отправке и каждом заказе; теперь они берутся по ID. Название товара
+# (как и цена) остается в заказе: товар может быть удален
+DENORMALIZED_SUBMISSION_FIELDS = ('user_name', 'user_unique_id', 'task_title', 'task_description', 'task_type')
+DENORMALIZED_ORDER_FIELDS = ('user_name', 'user_unique_id', 'product_description')
+
+def normalize_submission(data):
+    """Убирает из отправки (в формате JSON) продублированные поля"""
+    normalized = {k: v for k, v in data.items() if k not in DENORMALIZED_SUBMISSION_FIELDS}
+    # content в многофайловых отправках всегда совпадал с text_content
+    if 'text_content' in normalized and normalized.get('content') == normalized['text_content']:
+        del normalized['content']
+    return normalized
+
+def normalize_order(data):
+    """Убирает из заказа (в формате JSON) продублированные поля"""
+    return {k: v for k, v in data.items() if k not in DENORMALIZED_ORDER_FIELDS}
+
+def upgrade_user_v1(data):
+    """Пользователи, зарегистрированные до появления total_earned и name"""
+    user = dict(data)
+    user.setdefault('points', 0)
+    # Сколько было заработано до учета, неизвестно - считаем, что не меньше текущих баллов
+    user.setdefault('total_earned', max(user['points'], 0))
+    user.setdefault('name', f"{user.get('first_name', '')} {user.get('surname', '')}".strip())
+    user.setdefault('registered_at', None)
+    return user
+
+def upgrade_task_v1(data):
+    """Задания до появления названий и ежедневного типа"""
+    task = dict(data)
+    task.setdefault('title', "Без названия")
+    task.setdefault('type', 'once')
+    task.setdefault('created_at', None)
+    return task
+
+def upgrade_submission_v1(data):
+    """Отправки с копиями данных и с одним файлом в file_id вместо списка files"""
+    submission = normalize_submission(data)
+    if 'files' not in submission:
+        file_id = submission.get('file_id')
+        submission['files'] = [{'type': submission.get('content_type'), 'file_id': file_id, 'caption': ''}] if file_id else []
+    if 'text_content' not in submission:
+        submission['text_content'] = submission.get('content', '') if submission.get('content_type') == 'text' else ''
+    return submission
+
+def upgrade_product_v1(data):
+    """Товары до появления ограничения количества"""
+    product = dict(data)
+    product.setdefault('quantity', 0)
+    product.setdefault('sold', 0)
+    product.setdefault('created_at', None)
+    if product.get('description') is None:
+        product['description'] = ''
+    return product
+
+def upgrade_product_v2(data):
+    """Товары до появления флеш-распродаж"""
+    product = dict(data)
+    product.setdefault('flash_sale', False)
+    return product
+
+def upgrade_order_v1(data):
+    return normalize_order(data)
+
+# Схемы файлов коллекций: имя файла -> шаги обновления записи, шаг i переводит
+# запись из версии i в версию i + 1. Номер версии хранится в самом файле под
+# ключом SCHEMA_KEY; файл без него - версии 0, до введения схем.
+SCHEMA_KEY = '_schema'
+SCHEMA_HEADER_RE = re.compile(r'\{\s*"_schema":\s*(\d+)')
+SCHEMA_UPGRADES = {
+    DATA_FILE: (upgrade_user_v1,),
+    TASKS_FILE: (upgrade_task_v1,),
+    SUBMISSIONS_FILE: (upgrade_submission_v1,),
+    PRODUCTS_FILE: (upgrade_product_v1, upgrade_product_v2),
+    ORDERS_FILE: (upgrade_order_v1,),
+}
+
+def schema_steps(filename):
+    """Шаги обновления для файла; None, если у файла нет схемы"""
+    return SCHEMA_UPGRADES.get(os.path.basename(filename))
+
+def schema_version(filename):
+    """Текущая версия схемы файла коллекции"""
+    return len(schema_steps(filename) or ())
+
+def upgrade_record(record, version, steps):
+    """Запись (в формате JSON) из версии version в текущую"""
+    for step in steps[version:]:
+        record = step(record)
+    return record
+
+def upgrade_collection(data, filename):
+    """Разобранный файл коллекции -> записи текущей версии схемы, без SCHEMA_KEY.
+
+    Файлы обновляются на диске при запуске (upgrade_data_files) и утилитой
+    migrate_data.py schema, здесь досматриваются только старые версии,
+    пришедшие в обход них (например, из восстановленного снимка).
+    """
+    steps = schema_steps(filename)
+    if steps is None:
+        return data
+    version = data.pop(SCHEMA_KEY, 0)
+    if version < len(steps):
+        data = {key: upgrade_record(record, version, steps) for key, record in data.items()}
+    return data
+
+def stamp_schema(data, filename):
+    """Данные для записи в файл: у коллекций - с номером версии схемы первым ключом"""
+    if schema_steps(filename) is None:
+        return data
+    return {SCHEMA_KEY: schema_version(filename), **data}
+
+def user_display_name(users, user_id):
+    """Имя пользователя по его Telegram ID"""
+    user = users.get(user_id)
+    if user is None:
+        return f"Удаленный пользователь ({user_id})"
+    return f"{user.first_name} {user.surname}"
+
+def user_display_id(users, user_id):
+    """Уникальный ID пользователя по его Telegram ID"""
+    user = users.get(user_id)
+    return user.unique_id if user is not None else "?"
+
+def task_display_title(tasks, task_id):
+    """Название задания по его ID"""
+    task = tasks.get(task_id)
+    return task['title'] if task is not None else "Удаленное задание"
+
+def task_display_description(tasks, task_id):
+    """Описание задания по его ID"""
+    task = tasks.get(task_id)
+    return task['description'] if task is not None else f"Удаленное задание #{task_id}"
+
+def normalize_answer(text):
+    """Текст для сравнения с правилами: без регистра, ё -> е, пробелы схлопнуты"""
+    return ' '.join(text.casefold().replace('ё', 'е').split())
+
+def answer_words(text):
+    return set(re.findall(r'\w+', normalize_answer(text)))
+
+class AutoReviewRules:
+    """Скомпилированные правила автопроверки текстового ответа на задание.
+
+    Ответ принимается, если он совпадает с одним из точных ответов, целиком
+    подходит под одно из регулярных выражений или содержит все ключевые слова -
+    и при этом не длиннее max_length. Одного ограничения длины для принятия мало.
+    """
+    __slots__ = ('answers', 'patterns', 'keywords', 'max_length')
+
+    def __init__(self, answers=(), patterns=(), keywords=(), max_length=None):
+        self.answers = frozenset(normalize_answer(answer) for answer in answers)
+        self.patterns = tuple(re.compile(pattern, re.IGNORECASE) for pattern in patterns)
+        self.keywords = frozenset(keywords)
+        self.max_length = max_length
+
+    def matches(self, text):
+        text = text.strip()
+        if not text or len(text) > min(self.max_length or AUTO_REVIEW_MAX_TEXT_LENGTH, AUTO_REVIEW_MAX_TEXT_LENGTH):
+            return False
+        if normalize_answer(text) in self.answers:
+            return True
+        if any(pattern.fullmatch(text) for pattern in self.patterns):
+            return True
+        return bool(self.keywords) and self.keywords <= answer_words(text)
+
+@functools.lru_cache(maxsize=256)
+def compile_auto_review(answers, patterns, keywords, max_length):
+    return AutoReviewRules(answers, patterns, keywords, max_length)
+
+def auto_review_rules(task):
+    """Правила автопроверки задания (компилируются один раз) или None"""
+    rules = task.get('auto_review')
+    if not rules:
+        return None
+    return compile_auto_review(
+        tuple(rules.get('answers', ())), tuple(rules.get('patterns', ())),
+        tuple(rules.get('keywords', ())), rules.get('max_length'),
+    )
+
+def parse_auto_review_rules(text):
+    """Правила из сообщения администратора, по одному на строку.
+
+    Возвращает словарь для сохранения в задании; при ошибке - ValueError
+    с понятным администратору текстом.
+    """
+    rules = {}
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        kind, sep, value = line.partition(':')
+        kind = kind.strip().lower()
+        value = value.strip()
+        if not sep or not value:
+            raise ValueError(f"Строка {number}: ожидается «вид: значение»")
+        if kind == 'ответ':
+            rules.setdefault('answers', []).append(value)
+        elif kind == 'regex':
+            try:
+                re.compile(value, re.IGNORECASE)
+            except re.error as e:
+                raise ValueError(f"Строка {number}: ошибка в регулярном выражении ({e})")
+            rules.setdefault('patterns', []).append(value)
+        elif kind == 'слова':
+            words = sorted({word for part in value.split(',') for word in answer_words(part)})
+            if not words:
+                raise ValueError(f"Строка {number}: не найдено ни одного ключевого слова")
+            rules['keywords'] = words
+        elif kind == 'макс':
+            try:
+                max_length = int(value)
+            except ValueError:
+                raise ValueError(f"Строка {number}: длина должна быть целым числом")
+            if max_length <= 0:
+                raise ValueError(f"Строка {number}: длина должна быть положительной")
+            rules['max_length'] = max_length
+        else:
+            raise ValueError(f"Строка {number}: неизвестный вид правила «{kind}»")
+    if not any(key in rules for key in ('answers', 'patterns', 'keywords')):
+        raise ValueError("Нужен хотя бы один ответ, regex или набор ключевых слов")
+    return rules
+
+def describe_auto_review(rules):
+    """Краткое описание правил для сообщений администратору"""
+    parts = []
+    if rules.get('answers'):
+        parts.append(f"ответы: {', '.join(rules['answers'])}")
+    if rules.get('patterns'):
+        parts.append(f"regex: {', '.join(rules['patterns'])}")
+    if rules.get('keywords'):
+        parts.append(f"слова: {', '.join(rules['keywords'])}")
+    if rules.get('max_length'):
+        parts.append(f"до {rules['max_length']} символов")
+    return "; ".join(parts)
+
+def timestamp_of(value):
+    """Момент времени (epoch) из ISO-строки.
+
+    Старые записи хранят время без часового пояса - оно считается локальным,
+    новые пишутся в UTC (utc_now_iso).
+    """
+    return datetime.fromisoformat(value).timestamp()
+
+def utc_now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+def format_local_time(value):
+    """Время записи для показа в сообщениях (в часовом поясе сервера)"""
+    if value is None:
+        return "Неизвестно"
+    try:
+        return datetime.fromisoformat(value).astimezone().strftime('%Y-%m-%d %H:%M')
+    except (TypeError, ValueError):
+        return str(value)[:16]
+
+class CooldownIndex:
+    """Когда задание снова станет доступно пользователю.
+
+    available_at: (user_id, task_id) -> момент (epoch UTC); для выполненного
+    одноразового задания - бесконечность. Сроки ежедневных заданий дублируются
+    в мин-куче: периодическая задача забирает из нее наступившие сроки, удаляет
+    их из индекса и отправляет напоминания подписавшимся (subscribers).
+
+    approved_at и unresolved_at: (user_id, task_id) -> время последней принятой
+    и последней непринятой (на проверке или отклоненной) отправки - по ним
+    автопроверка узнает о неверных попытках без просмотра всех отправок.
+    """
+
+    def __init__(self):
+        self.available_at = {}
+        self.heap = []
+        self.subscribers = set()
+        self.approved_at = {}
+        self.unresolved_at = {}
+
+    @classmethod
+    def build(cls, submissions, tasks, now=None):
+        """Индекс по принятым отправкам (один проход при запуске)"""
+        index = cls()
+        now = time.time() if now is None else now
+        for submission in submissions.values():
+            if submission.status in ('pending', 'rejected'):
+                index.record_attempt(submission.user_id, submission.task_id, timestamp_of(submission.submission_time))
+            if submission.status != 'approved':
+                continue
+            task = tasks.get(submission.task_id)
+            if task is None:
+                continue
+            index.record_approval(
+                submission.user_id, submission.task_id, task['type'],
+                timestamp_of(submission.submission_time), now
+            )
+        return index
+
+    def record_approval(self, user_id, task_id, task_type, submitted_at, now=None):
+        """Учет принятой отправки; пауза ежедневного задания отсчитывается от времени отправки"""
+        key = (user_id, task_id)
+        if submitted_at > self.approved_at.get(key, -math.inf):
+            self.approved_at[key] = submitted_at
+        if task_type == 'once':
+            self.available_at[key] = math.inf
+            return
+        available_at = submitted_at + DAILY_COOLDOWN_SECONDS
+        if available_at <= (time.time() if now is None else now):
+            return
+        if available_at > self.available_at.get(key, 0):
+            self.available_at[key] = available_at
+            heapq.heappush(self.heap, (available_at, user_id, task_id))
+
+    def record_attempt(self, user_id, task_id, submitted_at):
+        """Учет отправки на проверку; отклонение ее не меняет - попытка остается непринятой"""
+        key = (user_id, task_id)
+        if submitted_at > self.unresolved_at.get(key, -math.inf):
+            self.unresolved_at[key] = submitted_at
+
+    def has_unresolved_attempt(self, user_id, task_id):
+        """Есть ли у пользователя отправка задания на проверке или отклоненная после последней принятой.
+
+        Принятие отправки не снимает ее из unresolved_at: все непринятые попытки
+        не позже нее перекрывает approved_at.
+        """
+        key = (user_id, task_id)
+        unresolved_at = self.unresolved_at.get(key)
+        return unresolved_at is not None and unresolved_at > self.approved_at.get(key, -math.inf)
+
+    def seconds_left(self, user_id, task_id, now=None):
+        """0 - задание доступно, math.inf - одноразовое задание уже выполнено"""
+        available_at = self.available_at.get((user_id, task_id))
+        if available_at is None:
+            return 0
+        left = available_at - (time.time() if now is None else now)
+        return left if left > 0 else 0
+
+    def subscribe(self, user_id, task_id, now=None):
+        """Подписка на напоминание; False, если ждать нечего"""
+        left = self.seconds_left(user_id, task_id, now)
+        if left == 0 or left == math.inf:
+            return False
+        self.subscribers.add((user_id, task_id))
+        return True
+
+    def restore_subscribers(self, subscribers, now=None):
+        """Подписки, сохраненные до перезапуска; истекшие за это время срабатывают сразу"""
+        now = time.time() if now is None else now
+        for user_id, task_id in subscribers:
+            key = (user_id, task_id)
+            if self.seconds_left(user_id, task_id, now) == math.inf:
+                continue
+            if key not in self.available_at:
+                self.available_at[key] = now
+                heapq.heappush(self.heap, (now, user_id, task_id))
+            self.subscribers.add(key)
+
+    def pop_due(self, now=None):
+        """Снимает наступившие сроки и возвращает те пары (user_id, task_id), что ждут напоминания"""
+        now = time.time() if now is None else now
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            available_at, user_id, task_id = heapq.heappop(self.heap)
+            key = (user_id, task_id)
+            # Срок мог быть перенесен более поздней отправкой - тогда запись кучи устарела
+            if self.available_at.get(key) != available_at:
+                continue
+            del self.available_at[key]
+            if key in self.subscribers:
+                self.subscribers.discard(key)
+                due.append(key)
+        return due
+
+    def forget_task(self, task_id):
+        """Удаление сроков и подписок удаленного задания: его номер достанется новому заданию"""
+        for key in [key for key in self.available_at if key[1] == task_id]:
+            del self.available_at[key]
+        self.heap = [item for item in self.heap if item[2] != task_id]
+        heapq.heapify(self.heap)
+        self.subscribers = {key for key in self.subscribers if key[1] != task_id}
+        for attempts in (self.approved_at, self.unresolved_at):
+            for key in [key for key in attempts if key[1] == task_id]:
+                del attempts[key]
+
+class StatsRollup:
+    """Счетчики событий по часам и по дням (UTC) для трендов в статистике.
+
+    hourly: "ГГГГ-ММ-ДДTЧЧ" -> {событие: сумма}, daily: "ГГГГ-ММ-ДД" -> {событие: сумма}.
+    Счетчики обновляются по мере событий (record), поэтому сумма за любой
+    период считается по корзинам без просмотра истории пользователей и отправок.
+    Почасовые корзины хранятся STATS_HOURLY_RETENTION_DAYS дней, дневные - всегда.
+    """
+
+    def __init__(self, hourly=None, daily=None):
+        self.hourly = hourly or {}
+        self.daily = daily or {}
+        self.dirty = False
+
+    @classmethod
+    def from_json(cls, data):
+        return cls(data.get('hourly'), data.get('daily'))
+
+    def to_json(self):
+        return {'hourly': self.hourly, 'daily': self.daily}
+
+    def record(self, event, amount=1, when=None):
+        when = datetime.now(timezone.utc) if when is None else when.astimezone(timezone.utc)
+        for buckets, key in ((self.hourly, when.strftime('%Y-%m-%dT%H')), (self.daily, when.strftime('%Y-%m-%d'))):
+            counters = buckets.setdefault(key, {})
+            counters[event] = counters.get(event, 0) + amount
+        self.dirty = True
+
+    @classmethod
+    def backfill(cls, users, submissions, orders):
+        """Первичное заполнение по существующим данным.
+
+        Момент проверки отправки не хранится, поэтому принятия и отклонения
+        относятся ко времени отправки; ручные начисления баллов не восстанавливаются.
+        """
+        rollup = cls()
+        for user in users.values():
+            if user.registered_at:
+                rollup.record('registrations', when=datetime.fromtimestamp(timestamp_of(user.registered_at), timezone.utc))
+        for submission in submissions.values():
+            when = datetime.fromtimestamp(timestamp_of(submission.submission_time), timezone.utc)
+            rollup.record('submissions', when=when)
+            if submission.status == 'approved':
+                rollup.record('approvals', when=when)
+                rollup.record('points_credited', submission.task_points, when=when)
+            elif submission.status == 'rejected':
+                rollup.record('rejections', when=when)
+        for order in orders.values():
+            when = datetime.fromtimestamp(timestamp_of(order.order_time), timezone.utc)
+            rollup.record('orders', when=when)
+            rollup.record('points_spent', order.price, when=when)
+        return rollup
+
+    def prune(self, now=None):
+        """Удаляет почасовые корзины старше срока хранения"""
+        now = datetime.now(timezone.utc) if now is None else now
+        oldest = (now - timedelta(days=STATS_HOURLY_RETENTION_DAYS)).strftime('%Y-%m-%dT%H')
+        for key in [key for key in self.hourly if key < oldest]:
+            del self.hourly[key]
+            self.dirty = True
+
+    def daily_series(self, date_from, date_to):
+        """[(день, счетчики)] за период включительно; дни без событий - пустые словари"""
+        day = date_from
+        series = []
+        while day <= date_to:
+            key = day.strftime('%Y-%m-%d')
+            series.append((key, self.daily.get(key, {})))
+            day += timedelta(days=1)
+        return series
+
+    def totals(self, date_from, date_to):
+        """Суммы событий за период по дневным корзинам"""
+        result = dict.fromkeys(STAT_EVENTS, 0)
+        for _, counters in self.daily_series(date_from, date_to):
+            for event, value in counters.items():
+                result[event] = result.get(event, 0) + value
+        return result
+
+    def last_hours(self, hours, now=None):
+        """Суммы событий за последние hours часов по почасовым корзинам"""
+        now = datetime.now(timezone.utc) if now is None else now
+        result = dict.fromkeys(STAT_EVENTS, 0)
+        for offset in range(hours):
+            counters = self.hourly.get((now - timedelta(hours=offset)).strftime('%Y-%m-%dT%H'), {})
+            for event, value in counters.items():
+                result[event] = result.get(event, 0) + value
+        return result
+
+class IdempotencyCache:
+    """Ограниченный LRU недавно обработанных операций: ключ -> ответ на повтор"""
+
+    def __init__(self, maxsize=IDEMPOTENCY_CACHE_SIZE):
+        self.maxsize = maxsize
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        result = self.entries.get(key)
+        if result is not None:
+            self.entries.move_to_end(key)
+        return result
+
+    def put(self, key, result):
+        self.entries[key] = result
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+
+    def discard(self, key):
+        self.entries.pop(key, None)
+
+    def forget_submissions(self, submission_ids):
+        """Забыть решения по удаленным отправкам: их номера достанутся новым отправкам"""
+        for submission_id in submission_ids:
+            for action in ('approve', 'reject'):
+                self.entries.pop(('submission', submission_id, action), None)
+
+def parse_rate_limits(spec):
+    """Разбор строки вида "menu=1:10,upload=0.5:5" в {вид: (скорость, запас)}"""
+    limits = {}
+    for item in spec.split(','):
+        kind, _, value = item.partition('=')
+        rate, _, burst = value.partition(':')
+        if kind.strip() and rate.strip() and burst.strip():
+            limits[kind.strip()] = (float(rate), float(burst))
+    return limits
+
+def parse_conversation_timeouts(spec):
+    """Разбор строки вида "shop=300,task_submission=3600" в {диалог: секунды}"""
+    timeouts = {}
+    for item in spec.split(','):
+        name, _, seconds = item.partition('=')
+        if not name.strip() or not seconds.strip():
+            continue
+        if name.strip() not in CONVERSATION_USER_DATA:
+            raise ValueError(f"Неизвестный диалог в CONVERSATION_TIMEOUTS: {name.strip()}")
+        timeouts[name.strip()] = float(seconds)
+    return timeouts
+
+def conversation_cleanup(name):
+    """Обработчик тайм-аута диалога name: освобождает его ключи в context.user_data"""
+    keys = CONVERSATION_USER_DATA[name]
+
+    async def cleanup(update, context):
+        released = [key for key in keys if context.user_data.pop(key, None) is not None]
+        logger.info(f"Диалог {name} завершен по тайм-ауту, освобождено: {', '.join(released) or 'ничего'}")
+        # Клавиатура диалога больше не действует - возвращаем обычную
+        if name == 'registration':
+            text, reply_markup = "⌛ Регистрация прервана: долго не было ответа. Начать заново: /start", None
+        elif name in ADMIN_CONVERSATIONS:
+            text, reply_markup = "⌛ Действие отменено: долго не было ответа.", get_admin_keyboard()
+        else:
+            text, reply_markup = "⌛ Действие отменено: долго не было ответа.", get_main_keyboard(update.effective_user.id)
+        try:
+            await context.bot.send_message(update.effective_chat.id, text, reply_markup=reply_markup)
+        except TelegramError as e:
+            logger.warning(f"Не удалось сообщить о тайм-ауте диалога {name}: {e}")
+
+    cleanup.__name__ = f"{name}_timeout"
+    return cleanup
+
+def conversation(name, entry_points, states, fallbacks):
+    """ConversationHandler с тайм-аутом бездействия и освобождением данных диалога в user_data"""
+    timeout = parse_conversation_timeouts(CONVERSATION_TIMEOUTS).get(name, CONVERSATION_TIMEOUT_SECONDS)
+    if timeout > 0:
+        states = {**states, ConversationHandler.TIMEOUT: [TypeHandler(Update, conversation_cleanup(name))]}
+    return ConversationHandler(
+        entry_points=entry_points,
+        states=states,
+        fallbacks=fallbacks,
+        name=name,
+        conversation_timeout=timeout if timeout > 0 else None,
+    )
+
+def user_data_flow(key):
+    """Диалоги (или другие сценарии), которым принадлежит ключ context.user_data"""
+    flows = [
+        name for name, keys in {**CONVERSATION_USER_DATA, **USER_DATA_FLOWS}.items() if key in keys
+    ]
+    return "/".join(flows) or "прочее"
+
+def user_data_size(value):
+    """Примерный размер значения в байтах: по pickle, для объектов без него - sys.getsizeof"""
+    try:
+        return len(pickle.dumps(value, protocol=5))
+    except Exception:
+        return sys.getsizeof(value)
+
+class RateLimiter:
+    """Token bucket на пользователя и вид апдейта (меню, загрузки, inline-кнопки).
+
+    Корзина пополняется со скоростью rate токенов в секунду до burst, каждый
+    апдейт забирает токен; апдейт без токена отбрасывается. Счетчики
+    показывают, сколько пропущено и отброшено и кого ограничивали чаще всего.
+    """
+
+    def __init__(self, limits):
+        self.limits = limits
+        self.buckets = {}  # (user_id, вид) -> [токены, время пополнения]
+        self.passed = Counter()
+        self.dropped = Counter()
+        self.dropped_by_user = Counter()
+        # Кого уже предупредили в текущей серии отброшенных апдейтов
+        self.notified = set()
+
+    def allow(self, user_id, kind, now=None):
+        limit = self.limits.get(kind)
+        if limit is None:
+            return True
+        rate, burst = limit
+        now = time.monotonic() if now is None else now
+        key = (user_id, kind)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            if len(self.buckets) >= RATE_LIMIT_MAX_BUCKETS:
+                self.purge(now)
+            bucket = self.buckets[key] = [burst, now]
+        else:
+            bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1] = now
+        if bucket[0] >= 1:
+            bucket[0] -= 1
+            self.passed[kind] += 1
+            self.notified.discard(key)
+            return True
+        self.dropped[kind] += 1
+        self.dropped_by_user[user_id] += 1
+        return False
+
+    def should_notify(self, user_id, kind):
+        """Предупреждение о лимите - одно на серию отброшенных апдейтов"""
+        key = (user_id, kind)
+        if key in self.notified:
+            return False
+        self.notified.add(key)
+        return True
+
+    def retry_after(self, user_id, kind):
+        """Через сколько секунд появится токен"""
+        tokens, _ = self.buckets[(user_id, kind)]
+        return max(1, math.ceil((1 - tokens) / self.limits[kind][0]))
+
+    def purge(self, now=None):
+        """Удаляет корзины, которые уже пополнились доверху: они не отличаются от новых"""
+        now = time.monotonic() if now is None else now
+        for key, (tokens, updated) in list(self.buckets.items()):
+            rate, burst = self.limits[key[1]]
+            if tokens + (now - updated) * rate >= burst:
+                del self.buckets[key]
+                self.notified.discard(key)
+
+class ReviewLeases:
+    """Аренда отправок на проверку.
+
+    Администратор забирает следующие отправки из очереди на ttl секунд; пока
+    аренда действует, другие администраторы их не видят и не могут оценить.
+    Истекшая аренда просто перестает учитываться - отправка снова в очереди.
+    """
+
+    def __init__(self, ttl=REVIEW_LEASE_SECONDS):
+        self.ttl = ttl
+        self.leases = {}  # submission_id -> (admin_id, истекает в epoch)
+
+    def holder(self, submission_id, now=None):
+        lease = self.leases.get(submission_id)
+        if lease is None or lease[1] <= (time.time() if now is None else now):
+            return None
+        return lease[0]
+
+    def extend(self, admin_id, submission_id, now=None):
+        """Взять или продлить аренду; False, если отправку держит другой администратор"""
+        now = time.time() if now is None else now
+        holder = self.holder(submission_id, now)
+        if holder is not None and holder != admin_id:
+            return False
+        self.leases[submission_id] = (admin_id, now + self.ttl)
+        return True
+
+    def claim(self, admin_id, pending_ids, limit, now=None):
+        """Свои действующие аренды плюс следующие свободные отправки, всего не больше limit"""
+        now = time.time() if now is None else now
+        self.purge(now)
+        claimed = [sid for sid in pending_ids if self.holder(sid, now) == admin_id]
+        for sid in pending_ids:
+            if len(claimed) >= limit:
+                break
+            if sid not in self.leases:
+                claimed.append(sid)
+        claimed = claimed[:limit]
+        for sid in claimed:
+            self.leases[sid] = (admin_id, now + self.ttl)
+        return sorted(claimed, key=submission_sort_key)
+
+    def held_by_others(self, admin_id, now=None):
+        now = time.time() if now is None else now
+        return {sid for sid, (holder, expires_at) in self.leases.items() if holder != admin_id and expires_at > now}
+
+    def release(self, submission_id):
+        self.leases.pop(submission_id, None)
+
+    def purge(self, now=None):
+        now = time.time() if now is None else now
+        for sid in [sid for sid, (_, expires_at) in self.leases.items() if expires_at <= now]:
+            del self.leases[sid]
+
+class StockReservations:
+    """Остатки товаров и короткие брони между подтверждением и покупкой.
+
+    Когда покупатель открывает подтверждение покупки товара ограниченного
+    количества, одна единица бронируется за ним на ttl секунд: пока бронь
+    действует, другие покупатели ее не получат, а не узнают о том, что товар
+    закончился, уже после решения. Покупка расходует бронь, отмена освобождает,
+    истекшая просто перестает учитываться. У покупателя одна бронь - новая
+    заменяет прежнюю. Остатки (quantity - sold) и число действующих броней
+    хранятся в памяти и обновляются при покупке и изменении товаров, поэтому
+    проверка наличия - O(1), без чтения products_data.json.
+    """
+
+    def __init__(self, ttl=STOCK_RESERVATION_SECONDS):
+        self.ttl = ttl
+        self.remaining = {}  # product_id -> quantity - sold; None - без ограничений
+        self.holds = {}  # user_id -> (product_id, истекает в epoch)
+        self.reserved = Counter()  # product_id -> число действующих броней
+        self.expiry = []  # куча (истекает, user_id) для снятия истекших броней
+
+    @classmethod
+    def build(cls, products):
+        reservations = cls()
+        for product_id, product in products.items():
+            reservations.update_product(product_id, product)
+        return reservations
+
+    def update_product(self, product_id, product):
+        """Остаток после создания товара, изменения или покупки"""
+        self.remaining[product_id] = product['quantity'] - product['sold'] if product['quantity'] > 0 else None
+
+    def remove_product(self, product_id):
+        self.remaining.pop(product_id, None)
+        self.release_product(product_id)
+
+    def release_product(self, product_id):
+        """Снятие всех броней товара"""
+        for user_id in [user_id for user_id, (held, _) in self.holds.items() if held == product_id]:
+            self.release(user_id)
+
+    def purge(self, now=None):
+        now = time.time() if now is None else now
+        while self.expiry and self.expiry[0][0] <= now:
+            expires_at, user_id = heapq.heappop(self.expiry)
+            hold = self.holds.get(user_id)
+            # В куче остаются записи замененных и снятых броней - снимаем только истекшую
+            if hold is not None and hold[1] == expires_at:
+                self.release(user_id)
+
+    def holds_product(self, user_id, product_id, now=None):
+        self.purge(now)
+        hold = self.holds.get(user_id)
+        return hold is not None and hold[0] == product_id
+
+    def available(self, product_id, user_id=None, now=None):
+        """Сколько единиц доступно user_id: остаток минус чужие брони; None - без ограничений"""
+        self.purge(now)
+        remaining = self.remaining.get(product_id, 0)
+        if remaining is None:
+            return None
+        own = 1 if self.holds_product(user_id, product_id, now) else 0
+        return max(remaining - self.reserved[product_id] + own, 0)
+
+    def reserve(self, product_id, user_id, now=None):
+        """Бронь единицы товара (или продление своей); False, если свободных единиц нет"""
+        now = time.time() if now is None else now
+        available = self.available(product_id, user_id, now)
+        if available is not None and available <= 0:
+            return False
+        self.release(user_id)
+        if available is None:
+            # Товар без ограничений бронировать не нужно
+            return True
+        expires_at = now + self.ttl
+        self.holds[user_id] = (product_id, expires_at)
+        self.reserved[product_id] += 1
+        heapq.heappush(self.expiry, (expires_at, user_id))
+        return True
+
+    def release(self, user_id):
+        hold = self.holds.pop(user_id, None)
+        if hold is not None:
+            self.reserved[hold[0]] -= 1
+            if self.reserved[hold[0]] <= 0:
+                del self.reserved[hold[0]]
+
+class FlashSales:
+    """Флеш-распродажи: покупка «горячих» товаров через очередь заявок.
+
+    Подтверждение покупки товара в режиме флеш-распродажи не читает и не пишет
+    файлы: заявка встает в очередь товара (FIFO), а единственный обработчик
+    очереди - задача asyncio, которая живет, пока в очереди есть заявки, - раз
+    в FLASH_SALE_BATCH_SECONDS забирает накопившиеся заявки, решает их по
+    порядку в памяти и записывает весь пакет одной транзакцией. Брони в этом
+    режиме не используются: заявка на распроданный товар сразу получает ответ
+    «распродано», остальные - покупку или отказ после записи своего пакета.
+    """
+
+    def __init__(self):
+        self.enabled = set()  # product_id товаров в режиме флеш-распродажи
+        self.queues = {}  # product_id -> deque заявок (user_id, chat_id)
+        self.queued = {}  # product_id -> user_id с заявкой в очереди
+        self.workers = {}  # product_id -> задача обработчика очереди
+        self.outcomes = Counter()  # (product_id, решение) -> число заявок с запуска
+
+    def refresh(self, products):
+        """Товары в режиме распродажи по products_data.json (при запуске и после восстановления снимка)"""
+        self.enabled = {product_id for product_id, product in products.items() if product['flash_sale']}
+
+    def pending(self, product_id):
+        return len(self.queues.get(product_id, ()))
+
+    def submit(self, application, product_id, user_id, chat_id):
+        """Заявка в очередь товара; False, если заявка покупателя уже стоит в очереди"""
+        queued = self.queued.setdefault(product_id, set())
+        if user_id in queued:
+            return False
+        queued.add(user_id)
+        self.queues.setdefault(product_id, deque()).append((user_id, chat_id))
+        if product_id not in self.workers:
+            # create_task копирует контекст: обработчик работает с хранилищем арендатора заявки
+            self.workers[product_id] = application.create_task(self.run(application, product_id))
+        return True
+
+    def take_batch(self, product_id):
+        pending, queued = self.queues[product_id], self.queued[product_id]
+        batch = [pending.popleft() for _ in range(min(len(pending), FLASH_SALE_BATCH_SIZE))]
+        for user_id, _ in batch:
+            queued.discard(user_id)
+        return batch
+
+    async def run(self, application, product_id):
+        """Обработчик очереди товара: пакет за пакетом, пока очередь не опустеет"""
+        try:
+            while self.pending(product_id):
+                await asyncio.sleep(FLASH_SALE_BATCH_SECONDS)
+                batch = self.take_batch(product_id)
+                try:
+                    messages = process_flash_batch(application.bot_data, product_id, batch)
+                except Exception as e:
+                    logger.error(f"Ошибка обработки пакета флеш-распродажи товара #{product_id}: {e}")
+                    messages = [
+                        (chat_id, "❌ Не удалось оформить покупку, баллы не списаны. Попробуйте позже.",
+                         get_main_keyboard(int(user_id)))
+                        for user_id, chat_id in batch
+                    ]
+                # Ответы отправляются отдельно, чтобы следующий пакет не ждал Bot API
+                application.create_task(send_batched(application.bot, messages))
+        finally:
+            self.workers.pop(product_id, None)
+
+def submission_sort_key(submission_id):
+    return int(submission_id) if submission_id.isdigit() else 0
+
 def initialize_files():
-    """Создание файлов если их нет"""
-    files = [DATA_FILE, TASKS_FILE, PRODUCTS_FILE, SUBMISSIONS_FILE, ORDERS_FILE]
+    """Создание документов если их нет"""
+    storage = current_storage.get()
+    storage.open()
+    files = [DATA_FILE, TASKS_FILE, PRODUCTS_FILE, SUBMISSIONS_FILE, ORDERS_FILE, REMINDERS_FILE]
     for file in files:
-        if not os.path.exists(file):
+        if not storage.exists(file):
             save_data({}, file)
             logger.info(f"Создан файл: {file}")
+    upgrade_data_files(storage)
+
+def upgrade_data_files(storage):
+    """Перезапись коллекций старых версий схемы в текущей.
+
+    Для файлов версия читается из начала файла, так что коллекции текущей
+    версии при запуске не разбираются. Для больших файлов лучше заранее
+    запустить migrate_data.py schema: она обновляет файл потоково, не
+    загружая его целиком.
+    """
+    for filename in SCHEMA_UPGRADES:
+        if not storage.exists(filename):
+            continue
+        try:
+            version = storage.read_schema_version(filename)
+            if version >= schema_version(filename):
+                continue
+            data = storage.load(filename)
+        except (OSError, ValueError) as e:
+            storage_logger.error(f"Ошибка загрузки данных из {filename}: {e}")
+            continue
+        save_data(upgrade_collection(data, filename), filename)
+        logger.info(f"Файл {filename} обновлен до версии схемы {schema_version(filename)} (была {version})")
 
 def load_products():
     return load_data(PRODUCTS_FILE)
 
-def save_products(products):
-    save_data(products, PRODUCTS_FILE)
+def save_products(products, uow=None):
+    save_data(products, PRODUCTS_FILE, uow)
 
 def load_orders():
-    return load_data(ORDERS_FILE)
+    return records_from_json(load_data(ORDERS_FILE), OrderRecord)
 
-def save_orders(orders):
-    save_data(orders, ORDERS_FILE)
+def save_orders(orders, uow=None):
+    save_data(records_to_json(orders), ORDERS_FILE, uow)
 
 def generate_product_id(products):
     """Генерация уникального ID для товара"""
@@ -107,44 +1494,1242 @@ def generate_task_id(tasks):
             continue
     return max_id + 1
     
-def load_data(filename):
-    """Загрузка данных из файла"""
+def load_data(filename, storage=None):
+    """Загрузка документа из хранилища (по умолчанию - хранилища текущего обработчика)"""
+    storage = storage or current_storage.get()
     try:
-        if os.path.exists(filename):
-            with open(filename, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-                return data if isinstance(data, dict) else {}
-        return {}
+        return upgrade_collection(storage.load(filename), filename)
     except Exception as e:
-        logger.error(f"Ошибка загрузки данных из {filename}: {e}")
+        storage_logger.error(f"Ошибка загрузки данных из {filename}: {e}")
         return {}
 
-def save_data(data, filename):
-    """Сохранение данных в файл"""
+# Заголовок двоичной копии: метка формата, mtime_ns, размер и inode JSON-файла,
+# по которому она сделана, и контрольная сумма blake2b содержимого
+BINARY_CACHE_MAGIC = b'LAMPAPK5'
+BINARY_CACHE_HEADER = struct.Struct('<8sqqq16s')
+
+def uses_binary_cache(filename):
+    return BINARY_CACHE and schema_steps(filename) is not None
+
+def binary_cache_key(stat):
+    return stat.st_mtime_ns, stat.st_size, stat.st_ino
+
+def dump_document(data):
+    """Документ в pickle (протокол 5)"""
+    buffer = io.BytesIO()
+    pickler = pickle.Pickler(buffer, protocol=5)
+    # Без мемо общих объектов: данные - дерево, как в JSON, а запись в 4 раза быстрее
+    pickler.fast = True
+    pickler.dump(data)
+    return buffer.getvalue()
+
+def load_document(payload):
+    """Документ из dump_document()"""
+    # Разбор создает сотни тысяч словарей, и сборщик мусора без пользы обходит их
+    # по многу раз; отключение ускоряет загрузку втрое (циклов в данных нет)
+    gc.disable()
+    try:
+        return pickle.loads(payload)
+    finally:
+        gc.enable()
+
+def read_binary_cache(path):
+    """Данные из двоичной копии файла path; None, если ее нет, она устарела или повреждена"""
+    try:
+        with open(path + BINARY_CACHE_SUFFIX, 'rb') as f:
+            header = f.read(BINARY_CACHE_HEADER.size)
+            payload = f.read()
+        stat = os.stat(path)
+    except OSError:
+        return None
+    if len(header) != BINARY_CACHE_HEADER.size:
+        return None
+    magic, mtime_ns, size, inode, digest = BINARY_CACHE_HEADER.unpack(header)
+    if magic != BINARY_CACHE_MAGIC or (mtime_ns, size, inode) != binary_cache_key(stat):
+        return None
+    if hashlib.blake2b(payload, digest_size=16).digest() != digest:
+        storage_logger.warning(f"Двоичная копия {path} повреждена, читается JSON")
+        return None
+    return load_document(payload)
+
+def write_binary_cache(data, path, stat):
+    """Двоичная копия data - содержимого файла path в состоянии stat.
+
+    Копия - только кэш: пишется без fsync (поврежденную отсеет контрольная
+    сумма), а ошибка записи не мешает сохранению данных.
+    """
+    try:
+        payload = dump_document(data)
+        header = BINARY_CACHE_HEADER.pack(
+            BINARY_CACHE_MAGIC, *binary_cache_key(stat), hashlib.blake2b(payload, digest_size=16).digest()
+        )
+        # Уникальное имя: копию одного файла могут писать несколько потоков чтения
+        fd, tmp_path = tempfile.mkstemp(prefix=os.path.basename(path), dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(header)
+            f.write(payload)
+        os.replace(tmp_path, path + BINARY_CACHE_SUFFIX)
+    except Exception as e:
+        storage_logger.warning(f"Не удалось записать двоичную копию {path}: {e}")
+
+def write_json_synced(data, filename, indent=2):
+    """Запись JSON с fsync: после возврата файл на диске целиком"""
+    with open(filename, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, indent=indent)
+        f.flush()
+        os.fsync(f.fileno())
+
+def write_json_atomic(data, filename, indent=2):
+    """Запись через временный файл и os.replace: на диске всегда целый старый или новый файл"""
+    tmp_filename = f"{filename}.tmp"
+    write_json_synced(data, tmp_filename, indent)
+    os.replace(tmp_filename, filename)
+
+def iter_log_lines(f, offset):
+    """(смещение, строка) полных строк открытого в двоичном режиме f, начиная с offset.
+
+    Недописанная последняя строка (запись прервана сбоем) пропускается.
+    """
+    f.seek(offset)
+    for line in f:
+        if not line.endswith(b'\n'):
+            break
+        yield offset, line
+        offset += len(line)
+
+def read_lines_at(f, offsets):
+    """Строки открытого в двоичном режиме f, начинающиеся со смещений offsets"""
+    lines = []
+    for offset in offsets:
+        f.seek(offset)
+        lines.append(f.readline())
+    return lines
+
+class Storage(abc.ABC):
+    """Хранилище данных бота, через которое работают все обработчики.
+
+    Документы - словари JSON-вида (users_data.json, tasks_data.json, ...),
+    журналы - последовательности строк, которые только дописываются
+    (points_ledger.jsonl). load() отдает собственную копию документа: ее можно
+    менять, хранилище изменится только после save() или commit(). Хранилище
+    выбирается при сборке приложения (create_storage), лежит в
+    bot_data['storage'] и на время обработчика или задачи становится
+    current_storage, через которое работают load_*/save_* и UnitOfWork.
+    Бэкенд обязан реализовать все абстрактные методы, иначе его нельзя создать.
+    """
+    name = None
+    # Каталог снимков данных (/snapshot, /restore); None - снимки не поддерживаются
+    snapshot_dir = None
+
+    def __init__(self):
+        self.read_store = ReadStore(self)
+
+    def open(self):
+        """Подготовка при запуске (для файлов - завершение прерванной транзакции)"""
+
+    def close(self):
+        """Освобождение ресурсов при остановке"""
+
+    def describe(self):
+        """Строка для отчета о запуске"""
+        return self.name
+
+    @abc.abstractmethod
+    def exists(self, name):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def load(self, name):
+        """Документ name; {}, если его нет"""
+        raise NotImplementedError
+
+    def read_schema_version(self, name):
+        """Версия схемы документа коллекции (SCHEMA_KEY)"""
+        return self.load(name).get(SCHEMA_KEY, 0)
+
+    def save(self, name, data):
+        """Запись одного документа вне транзакции"""
+        try:
+            self.write_document(name, data)
+        finally:
+            self.read_store.invalidate(name)
+
+    def commit(self, documents, appends=None, deletes=()):
+        """Атомарная запись документов, дописывание строк в журналы и удаление документов.
+
+        appends - {журнал: {'offset': смещение или None, 'lines': [строки]}}:
+        с offset журнал сначала обрезается до этого смещения, иначе строки
+        дописываются в конец. False, если записать не удалось (ничего не изменено).
+        """
+        try:
+            return self.write_batch(documents, appends or {}, list(deletes))
+        finally:
+            # И при неудаче: часть файлов могла быть уже заменена
+            for name in [*documents, *deletes]:
+                self.read_store.invalidate(name)
+
+    @abc.abstractmethod
+    def write_document(self, name, data):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def write_batch(self, documents, appends, deletes):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def version_token(self, name):
+        """Строка, которая меняется при каждом изменении документа или журнала; None, если его нет"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def read_bytes(self, name):
+        """Содержимое документа (JSON) или журнала целиком - для снимков данных"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def log_size(self, name):
+        """Размер журнала в байтах (смещение конца)"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def read_log(self, name, offset=0):
+        """(смещение, строка в байтах) полных строк журнала, начиная с offset"""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def read_log_lines(self, name, offsets):
+        """Строки журнала (в байтах), начинающиеся со смещений offsets"""
+        raise NotImplementedError
+
+class JsonFileStorage(Storage):
+    """Документы - JSON-файлы в data_dir (с двоичными копиями для быстрой загрузки), журналы - файлы строк.
+
+    Новые версии документов транзакции пишутся с fsync рядом с файлами
+    (имя + TRANSACTION_SUFFIX), затем в transaction.journal (атомарно, с fsync)
+    записываются имена заменяемых и удаляемых файлов и дописываемые строки
+    журналов, после чего файлы заменяются и журнал удаляется. Каждый документ
+    записывается один раз, журнал остается маленьким. Транзакция считается
+    записанной, как только записан журнал: сбой замены после этого сразу
+    повторяется, а если процесс упал - замену доводит запуск (open()) или
+    следующая транзакция. Сбой до записи журнала оставляет на диске прежние
+    версии всех файлов.
+    """
+    name = 'json'
+
+    def __init__(self, data_dir):
+        super().__init__()
+        self.data_dir = data_dir
+        self.snapshot_dir = os.path.join(data_dir, SNAPSHOT_DIR_NAME)
+        self.cache_stats = {'hits': 0, 'misses': 0}
+        # Коллекции загружаются и в потоках ReadStore (asyncio.to_thread), поэтому
+        # счетчики и двоичные копии меняются под блокировками
+        self.stats_lock = threading.Lock()
+        self.cache_locks = {}  # документ -> блокировка его двоичной копии
+        self.cache_locks_guard = threading.Lock()
+
+    def path(self, name):
+        return os.path.join(self.data_dir, name)
+
+    def count_cache_load(self, outcome):
+        with self.stats_lock:
+            self.cache_stats[outcome] += 1
+
+    def refresh_binary_cache(self, name, data, stat=None):
+        """Двоичная копия документа name по data.
+
+        stat - состояние файла, из которого прочитаны data: если файл с тех пор
+        заменили, копия не пишется. Проверка и запись копии одного документа
+        выполняются под его блокировкой, поэтому копия, которую пишет поток
+        чтения, не может заменить более свежую копию, записанную вместе с файлом.
+        """
+        path = self.path(name)
+        with self.cache_locks_guard:
+            lock = self.cache_locks.setdefault(name, threading.Lock())
+        with lock:
+            current = os.stat(path)
+            if stat is None or binary_cache_key(current) == binary_cache_key(stat):
+                write_binary_cache(data, path, current)
+
+    def describe(self):
+        loads = self.cache_stats['hits'] + self.cache_stats['misses']
+        return f"json ({self.data_dir}), двоичный кэш: {self.cache_stats['hits']} из {loads} загрузок"
+
+    def open(self):
+        os.makedirs(self.data_dir, exist_ok=True)
+        self.recover_journal()
+
+    def exists(self, name):
+        return os.path.exists(self.path(name))
+
+    def load(self, name):
+        path = self.path(name)
+        if not os.path.exists(path):
+            return {}
+        data = read_binary_cache(path) if uses_binary_cache(name) else None
+        if data is not None:
+            self.count_cache_load('hits')
+        else:
+            data = self.load_json(name)
+        return data if isinstance(data, dict) else {}
+
+    def load_json(self, name):
+        """Разбор JSON-файла; для коллекций заодно пишется двоичная копия для следующих загрузок"""
+        path = self.path(name)
+        if not uses_binary_cache(name):
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        self.count_cache_load('misses')
+        stat = os.stat(path)
+        with open(path, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        # Если файл заменили, пока он читался, копия по прочитанному была бы неверной
+        self.refresh_binary_cache(name, data, stat)
+        return data
+
+    def read_schema_version(self, name):
+        """Версия по началу файла: SCHEMA_KEY всегда пишется первым ключом, файл целиком не разбирается"""
+        with open(self.path(name), 'r', encoding='utf-8') as f:
+            match = SCHEMA_HEADER_RE.match(f.read(64))
+        return int(match.group(1)) if match else 0
+
+    def write_document(self, name, data):
+        path = self.path(name)
+        write_json_atomic(data, path)
+        if uses_binary_cache(name):
+            self.refresh_binary_cache(name, data)
+
+    def write_batch(self, documents, appends, deletes):
+        # Незавершенная транзакция доводится до конца раньше следующей, иначе ее журнал был бы перезаписан
+        try:
+            for name in self.recover_journal():
+                self.read_store.invalidate(name)
+        except Exception as e:
+            storage_logger.error(f"❌ Не удалось завершить предыдущую транзакцию, запись отклонена: {e}")
+            return False
+
+        try:
+            for name, data in documents.items():
+                write_json_synced(data, self.path(name) + TRANSACTION_SUFFIX)
+            journal = {
+                'replaces': list(documents),
+                # Смещение начала дописываемых строк: повторное применение журнала их не продублирует
+                'appends': {
+                    name: {
+                        'offset': append['offset'] if append['offset'] is not None else self.log_size(name),
+                        'lines': append['lines'],
+                    }
+                    for name, append in appends.items()
+                },
+                'deletes': deletes,
+            }
+            write_json_atomic(journal, self.path(JOURNAL_FILE), indent=None)
+        except Exception as e:
+            storage_logger.error(f"❌ Ошибка записи транзакции: {e}")
+            for name in documents:
+                if os.path.exists(self.path(name) + TRANSACTION_SUFFIX):
+                    os.remove(self.path(name) + TRANSACTION_SUFFIX)
+            return False
+
+        # Журнал записан - транзакция подтверждена, остается довести замену файлов до конца
+        for attempt in range(1, JOURNAL_APPLY_ATTEMPTS + 1):
+            try:
+                self.apply_journal(journal)
+                break
+            except Exception as e:
+                storage_logger.error(f"❌ Не удалось применить журнал транзакции (попытка {attempt}): {e}")
+        else:
+            # Журнал остается: замену доведет следующая транзакция или запуск бота
+            storage_logger.critical("❌ Транзакция записана в журнал, но файлы не заменены до следующей записи")
+            return True
+        for name, data in documents.items():
+            if uses_binary_cache(name):
+                self.refresh_binary_cache(name, data)
+        return True
+
+    def apply_journal(self, journal):
+        """Замена файлов версиями транзакции, дописывание строк, удаление файлов и самого журнала"""
+        if 'files' not in journal and 'replaces' not in journal:
+            # Журнал прежнего формата: только файлы коллекций
+            journal = {'files': journal, 'appends': {}}
+        # Журнал прежнего формата хранит документы целиком
+        for name, data in journal.get('files', {}).items():
+            self.write_document(name, data)
+        for name in journal.get('replaces', ()):
+            staged = self.path(name) + TRANSACTION_SUFFIX
+            # При повторном применении уже замененные файлы пропускаются
+            if os.path.exists(staged):
+                os.replace(staged, self.path(name))
+        for name, append in journal['appends'].items():
+            with open(self.path(name), 'ab') as f:
+                # Отрезаем то, что успело дописаться до сбоя, и пишем строки заново
+                f.truncate(min(append['offset'], f.seek(0, os.SEEK_END)))
+                f.write(''.join(append['lines']).encode('utf-8'))
+                f.flush()
+                os.fsync(f.fileno())
+        for name in journal.get('deletes', ()):
+            if os.path.exists(self.path(name)):
+                os.remove(self.path(name))
+        os.remove(self.path(JOURNAL_FILE))
+
+    def recover_journal(self):
+        """Завершение транзакции, прерванной сбоем; возвращает имена измененных файлов"""
+        journal_path = self.path(JOURNAL_FILE)
+        if not os.path.exists(journal_path):
+            return []
+        with open(journal_path, 'r', encoding='utf-8') as f:
+            journal = json.load(f)
+        self.apply_journal(journal)
+        if 'replaces' in journal:
+            names = [*journal['replaces'], *journal['appends'], *journal['deletes']]
+        else:
+            names = [*journal.get('files', journal), *journal.get('appends', {})] if 'files' in journal else list(journal)
+        logger.warning(f"Восстановлена незавершенная транзакция: {', '.join(names)}")
+        return names
+
+    def version_token(self, name):
+        try:
+            stat = os.stat(self.path(name))
+        except FileNotFoundError:
+            return None
+        return f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def read_bytes(self, name):
+        with open(self.path(name), 'rb') as f:
+            return f.read()
+
+    def log_size(self, name):
+        path = self.path(name)
+        return os.path.getsize(path) if os.path.exists(path) else 0
+
+    def read_log(self, name, offset=0):
+        path = self.path(name)
+        if not os.path.exists(path):
+            return
+        with open(path, 'rb') as f:
+            yield from iter_log_lines(f, offset)
+
+    def read_log_lines(self, name, offsets):
+        with open(self.path(name), 'rb') as f:
+            return read_lines_at(f, offsets)
+
+class MemoryStorage(Storage):
+    """Все данные в памяти процесса: обработчики без дискового ввода-вывода для тестов и бенчмарков.
+
+    Документы хранятся сериализованными (dump_document), поэтому load() отдает
+    независимую копию, как при чтении файла. После остановки данные теряются;
+    снимки данных не поддерживаются.
+    """
+    name = 'memory'
+
+    def __init__(self):
+        super().__init__()
+        self.documents = {}
+        self.logs = {}
+        self.versions = Counter()
+
+    def exists(self, name):
+        return name in self.documents or name in self.logs
+
+    def load(self, name):
+        payload = self.documents.get(name)
+        return load_document(payload) if payload is not None else {}
+
+    def write_document(self, name, data):
+        self.documents[name] = dump_document(data)
+        self.versions[name] += 1
+
+    def write_batch(self, documents, appends, deletes):
+        # Все документы сериализуются до первого изменения: ошибка не оставит транзакцию записанной наполовину
+        try:
+            payloads = {name: dump_document(data) for name, data in documents.items()}
+            encoded = {name: ''.join(append['lines']).encode('utf-8') for name, append in appends.items()}
+        except Exception as e:
+            storage_logger.error(f"❌ Ошибка записи транзакции: {e}")
+            return False
+        self.documents.update(payloads)
+        for name, append in appends.items():
+            log = self.logs.setdefault(name, bytearray())
+            if append['offset'] is not None:
+                del log[append['offset']:]
+            log += encoded[name]
+        for name in deletes:
+            self.documents.pop(name, None)
+            self.logs.pop(name, None)
+        self.versions.update([*payloads, *appends, *deletes])
+        return True
+
+    def version_token(self, name):
+        return str(self.versions[name]) if self.exists(name) else None
+
+    def read_bytes(self, name):
+        if name in self.logs:
+            return bytes(self.logs[name])
+        return json.dumps(self.load(name), ensure_ascii=False, indent=2).encode('utf-8')
+
+    def log_size(self, name):
+        return len(self.logs.get(name, b''))
+
+    def read_log(self, name, offset=0):
+        yield from iter_log_lines(io.BytesIO(self.logs.get(name, b'')), offset)
+
+    def read_log_lines(self, name, offsets):
+        return read_lines_at(io.BytesIO(self.logs.get(name, b'')), offsets)
+
+class SqliteStorage(Storage):
+    """Документы и журналы в одной базе SQLite; транзакция UnitOfWork - транзакция базы.
+
+    Документ хранится одной строкой (JSON без отступов), журнал - строками со
+    смещениями, как в файле, поэтому индекс журнала баллов работает так же.
+    Соединение одно; документы читаются и из потоков (ReadStore), поэтому
+    обращения к нему идут под блокировкой.
+    """
+    name = 'sqlite'
+    TABLES = (
+        "CREATE TABLE IF NOT EXISTS documents (name TEXT PRIMARY KEY, data TEXT NOT NULL, version INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS logs (name TEXT PRIMARY KEY, version INTEGER NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS log_lines ("
+        "name TEXT NOT NULL, position INTEGER NOT NULL, line BLOB NOT NULL, PRIMARY KEY (name, position))",
+    )
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.snapshot_dir = os.path.join(os.path.dirname(os.path.abspath(path)), SNAPSHOT_DIR_NAME)
+        self.connection = None
+        self.lock = threading.Lock()
+
+    def describe(self):
+        return f"sqlite ({self.path})"
+
+    def open(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        self.connection = sqlite3.connect(self.path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.execute("PRAGMA journal_mode=WAL")
+            for statement in self.TABLES:
+                self.connection.execute(statement)
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def query(self, sql, params=()):
+        with self.lock:
+            return self.connection.execute(sql, params).fetchall()
+
+    def exists(self, name):
+        return bool(self.query(
+            "SELECT 1 FROM documents WHERE name = ? UNION ALL SELECT 1 FROM logs WHERE name = ?", (name, name)
+        ))
+
+    def load(self, name):
+        rows = self.query("SELECT data FROM documents WHERE name = ?", (name,))
+        return json.loads(rows[0][0]) if rows else {}
+
+    def write_document(self, name, data):
+        self.write_batch({name: data}, {}, [])
+
+    def write_batch(self, documents, appends, deletes):
+        try:
+            encoded = {name: json.dumps(data, ensure_ascii=False) for name, data in documents.items()}
+            with self.lock, self.connection:
+                for name, data in encoded.items():
+                    self.connection.execute(
+                        "INSERT INTO documents (name, data, version) VALUES (?, ?, 1) "
+                        "ON CONFLICT (name) DO UPDATE SET data = excluded.data, version = version + 1",
+                        (name, data)
+                    )
+                for name, append in appends.items():
+                    if append['offset'] is not None:
+                        self.connection.execute(
+                            "DELETE FROM log_lines WHERE name = ? AND position >= ?", (name, append['offset'])
+                        )
+                    position = self.log_end(name)
+                    for line in append['lines']:
+                        line = line.encode('utf-8')
+                        self.connection.execute(
+                            "INSERT INTO log_lines (name, position, line) VALUES (?, ?, ?)", (name, position, line)
+                        )
+                        position += len(line)
+                    self.connection.execute(
+                        "INSERT INTO logs (name, version) VALUES (?, 1) "
+                        "ON CONFLICT (name) DO UPDATE SET version = version + 1",
+                        (name,)
+                    )
+                for name in deletes:
+                    for table in ('documents', 'logs', 'log_lines'):
+                        self.connection.execute(f"DELETE FROM {table} WHERE name = ?", (name,))
+        except (sqlite3.Error, TypeError, ValueError) as e:
+            storage_logger.error(f"❌ Ошибка записи транзакции в {self.path}: {e}")
+            return False
+        return True
+
+    def log_end(self, name):
+        """Смещение конца журнала (вызывается под блокировкой)"""
+        row = self.connection.execute(
+            "SELECT position + length(line) FROM log_lines WHERE name = ? ORDER BY position DESC LIMIT 1", (name,)
+        ).fetchone()
+        return row[0] if row else 0
+
+    def version_token(self, name):
+        rows = self.query(
+            "SELECT version FROM documents WHERE name = ? UNION ALL SELECT version FROM logs WHERE name = ?",
+            (name, name)
+        )
+        return str(rows[0][0]) if rows else None
+
+    def read_bytes(self, name):
+        rows = self.query("SELECT data FROM documents WHERE name = ?", (name,))
+        if rows:
+            return rows[0][0].encode('utf-8')
+        return b''.join(line for _, line in self.read_log(name))
+
+    def log_size(self, name):
+        with self.lock:
+            return self.log_end(name)
+
+    def read_log(self, name, offset=0):
+        rows = self.query(
+            "SELECT position, line FROM log_lines WHERE name = ? AND position >= ? ORDER BY position", (name, offset)
+        )
+        for position, line in rows:
+            yield position, bytes(line)
+
+    def read_log_lines(self, name, offsets):
+        lines = []
+        for offset in offsets:
+            rows = self.query("SELECT line FROM log_lines WHERE name = ? AND position = ?", (name, offset))
+            lines.append(bytes(rows[0][0]) if rows else b'')
+        return lines
+
+def create_storage(backend=STORAGE_BACKEND, data_dir=DATA_DIR, sqlite_path=None):
+    """Хранилище по имени: json (файлы в data_dir), memory или sqlite (sqlite_path, по умолчанию в data_dir)"""
+    if backend == 'json':
+        return JsonFileStorage(data_dir)
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 'sqlite':
+        return SqliteStorage(sqlite_path or os.path.join(data_dir, SQLITE_FILE))
+    raise ValueError(f"Неизвестное хранилище: {backend} (json, memory или sqlite)")
+
+# Хранилище приложения, которое обрабатывает текущий апдейт или задачу
+current_storage = contextvars.ContextVar('current_storage')
+
+@contextmanager
+def using_storage(storage):
+    """Делает storage текущим хранилищем внутри блока"""
+    token = current_storage.set(storage)
     try:
-        with open(filename, 'w', encoding='utf-8') as f:
-            json.dump(data, f, ensure_ascii=False, indent=2)
-        logger.info(f"✅ Данные успешно сохранены в {filename}")
+        yield storage
+    finally:
+        current_storage.reset(token)
+
+class Tenant:
+    """Сообщество (учебная группа), которое обслуживает одно Application процесса.
+
+    У каждого свои токен бота, администраторы и хранилище; event loop, пул
+    соединений к Bot API, пул потоков и метрики - общие. Сообщество лежит в
+    bot_data['tenant'] и на время обработчика или задачи становится
+    current_tenant (а его хранилище - current_storage).
+    """
+    __slots__ = ('name', 'token', 'admin_ids', 'storage', 'api_base_url', 'api_base_file_url')
+
+    def __init__(self, name, token, admin_ids, storage, api_base_url=None, api_base_file_url=None):
+        self.name = name
+        self.token = token
+        self.admin_ids = frozenset(admin_ids)
+        self.storage = storage
+        self.api_base_url = api_base_url
+        self.api_base_file_url = api_base_file_url
+
+@contextmanager
+def using_tenant(tenant):
+    """Делает tenant текущим сообществом (и его хранилище - текущим) внутри блока"""
+    token = current_tenant.set(tenant)
+    try:
+        with using_storage(tenant.storage):
+            yield tenant
+    finally:
+        current_tenant.reset(token)
+
+def load_tenants():
+    """Сообщества процесса: из BOT_TENANTS_FILE или одно по BOT_TOKEN, ADMIN_IDS и BOT_DATA_DIR"""
+    if not BOT_TENANTS_FILE:
+        if not BOT_TOKEN:
+            raise RuntimeError("Не задан токен бота: укажите переменную окружения BOT_TOKEN или файл BOT_TENANTS_FILE")
+        return [Tenant(
+            'default', BOT_TOKEN, ADMIN_IDS, create_storage(STORAGE_BACKEND, DATA_DIR, SQLITE_PATH),
+            BOT_API_BASE_URL, BOT_API_BASE_FILE_URL
+        )]
+    with open(BOT_TENANTS_FILE, 'r', encoding='utf-8') as f:
+        configs = json.load(f)
+    tenants = []
+    for config in configs:
+        data_dir = config.get('data_dir') or os.path.join(DATA_DIR, config['name'])
+        tenants.append(Tenant(
+            config['name'],
+            config['token'],
+            config.get('admin_ids', ADMIN_IDS),
+            create_storage(config.get('storage', STORAGE_BACKEND), data_dir, config.get('sqlite_path')),
+            config.get('api_base_url', BOT_API_BASE_URL),
+            config.get('api_base_file_url', BOT_API_BASE_FILE_URL),
+        ))
+    names = [tenant.name for tenant in tenants]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Имена сообществ в {BOT_TENANTS_FILE} повторяются: {', '.join(names)}")
+    return tenants
+
+def save_data(data, filename, uow=None):
+    """Сохранение документа; с uow изменение только добавляется в транзакцию"""
+    if uow is not None:
+        uow.stage(filename, data)
+        return
+    try:
+        current_storage.get().save(filename, stamp_schema(data, filename))
+        storage_logger.info(f"✅ Данные успешно сохранены в {filename}")
     except Exception as e:
-        logger.error(f"❌ Ошибка сохранения данных в {filename}: {e}")
+        storage_logger.error(f"❌ Ошибка сохранения данных в {filename}: {e}")
+
+class UnitOfWork:
+    """Транзакция над несколькими документами и журналами хранилища.
+
+    Изменения копятся через save_*(..., uow), append() и delete() и
+    записываются commit() разом - атомарно средствами хранилища
+    (Storage.commit): либо все, либо ни одно.
+    """
+
+    def __init__(self, storage=None):
+        self.storage = storage or current_storage.get()
+        self.staged = {}
+        self.appends = {}
+        self.deletes = []
+
+    def stage(self, filename, data):
+        self.staged[filename] = data
+
+    def append(self, filename, lines, offset=None):
+        """Строки, дописываемые в журнал (журнал баллов) в той же транзакции.
+
+        По умолчанию - в конец журнала; с offset он сначала обрезается до этого смещения.
+        """
+        append = self.appends.setdefault(filename, {'offset': offset, 'lines': []})
+        append['lines'].extend(lines)
+
+    def delete(self, filename):
+        self.deletes.append(filename)
+
+    def commit(self):
+        """Запись транзакции; False, если сохранить не удалось (данные не изменены)"""
+        if not self.staged and not self.appends and not self.deletes:
+            return True
+        # Версия схемы пишется вместе с документом: журнал прежней версии бота восстановится без нее
+        documents = {filename: stamp_schema(data, filename) for filename, data in self.staged.items()}
+        if not self.storage.commit(documents, self.appends, self.deletes):
+            return False
+        storage_logger.info(f"✅ Транзакция сохранена: {', '.join([*documents, *self.appends, *self.deletes])}")
+        self.staged = {}
+        self.appends = {}
+        self.deletes = []
+        return True
+
+# Коллекции для снимков чтения: имя -> (документ, класс записей или None для словарей)
+READ_COLLECTIONS = {
+    'users': (DATA_FILE, UserRecord),
+    'tasks': (TASKS_FILE, None),
+    'submissions': (SUBMISSIONS_FILE, SubmissionRecord),
+    'products': (PRODUCTS_FILE, None),
+    'orders': (ORDERS_FILE, OrderRecord),
+}
+# Сколько раз перечитывать коллекции в потоке, если их успели перезаписать
+READ_SNAPSHOT_RETRIES = 2
+
+def load_read_collection(storage, name):
+    filename, record_class = READ_COLLECTIONS[name]
+    data = load_data(filename, storage)
+    return MappingProxyType(records_from_json(data, record_class) if record_class else data)
+
+class ReadSnapshot:
+    """Коллекции одной версии хранилища (snapshot.users, snapshot.tasks, ...); только для чтения"""
+    __slots__ = ('version', 'collections')
+
+    def __init__(self, version, collections):
+        self.version = version
+        self.collections = collections
+
+    def __getattr__(self, name):
+        try:
+            return self.collections[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+class ReadStore:
+    """Версионированные снимки коллекций хранилища для обработчиков, которые только читают.
+
+    Каждая запись документа (save_data, транзакция UnitOfWork) увеличивает
+    версию. Разобранная коллекция публикуется и отдается всем читателям до
+    следующей записи своего документа, поэтому изменять ее нельзя; обработчики,
+    которые меняют данные, как и раньше читают документы через load_*().
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.version = 0
+        self.written = {}  # документ -> версия его последней записи
+        self.published = {}  # имя коллекции -> (версия записи документа, коллекция)
+
+    def invalidate(self, filename):
+        self.version += 1
+        self.written[filename] = self.version
+
+    def current(self, name):
+        """Опубликованная коллекция, если ее документ с тех пор не перезаписывался"""
+        published = self.published.get(name)
+        if published is not None and published[0] == self.written.get(READ_COLLECTIONS[name][0], 0):
+            return published[1]
+        return None
+
+    async def snapshot(self, *names):
+        """Согласованный снимок коллекций names.
+
+        Коллекции, которых нет в кэше, разбираются в отдельном потоке - записи
+        в это время не ждут. Если документ перезаписали, пока его читали, результат
+        отбрасывается и чтение повторяется; последняя попытка выполняется прямо
+        в потоке event loop. Снимок собирается без await между коллекциями, а
+        транзакции выполняются в том же потоке, поэтому версии коллекций в нем
+        согласованы между собой.
+        """
+        for attempt in range(READ_SNAPSHOT_RETRIES + 1):
+            missing = [name for name in names if self.current(name) is None]
+            if not missing:
+                break
+            versions = {name: self.written.get(READ_COLLECTIONS[name][0], 0) for name in missing}
+            if attempt < READ_SNAPSHOT_RETRIES:
+                loaded = await asyncio.to_thread(
+                    lambda: {name: load_read_collection(self.storage, name) for name in missing}
+                )
+            else:
+                loaded = {name: load_read_collection(self.storage, name) for name in missing}
+            for name, collection in loaded.items():
+                if self.written.get(READ_COLLECTIONS[name][0], 0) == versions[name]:
+                    self.published[name] = (versions[name], collection)
+        return ReadSnapshot(self.version, {name: self.current(name) for name in names})
 
 def load_users():
-    return load_data(DATA_FILE)
+    return records_from_json(load_data(DATA_FILE), UserRecord)
 
-def save_users(users):
-    save_data(users, DATA_FILE)
+def save_users(users, uow=None):
+    save_data(records_to_json(users), DATA_FILE, uow)
 
 def load_tasks():
     return load_data(TASKS_FILE)
 
-def save_tasks(tasks):
-    save_data(tasks, TASKS_FILE)
+def save_tasks(tasks, uow=None):
+    save_data(tasks, TASKS_FILE, uow)
 
 def load_submissions():
-    return load_data(SUBMISSIONS_FILE)
+    return records_from_json(load_data(SUBMISSIONS_FILE), SubmissionRecord)
+
+def save_submissions(submissions, uow=None):
+    save_data(records_to_json(submissions), SUBMISSIONS_FILE, uow)
+
+def load_stats():
+    """Счетчики статистики; при первом запуске заполняются по существующим данным"""
+    if current_storage.get().exists(STATS_FILE):
+        return StatsRollup.from_json(load_data(STATS_FILE))
+    rollup = StatsRollup.backfill(load_users(), load_submissions(), load_orders())
+    save_stats(rollup)
+    return rollup
+
+def save_stats(rollup):
+    save_data(rollup.to_json(), STATS_FILE)
+    rollup.dirty = False
+
+def record_stat(context, event, amount=1):
+    """Учет события в счетчиках статистики; на диск они сбрасываются задачей flush_stats"""
+    context.bot_data['stats'].record(event, amount)
+
+def load_file_index():
+    """Индекс файлов отправок; при первом запуске строится по существующим отправкам"""
+    if current_storage.get().exists(FILE_INDEX_FILE):
+        return load_data(FILE_INDEX_FILE)
+    index = {}
+    for submission_id, submission in load_submissions().items():
+        index_submission_files(index, submission_id, submission.files)
+    save_file_index(index)
+    return index
+
+def save_file_index(index, uow=None):
+    save_data(index, FILE_INDEX_FILE, uow)
+
+def index_submission_files(index, submission_id, files):
+    for file_data in files:
+        file_unique_id = file_data.get('file_unique_id')
+        if file_unique_id:
+            submission_ids = index.setdefault(file_unique_id, [])
+            if submission_id not in submission_ids:
+                submission_ids.append(submission_id)
+
+def unindex_submission_files(index, submission_id, files):
+    for file_data in files:
+        submission_ids = index.get(file_data.get('file_unique_id'))
+        if submission_ids and submission_id in submission_ids:
+            submission_ids.remove(submission_id)
+            if not submission_ids:
+                del index[file_data['file_unique_id']]
+
+def find_duplicate_files(index, submission_id, files):
+    """ID других отправок с теми же файлами (по file_unique_id)"""
+    duplicates = []
+    for file_data in files:
+        for other_id in index.get(file_data.get('file_unique_id'), ()):
+            if other_id != submission_id and other_id not in duplicates:
+                duplicates.append(other_id)
+    return duplicates
+
+def load_reminders():
+    """Подписки на напоминания: множество пар (user_id, task_id)"""
+    return {
+        (user_id, task_id)
+        for user_id, task_ids in load_data(REMINDERS_FILE).items()
+        for task_id in task_ids
+    }
 
-def save_submissions(submissions):
-    save_data(submissions, SUBMISSIONS_FILE)
+def save_reminders(subscribers):
+    data = {}
+    for user_id, task_id in sorted(subscribers):
+        data.setdefault(user_id, []).append(task_id)
+    save_data(data, REMINDERS_FILE)
+
+class PointsLedger:
+    """Журнал начислений и списаний баллов (points_ledger.jsonl, только дописывается).
+
+    Строка журнала - JSON {seq, user_id, amount, earned, source, ref, admin_id,
+    note, time}: amount меняет points, earned - total_earned. Балансы в
+    users_data.json материализуются из журнала: запись журнала и новый баланс
+    сохраняются одной транзакцией UnitOfWork. offsets - индекс пользователь ->
+    смещения его строк в журнале, поэтому последние N операций читаются за N
+    позиционных чтений независимо от размера журнала. Индекс сохраняется
+    вместе со счетчиками статистики; при запуске дочитывается только хвост.
+    """
+
+    def __init__(self, storage):
+        self.storage = storage
+        self.offsets = {}
+        self.size = 0  # сколько байт файла учтено в индексе
+        self.next_seq = 1
+        self.dirty = False
+
+    @classmethod
+    def load(cls):
+        """Индекс из файла (если он соответствует журналу) плюс непрочитанный хвост журнала"""
+        storage = current_storage.get()
+        if not storage.exists(POINTS_LEDGER_FILE):
+            open_points_ledger(load_users())
+        ledger = cls(storage)
+        saved = load_data(POINTS_LEDGER_INDEX_FILE)
+        if saved and saved.get('size', 0) <= storage.log_size(POINTS_LEDGER_FILE):
+            ledger.offsets = saved['offsets']
+            ledger.size = saved['size']
+            ledger.next_seq = saved['next_seq']
+        ledger.refresh()
+        return ledger
+
+    def refresh(self):
+        """Дочитывает в индекс строки, дописанные после последнего чтения"""
+        for offset, line in self.storage.read_log(POINTS_LEDGER_FILE, self.size):
+            entry = json.loads(line)
+            self.offsets.setdefault(entry['user_id'], []).append(offset)
+            self.next_seq = entry['seq'] + 1
+            self.size = offset + len(line)
+            self.dirty = True
+
+    def stage(self, uow, entries):
+        """Добавляет записи в транзакцию; номера присваиваются по порядку журнала"""
+        self.refresh()
+        now = utc_now_iso()
+        lines = []
+        for seq, entry in enumerate(entries, self.next_seq):
+            lines.append(json.dumps({'seq': seq, **entry, 'time': now}, ensure_ascii=False) + '\n')
+        uow.append(POINTS_LEDGER_FILE, lines)
+
+    def history(self, user_id, limit=POINTS_HISTORY_LIMIT):
+        """Последние limit операций пользователя, новые первыми"""
+        self.refresh()
+        offsets = reversed(self.offsets.get(user_id, [])[-limit:])
+        return [json.loads(line) for line in self.storage.read_log_lines(POINTS_LEDGER_FILE, offsets)]
+
+    def totals(self, user_id):
+        """(points, total_earned) пользователя по журналу - для сверки с балансом"""
+        self.refresh()
+        points = earned = 0
+        for line in self.storage.read_log_lines(POINTS_LEDGER_FILE, self.offsets.get(user_id, [])):
+            entry = json.loads(line)
+            points += entry['amount']
+            earned += entry['earned']
+        return points, earned
+
+    def to_json(self):
+        return {'size': self.size, 'next_seq': self.next_seq, 'offsets': self.offsets}
+
+def save_points_ledger_index(ledger):
+    save_data(ledger.to_json(), POINTS_LEDGER_INDEX_FILE)
+    ledger.dirty = False
+
+def open_points_ledger(users):
+    """Новый журнал баллов: текущие балансы записываются как начальные остатки"""
+    lines = []
+    now = utc_now_iso()
+    for user_id, user in users.items():
+        if user.points or user.total_earned:
+            entry = ledger_entry(user_id, user.points, 'opening', earned=user.total_earned)
+            lines.append(json.dumps({'seq': len(lines) + 1, **entry, 'time': now}, ensure_ascii=False) + '\n')
+    # Журнал заменяется целиком, а индекс прежнего журнала удаляется в той же транзакции
+    uow = UnitOfWork()
+    uow.append(POINTS_LEDGER_FILE, lines, offset=0)
+    uow.delete(POINTS_LEDGER_INDEX_FILE)
+    if not uow.commit():
+        raise OSError("не удалось записать журнал баллов")
+    if lines:
+        logger.info(f"Журнал баллов создан: начальные остатки {len(lines)} пользователей")
+
+def ledger_entry(user_id, amount, source, ref=None, admin_id=None, note=None, earned=None):
+    """Запись журнала баллов; по умолчанию начисление увеличивает и total_earned"""
+    return {
+        'user_id': user_id,
+        'amount': amount,
+        'earned': (amount if amount > 0 else 0) if earned is None else earned,
+        'source': source,
+        'ref': ref,
+        'admin_id': admin_id,
+        'note': note,
+    }
+
+def apply_points(users, user_id, amount, source, ref=None, admin_id=None, note=None):
+    """Изменение баланса пользователя; возвращает запись для журнала баллов.
+
+    Начисление увеличивает points и total_earned, списание - только points.
+    Запись передается в PointsLedger.stage() той же транзакции, что и users.
+    """
+    entry = ledger_entry(user_id, amount, source, ref, admin_id, note)
+    users[user_id].points += entry['amount']
+    users[user_id].total_earned += entry['earned']
+    return entry
+
+def load_snapshot_manifest(snapshot_dir):
+    path = os.path.join(snapshot_dir, SNAPSHOT_MANIFEST_NAME)
+    manifest = {}
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    manifest.setdefault('snapshots', [])
+    return manifest
+
+def snapshot_line_digest(line):
+    return hashlib.sha256(line).hexdigest()[:24]
+
+def snapshot_entry_blobs(entry):
+    """Сжатые файлы записи снимка: документ - один, журнал - по куску на снимок"""
+    if entry is None:
+        return []
+    return entry['segments'] if 'segments' in entry else [entry['blob']]
+
+def collect_log_changes(storage, name, entry, token):
+    """Запись снимка журнала и строки, дописанные после прошлого снимка entry.
+
+    Журнал только дописывается, поэтому в снимках он хранится кусками: каждый
+    снимок читает и сжимает лишь новые строки, а запись перечисляет все куски
+    по порядку. Журнал, замененный с тех пор (сброс, восстановление снимка) -
+    его первая строка или последняя строка прошлого снимка стала другой, -
+    читается целиком, и куски начинаются заново.
+    """
+    base = None
+    if entry is not None and 'segments' in entry and storage.log_size(name) >= entry['size']:
+        expected = [entry['first'], entry['last'][1]] if entry['last'] else []
+        offsets = [0, entry['last'][0]] if entry['last'] else []
+        lines = storage.read_log_lines(name, offsets) if offsets else []
+        if [snapshot_line_digest(line) for line in lines] == expected:
+            base = entry
+    if base is None:
+        base = {'segments': [], 'size': 0, 'first': None, 'last': None}
+    new_lines = list(storage.read_log(name, base['size']))
+    result = dict(base, token=token)
+    if new_lines:
+        if result['first'] is None:
+            result['first'] = snapshot_line_digest(new_lines[0][1])
+        result['last'] = [new_lines[-1][0], snapshot_line_digest(new_lines[-1][1])]
+    return result, b''.join(line for _, line in new_lines)
+
+def collect_snapshot_changes(storage, manifest):
+    """Что изменилось с последнего снимка.
+
+    Неизменившиеся документы (та же версия в хранилище - Storage.version_token)
+    не читаются вовсе, их записи берутся из последнего снимка, а из журналов
+    (.jsonl) читаются только строки, дописанные после него. Вызывается в
+    потоке event loop: транзакции UnitOfWork тоже выполняются в нем, поэтому
+    прочитанные документы согласованы. Возвращает (записи, {имя: (содержимое,
+    версия) изменившихся документов}); для журналов содержимое - новые строки,
+    а запись уже подготовлена без их куска.
+    """
+    previous = manifest['snapshots'][-1]['files'] if manifest['snapshots'] else {}
+    entries = {}
+    changed = {}
+    for name in SNAPSHOT_FILES:
+        token = storage.version_token(name)
+        if token is None:
+            entries[name] = None
+            continue
+        entry = previous.get(name)
+        # Записи снимков прежних версий бота без token просто перечитываются один раз
+        if entry is not None and entry.get('token') == token:
+            entries[name] = entry
+            continue
+        if name.endswith('.jsonl'):
+            entries[name], content = collect_log_changes(storage, name, entry, token)
+            changed[name] = (content, token)
+            continue
+        changed[name] = (storage.read_bytes(name), token)
+    return entries, changed
+
+def write_snapshot_blob(blob_dir, name, content):
+    """Сжатый файл с содержимым content; одинаковое содержимое хранится один раз"""
+    digest = hashlib.sha256(content).hexdigest()
+    blob = f"{name}.{digest[:24]}.gz"
+    blob_path = os.path.join(blob_dir, blob)
+    if not os.path.exists(blob_path):
+        tmp_path = f"{blob_path}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(gzip.compress(content, compresslevel=6))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, blob_path)
+    return blob
+
+def write_snapshot(snapshot_dir, manifest, entries, changed, reason, force=False, now=None):
+    """Сжимает изменившиеся документы, дописывает снимок в манифест и удаляет устаревшие.
+
+    Выполняется в отдельном потоке. Документ с тем же содержимым, что уже есть
+    в каталоге снимков, не записывается повторно. Возвращает снимок или None,
+    если ничего не изменилось и force не задан.
+    """
+    now = datetime.now(timezone.utc) if now is None else now
+    previous = manifest['snapshots'][-1]['files'] if manifest['snapshots'] else {}
+    manifest_path = os.path.join(snapshot_dir, SNAPSHOT_MANIFEST_NAME)
+    blob_dir = os.path.join(snapshot_dir, SNAPSHOT_BLOB_DIR_NAME)
+    os.makedirs(blob_dir, exist_ok=True)
+    for name, (content, token) in changed.items():
+        if name.endswith('.jsonl'):
+            # Новые строки журнала - еще один кусок к кускам прошлого снимка
+            if content:
+                entry = entries[name]
+                entry['segments'] = entry['segments'] + [write_snapshot_blob(blob_dir, name, content)]
+                entry['size'] += len(content)
+            continue
+        entries[name] = {'blob': write_snapshot_blob(blob_dir, name, content), 'size': len(content), 'token': token}
+    changed_names = [
+        name for name, entry in entries.items()
+        if snapshot_entry_blobs(entry) != snapshot_entry_blobs(previous.get(name))
+    ]
+    if not changed_names and not force:
+        # Документы перезаписаны без изменений - запоминаем новые версии, чтобы не читать их снова
+        if manifest['snapshots'] and changed:
+            manifest['snapshots'][-1]['files'] = entries
+            write_json_atomic(manifest, manifest_path)
+        return None
+
+    snapshot_id = now.strftime('%Y%m%dT%H%M%SZ')
+    existing_ids = {snapshot['id'] for snapshot in manifest['snapshots']}
+    suffix = 2
+    while snapshot_id in existing_ids:
+        snapshot_id = f"{now.strftime('%Y%m%dT%H%M%SZ')}-{suffix}"
+        suffix += 1
+    snapshot = {
+        'id': snapshot_id,
+        'created_at': now.isoformat(),
+        'reason': reason,
+        'changed': changed_names,
+        'files': entries,
+    }
+    manifest['snapshots'].append(snapshot)
+
+    # Ротация по возрасту; последний снимок хранится всегда
+    cutoff = now - timedelta(days=SNAPSHOT_RETENTION_DAYS)
+    manifest['snapshots'] = [
+        item for item in manifest['snapshots'][:-1]
+        if datetime.fromisoformat(item['created_at']) >= cutoff
+    ] + manifest['snapshots'][-1:]
+    write_json_atomic(manifest, manifest_path)
+
+    # Сжатые файлы удаляются только после записи манифеста без ссылок на них
+    referenced = {
+        blob for item in manifest['snapshots'] for entry in item['files'].values()
+        for blob in snapshot_entry_blobs(entry)
+    }
+    for name in os.listdir(blob_dir):
+        if name not in referenced:
+            os.remove(os.path.join(blob_dir, name))
+    return snapshot
+
+async def create_snapshot(bot_data, reason, force=False):
+    """Снимок данных; вызывающий держит bot_data['snapshot_lock'].
+
+    None, если ничего не изменилось (и force не задан) или хранилище не
+    поддерживает снимки (Storage.snapshot_dir).
+    """
+    storage = bot_data['storage']
+    if storage.snapshot_dir is None:
+        return None
+    stats = bot_data.get('stats')
+    if stats is not None and stats.dirty:
+        save_stats(stats)
+    manifest = load_snapshot_manifest(storage.snapshot_dir)
+    entries, changed = collect_snapshot_changes(storage, manifest)
+    snapshot = await asyncio.to_thread(
+        write_snapshot, storage.snapshot_dir, manifest, entries, changed, reason, force
+    )
+    if snapshot is not None:
+        changed_bytes = sum(len(content) for content, _ in changed.values())
+        storage_logger.warning(
+            f"Снимок {snapshot['id']} ({reason}): изменено {', '.join(snapshot['changed']) or 'ничего'}, "
+            f"прочитано {changed_bytes / 1024:.1f} КБ"
+        )
+    return snapshot
+
+def read_snapshot_files(snapshot_dir, snapshot):
+    """Содержимое коллекций снимка: {имя документа: данные или None, если его не было}.
+
+    JSON-коллекции разбираются, журнал баллов (.jsonl) собирается из кусков
+    и возвращается как байты.
+    """
+    result = {}
+    for name, entry in snapshot['files'].items():
+        if entry is None:
+            result[name] = None
+            continue
+        parts = []
+        for blob in snapshot_entry_blobs(entry):
+            with open(os.path.join(snapshot_dir, SNAPSHOT_BLOB_DIR_NAME, blob), 'rb') as f:
+                parts.append(gzip.decompress(f.read()))
+        content = b''.join(parts)
+        result[name] = content if name.endswith('.jsonl') else json.loads(content)
+    return result
+
+def apply_snapshot_files(storage, files):
+    """Одна транзакция UnitOfWork: коллекции снимка заменяют текущие документы"""
+    uow = UnitOfWork(storage)
+    for name, data in files.items():
+        if isinstance(data, bytes):
+            # Журнал баллов заменяется целиком в той же транзакции
+            uow.append(name, [data.decode('utf-8')], offset=0)
+        elif data is not None:
+            # Снимок мог быть сделан до последнего обновления схемы
+            save_data(upgrade_collection(data, name), name, uow)
+        elif storage.exists(name):
+            # Документы, которых не было в момент снимка (счетчики, индексы, журнал), строятся заново
+            uow.delete(name)
+    # Индекс журнала баллов относится к прежнему журналу
+    uow.delete(POINTS_LEDGER_INDEX_FILE)
+    return uow.commit()
 
 def get_main_keyboard(user_id=None):
     """Главная клавиатура с кнопками"""
@@ -167,13 +2752,14 @@ def get_admin_keyboard():
         [KeyboardButton("📦 Список товаров"), KeyboardButton("🗑️ Удалить товар")],
         [KeyboardButton("🆔 Исправить ID"), KeyboardButton("🗑️ Сбросить пользователей")],
         [KeyboardButton("🗑️ Удалить задание"), KeyboardButton("📊 Статистика")],
-        [KeyboardButton("🔙 Главное меню")]
+        [KeyboardButton("📦 Массовая проверка"), KeyboardButton("⭐ Баллы списком")],
+        [KeyboardButton("📤 Экспорт данных"), KeyboardButton("🔙 Главное меню")]
     ]
     return ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
 
 def is_admin(user_id):
-    """Проверка, является ли пользователь администратором"""
-    return user_id in ADMIN_IDS
+    """Проверка, является ли пользователь администратором текущего сообщества"""
+    return user_id in current_tenant.get().admin_ids
 
 def generate_unique_id(items):
     """Генерация уникального ID"""
@@ -183,8 +2769,9 @@ def generate_unique_id(items):
     # Собираем все существующие ID
     existing_ids = []
     for user_data in items.values():
-        if 'unique_id' in user_data:
-            existing_ids.append(user_data['unique_id'])
+        unique_id = getattr(user_data, 'unique_id', None)
+        if unique_id is not None:
+            existing_ids.append(unique_id)
 
     # Если нет ID, начинаем с 1
     if not existing_ids:
@@ -202,8 +2789,8 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_data = users[str(user_id)]
         await update.message.reply_text(
             f"✅ Вы уже зарегистрированы!\n\n"
-            f"👤 Имя: {user_data['first_name']} {user_data['surname']}\n"
-            f"🆔 Ваш ID: #{user_data['unique_id']}\n\n"
+            f"👤 Имя: {user_data.first_name} {user_data.surname}\n"
+            f"🆔 Ваш ID: #{user_data.unique_id}\n\n"
             f"Используйте кнопки ниже для работы с ботом.",
             reply_markup=get_main_keyboard(user_id)
         )
@@ -273,16 +2860,17 @@ async def register_surname(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Генерируем уникальный ID
     unique_id = generate_unique_id(users)
 
-    users[user_id] = {
-    'first_name': first_name,
-    'surname': surname,
-    'name': f"{first_name} {surname}",
-    'unique_id': unique_id,
-    'points': 0,           # Текущие баллы (списываются при покупках)
-    'total_earned': 0,     # Всего заработано (не списывается, только начисляется)
-    'registered_at': update.message.date.isoformat()
-}
+    users[user_id] = UserRecord(
+        first_name=first_name,
+        surname=surname,
+        name=f"{first_name} {surname}",
+        unique_id=unique_id,
+        points=0,           # Текущие баллы (списываются при покупках)
+        total_earned=0,     # Всего заработано (не списывается, только начисляется)
+        registered_at=update.message.date.isoformat()
+    )
     save_users(users)
+    record_stat(context, 'registrations')
 
     logger.info(f"Зарегистрирован новый пользователь: {first_name} {surname} (ID: {unique_id})")
 
@@ -304,7 +2892,7 @@ async def register_surname(update: Update, context: ContextTypes.DEFAULT_TYPE):
 async def show_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать рейтинг участников"""
     user_id = str(update.effective_user.id)
-    users = load_users()
+    users = (await context.bot_data['storage'].read_store.snapshot('users')).users
 
     if user_id not in users:
         await update.message.reply_text(
@@ -324,7 +2912,7 @@ async def show_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Сортируем пользователей по total_earned (всего заработано)
     sorted_users = sorted(
         users.items(),
-        key=lambda x: x[1]['total_earned'],  # Изменено с 'points' на 'total_earned'
+        key=lambda x: x[1].total_earned,  # Изменено с 'points' на 'total_earned'
         reverse=True
     )
 
@@ -339,10 +2927,10 @@ async def show_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
         elif index == 3:
             medal = "🥉 "
 
-        user_name = f"{user_data['first_name']} {user_data['surname']}"
+        user_name = f"{user_data.first_name} {user_data.surname}"
 
         rating_text += (
-            f"{medal}<b>{index}.</b> {user_name} - {user_data['total_earned']} баллов\n"
+            f"{medal}<b>{index}.</b> {user_name} - {user_data.total_earned} баллов\n"
         )
 
         if index % 5 == 0 and index < len(sorted_users):
@@ -351,7 +2939,7 @@ async def show_rating(update: Update, context: ContextTypes.DEFAULT_TYPE):
     # Добавляем статистику
     total_users = len(users)
     # Считаем по total_earned
-    total_points = sum(user['total_earned'] for user in users.values())
+    total_points = sum(user.total_earned for user in users.values())
     average_points = total_points / total_users if total_users > 0 else 0
 
     rating_text += f"\n📈 <b>Статистика:</b>\n"
@@ -380,12 +2968,13 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     profile_text = (
         "👤 <b>Ваш профиль</b>\n\n"
-        f"📝 Имя: {user_data['first_name']}\n"
-        f"📝 Фамилия: {user_data['surname']}\n"
-        f"🆔 Уникальный ID: #{user_data['unique_id']}\n"
-        f"💰 Текущие баллы: {user_data['points']}\n"
-        f"⭐ Всего заработано: {user_data['total_earned']}\n"
-        f"📅 Зарегистрирован: {user_data.get('registered_at', 'Неизвестно')}"
+        f"📝 Имя: {user_data.first_name}\n"
+        f"📝 Фамилия: {user_data.surname}\n"
+        f"🆔 Уникальный ID: #{user_data.unique_id}\n"
+        f"💰 Текущие баллы: {user_data.points}\n"
+        f"⭐ Всего заработано: {user_data.total_earned}\n"
+        f"📅 Зарегистрирован: {format_local_time(user_data.registered_at)}\n\n"
+        f"🧾 История операций с баллами: /history"
     )
 
     await update.message.reply_text(
@@ -394,10 +2983,50 @@ async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=get_main_keyboard(update.effective_user.id)
     )
     
+def format_ledger_entries(entries):
+    """Строки истории операций с баллами (новые первыми)"""
+    lines = []
+    for entry in entries:
+        reference = f" #{entry['ref']}" if entry.get('ref') else ""
+        note = f" - {html.escape(entry['note'])}" if entry.get('note') else ""
+        lines.append(
+            f"{'➕' if entry['amount'] >= 0 else '➖'} <b>{entry['amount']:+d}</b> "
+            f"{LEDGER_SOURCE_TITLES.get(entry['source'], entry['source'])}{reference}{note}\n"
+            f"    <i>{format_local_time(entry['time'])}</i>"
+        )
+    return lines
+
+async def points_history(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Последние операции с баллами пользователя (по индексу журнала баллов)"""
+    user_id = str(update.effective_user.id)
+    users = load_users()
+
+    if user_id not in users:
+        await update.message.reply_text(
+            "❌ Вы не зарегистрированы. Используйте команду /start для регистрации."
+        )
+        return
+
+    entries = context.bot_data['points_ledger'].history(user_id)
+    if not entries:
+        text = "🧾 Операций с баллами пока не было."
+    else:
+        text = (
+            f"🧾 <b>Последние операции с баллами</b> (до {POINTS_HISTORY_LIMIT}):\n\n"
+            + "\n".join(format_ledger_entries(entries))
+            + f"\n\n💰 Текущие баллы: {users[user_id].points}"
+        )
+    await update.message.reply_text(
+        text,
+        parse_mode='HTML',
+        reply_markup=get_main_keyboard(update.effective_user.id)
+    )
+
 async def shop(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Показать магазин товаров"""
     user_id = str(update.effective_user.id)
-    users = load_users()
+    snapshot = await context.bot_data['storage'].read_store.snapshot('users', 'products')
+    users, products = snapshot.users, snapshot.products
 
     if user_id not in users:
         await update.message.reply_text(
@@ -405,7 +3034,9 @@ async def shop(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ConversationHandler.END
 
-    products = load_products()
+    stock = context.bot_data['stock']
+    # Вернувшийся к списку товаров покупатель отказался от забронированного
+    stock.release(user_id)
     user_data = users[user_id]
 
     if not products:
@@ -418,14 +3049,19 @@ async def shop(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ConversationHandler.END
 
-    shop_text = f"🛍️ <b>Магазин товаров</b>\n\n💳 <b>Ваш баланс:</b> {user_data['points']} баллов\n\n"
+    shop_text = f"🛍️ <b>Магазин товаров</b>\n\n💳 <b>Ваш баланс:</b> {user_data.points} баллов\n\n"
 
     for product_id, product in products.items():
-        quantity_text = "∞" if product.get('quantity', 0) == 0 else f"{product.get('quantity', 0)} шт."
-        available = product.get('quantity', 0) == 0 or product.get('quantity', 0) > product.get('sold', 0)
+        quantity_text = "∞" if product['quantity'] == 0 else f"{product['quantity']} шт."
+        available = stock.available(product_id, user_id) != 0
 
         status_icon = "✅" if available else "❌"
-        status_text = "Доступен" if available else "Нет в наличии"
+        if available:
+            status_text = "Доступен ⚡ флеш-распродажа" if product['flash_sale'] else "Доступен"
+        elif stock.remaining.get(product_id):
+            status_text = "Все экземпляры забронированы, загляните через несколько минут"
+        else:
+            status_text = "Нет в наличии"
 
         shop_text += (
             f"{status_icon} <b>Товар #{product_id}</b> - {status_text}\n"
@@ -440,13 +3076,18 @@ async def shop(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Создаем клавиатуру с товарами
     keyboard = []
-    for product_id, product in products.items():
-        available = product.get('quantity', 0) == 0 or product.get('quantity', 0) > product.get('sold', 0)
-        if available:
+    for product_id in products:
+        if stock.available(product_id, user_id) != 0:
             keyboard.append([KeyboardButton(f"🛒 Купить товар #{product_id}")])
 
     if not keyboard:
-        shop_text = "🛍️ <b>Магазин</b>\n\n❌ На данный момент все товары распроданы."
+        if any(stock.remaining.get(product_id) for product_id in products):
+            shop_text = (
+                "🛍️ <b>Магазин</b>\n\n⏳ Все оставшиеся товары сейчас забронированы другими покупателями. "
+                "Загляните через несколько минут."
+            )
+        else:
+            shop_text = "🛍️ <b>Магазин</b>\n\n❌ На данный момент все товары распроданы."
         await update.message.reply_text(
             shop_text,
             parse_mode='HTML',
@@ -469,6 +3110,7 @@ async def buy_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text = update.message.text
 
     if text == "🔙 Назад":
+        context.bot_data['stock'].release(str(update.effective_user.id))
         await update.message.reply_text(
             "🔙 Возврат в главное меню.",
             reply_markup=get_main_keyboard(update.effective_user.id)
@@ -486,8 +3128,8 @@ async def buy_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return USER_BUY_PRODUCT
 
     user_id = str(update.effective_user.id)
-    users = load_users()
-    products = load_products()
+    snapshot = await context.bot_data['storage'].read_store.snapshot('users', 'products')
+    users, products = snapshot.users, snapshot.products
 
     if user_id not in users:
         await update.message.reply_text(
@@ -506,22 +3148,38 @@ async def buy_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user_data = users[user_id]
     product = products[product_id]
 
-    # Проверяем доступность товара
-    available = product.get('quantity', 0) == 0 or product.get('quantity', 0) > product.get('sold', 0)
-    if not available:
-        await update.message.reply_text(
-            "❌ Этот товар закончился.",
-            reply_markup=get_main_keyboard(update.effective_user.id)
-        )
+    stock = context.bot_data['stock']
+    flash_sales = context.bot_data['flash_sales']
+    if product_id in flash_sales.enabled:
+        # На распродаже товар не бронируется: очередность решает очередь заявок
+        if stock.remaining.get(product_id, 0) == 0:
+            await update.message.reply_text(
+                "❌ Товар распродан.",
+                reply_markup=get_main_keyboard(update.effective_user.id)
+            )
+            return ConversationHandler.END
+    # Бронируем единицу товара на время подтверждения
+    elif not stock.reserve(product_id, user_id):
+        if stock.remaining.get(product_id):
+            text = "⏳ Все оставшиеся экземпляры сейчас забронированы другими покупателями. Загляните через несколько минут."
+        else:
+            text = "❌ Этот товар закончился."
+        await update.message.reply_text(text, reply_markup=get_main_keyboard(update.effective_user.id))
         return ConversationHandler.END
 
-    # Сохраняем выбранный товар в контексте
-    context.user_data['selected_product'] = product
+    # Сохраняем выбранный товар в контексте (копию: товары снимка общие для всех читателей)
+    context.user_data['selected_product'] = dict(product)
     context.user_data['selected_product_id'] = product_id
 
     # Показываем подтверждение покупки
-    quantity_text = "без ограничений" if product.get('quantity', 0) == 0 else f"{product.get('quantity', 0)} шт."
-    remaining = product.get('quantity', 0) - product.get('sold', 0) if product.get('quantity', 0) > 0 else "∞"
+    quantity_text = "без ограничений" if product['quantity'] == 0 else f"{product['quantity']} шт."
+    remaining = stock.remaining[product_id] if product['quantity'] > 0 else "∞"
+    if product_id in flash_sales.enabled:
+        reservation_text = "⚡ Флеш-распродажа: заявки решаются строго по очереди подтверждений.\n\n"
+    elif product['quantity'] > 0:
+        reservation_text = f"⏳ Один экземпляр забронирован за вами на {max(stock.ttl / 60, 1):.0f} мин.\n\n"
+    else:
+        reservation_text = ""
 
     confirmation_text = (
         f"🛒 <b>Подтверждение покупки</b>\n\n"
@@ -530,8 +3188,9 @@ async def buy_product(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"💰 <b>Цена:</b> {product['price']} баллов\n"
         f"📦 <b>В наличии:</b> {quantity_text}\n"
         f"🔢 <b>Осталось:</b> {remaining} шт.\n\n"
-        f"💳 <b>Ваш баланс:</b> {user_data['points']} баллов\n"
-        f"🔮 <b>Останется после покупки:</b> {user_data['points'] - product['price']} баллов\n\n"
+        f"💳 <b>Ваш баланс:</b> {user_data.points} баллов\n"
+        f"🔮 <b>Останется после покупки:</b> {user_data.points - product['price']} баллов\n\n"
+        f"{reservation_text}"
         f"<b>Вы уверены, что хотите купить этот товар?</b>"
     )
 
@@ -556,7 +3215,10 @@ async def confirm_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if text == "🔙 Назад к товарам":
         return await shop(update, context)
 
+    stock = context.bot_data['stock']
+    user_id = str(update.effective_user.id)
     if text in ["❌ Нет, отменить", "🔙 Назад"]:
+        stock.release(user_id)
         await update.message.reply_text(
             "❌ Покупка отменена.",
             reply_markup=get_main_keyboard(update.effective_user.id)
@@ -581,12 +3243,23 @@ async def confirm_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return ConversationHandler.END
 
-    user_id = str(update.effective_user.id)
+    if product_id in context.bot_data['flash_sales'].enabled:
+        return await submit_flash_purchase(update, context, product_id)
+
+    # Бронь могла истечь: тогда пробуем забронировать заново
+    if not stock.holds_product(user_id, product_id) and not stock.reserve(product_id, user_id):
+        await update.message.reply_text(
+            "⌛ Бронь истекла, а свободных экземпляров товара не осталось.",
+            reply_markup=get_main_keyboard(update.effective_user.id)
+        )
+        return ConversationHandler.END
+
     users = load_users()
     products = load_products()
 
     # Обновляем данные товара (на случай изменений)
     if product_id not in products:
+        stock.remove_product(product_id)
         await update.message.reply_text(
             "❌ Товар больше не доступен.",
             reply_markup=get_main_keyboard(update.effective_user.id)
@@ -596,9 +3269,11 @@ async def confirm_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
     product = products[product_id]
     user_data = users[user_id]
 
-    # Проверяем доступность товара еще раз
-    available = product.get('quantity', 0) == 0 or product.get('quantity', 0) > product.get('sold', 0)
+    # Бронь гарантирует единицу товара, если остатки в памяти совпадают с файлом
+    available = product['quantity'] == 0 or product['quantity'] > product['sold']
     if not available:
+        stock.release(user_id)
+        stock.update_product(product_id, product)
         await update.message.reply_text(
             "❌ Этот товар закончился.",
             reply_markup=get_main_keyboard(update.effective_user.id)
@@ -606,52 +3281,67 @@ async def confirm_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return ConversationHandler.END
 
     # Проверяем достаточно ли баллов
-    if user_data['points'] < product['price']:
+    if user_data.points < product['price']:
+        stock.release(user_id)
         await update.message.reply_text(
             f"❌ <b>Недостаточно баллов!</b>\n\n"
             f"💰 Стоимость товара: {product['price']} баллов\n"
-            f"💳 Ваш баланс: {user_data['points']} баллов\n"
-            f"🔻 Не хватает: {product['price'] - user_data['points']} баллов\n\n"
+            f"💳 Ваш баланс: {user_data.points} баллов\n"
+            f"🔻 Не хватает: {product['price'] - user_data.points} баллов\n\n"
             f"Пополните баланс и попробуйте снова!",
             parse_mode='HTML',
             reply_markup=get_main_keyboard(update.effective_user.id)
         )
         return ConversationHandler.END
 
-    # Списываем баллы из текущих (points), но total_earned остается неизменным
-    users[user_id]['points'] -= product['price']
-    save_users(users)
+    # Списание, остаток товара и заказ сохраняются одной транзакцией
+    uow = UnitOfWork()
 
     # Обновляем количество товара
-    if product.get('quantity', 0) > 0:
-        products[product_id]['sold'] = products[product_id].get('sold', 0) + 1
-    save_products(products)
+    if product['quantity'] > 0:
+        products[product_id]['sold'] = products[product_id]['sold'] + 1
+    save_products(products, uow)
 
     # Создаем заказ
     orders = load_orders()
-    order_id = generate_unique_id(orders)
+    order_id = str(generate_task_id(orders))
+
+    orders[order_id] = OrderRecord(
+        user_id=user_id,
+        product_id=product_id,
+        product_name=product['name'],
+        price=product['price'],
+        order_time=utc_now_iso(),
+        status='completed'
+    )
+    save_orders(orders, uow)
 
-    orders[order_id] = {
-        'user_id': user_id,
-        'user_name': f"{user_data['first_name']} {user_data['surname']}",
-        'user_unique_id': user_data['unique_id'],
-        'product_id': product_id,
-        'product_name': product['name'],
-        'product_description': product['description'],
-        'price': product['price'],
-        'order_time': datetime.now().isoformat(),
-        'status': 'completed'
-    }
-    save_orders(orders)
+    # Списываем баллы из текущих (points), но total_earned остается неизменным
+    entry = apply_points(users, user_id, -product['price'], 'purchase', ref=order_id)
+    save_users(users, uow)
+    context.bot_data['points_ledger'].stage(uow, [entry])
+
+    if not uow.commit():
+        stock.release(user_id)
+        await update.message.reply_text(
+            "❌ Не удалось оформить покупку, баллы не списаны. Попробуйте позже.",
+            reply_markup=get_main_keyboard(update.effective_user.id)
+        )
+        return ConversationHandler.END
+    # Бронь израсходована: единица товара теперь учтена в sold
+    stock.release(user_id)
+    stock.update_product(product_id, products[product_id])
+    record_stat(context, 'orders')
+    record_stat(context, 'points_spent', product['price'])
 
     # Уведомляем администраторов
-    for admin_id in ADMIN_IDS:
+    for admin_id in current_tenant.get().admin_ids:
         try:
-            remaining = "∞" if product.get('quantity', 0) == 0 else product.get('quantity', 0) - products[product_id]['sold']
+            remaining = "∞" if product['quantity'] == 0 else product['quantity'] - products[product_id]['sold']
             await context.bot.send_message(
                 chat_id=admin_id,
                 text=f"🛒 <b>Новая покупка!</b>\n\n"
-                     f"👤 <b>Покупатель:</b> {user_data['first_name']} {user_data['surname']} (ID: #{user_data['unique_id']})\n"
+                     f"👤 <b>Покупатель:</b> {user_data.first_name} {user_data.surname} (ID: #{user_data.unique_id})\n"
                      f"🎁 <b>Товар:</b> {product['name']}\n"
                      f"💰 <b>Цена:</b> {product['price']} баллов\n"
                      f"📦 <b>Осталось:</b> {remaining} шт.\n"
@@ -662,14 +3352,14 @@ async def confirm_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
         except Exception as e:
             logger.error(f"Не удалось отправить уведомление администратору {admin_id}: {e}")
 
-    remaining_text = "∞" if product.get('quantity', 0) == 0 else product.get('quantity', 0) - products[product_id]['sold']
+    remaining_text = "∞" if product['quantity'] == 0 else product['quantity'] - products[product_id]['sold']
 
     await update.message.reply_text(
         f"🎉 <b>Поздравляем с покупкой!</b>\n\n"
         f"🎁 <b>Товар:</b> {product['name']}\n"
         f"📝 <b>Описание:</b> {product['description']}\n"
         f"💰 <b>Списано:</b> {product['price']} баллов\n"
-        f"💳 <b>Остаток на балансе:</b> {users[user_id]['points']} баллов\n"
+        f"💳 <b>Остаток на балансе:</b> {users[user_id].points} баллов\n"
         f"📦 <b>Осталось товара:</b> {remaining_text} шт.\n"
         f"🆔 <b>Номер заказа:</b> #{order_id}\n\n"
         f"Спасибо за покупку! 🎊",
@@ -682,7 +3372,198 @@ async def confirm_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
     context.user_data.pop('selected_product_id', None)
 
     return ConversationHandler.END
-    
+
+async def submit_flash_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE, product_id):
+    """Подтверждение покупки товара на флеш-распродаже: заявка в очередь или сразу отказ"""
+    user_id = str(update.effective_user.id)
+    flash_sales = context.bot_data['flash_sales']
+    context.user_data.pop('selected_product', None)
+    context.user_data.pop('selected_product_id', None)
+
+    # Распроданный товар не ставится в очередь. Стоящие в очереди заявки в расчет не
+    # берутся: какая-то из них может не пройти (не хватит баллов), и тогда экземпляр
+    # должен достаться следующему по очереди
+    if context.bot_data['stock'].remaining.get(product_id, 0) == 0:
+        flash_sales.outcomes[product_id, 'sold_out'] += 1
+        await update.message.reply_text(
+            "❌ Товар распродан.",
+            reply_markup=get_main_keyboard(update.effective_user.id)
+        )
+        return ConversationHandler.END
+
+    if not flash_sales.submit(context.application, product_id, user_id, update.effective_chat.id):
+        await update.message.reply_text(
+            "⏳ Ваша заявка на этот товар уже в очереди, ответ придет через мгновение.",
+            reply_markup=get_main_keyboard(update.effective_user.id)
+        )
+    # Результат - покупку или отказ - пришлет обработчик очереди после записи пакета
+    return ConversationHandler.END
+
+def process_flash_batch(bot_data, product_id, batch):
+    """Решение пакета заявок флеш-распродажи по порядку очереди и запись одной транзакцией.
+
+    Данные читаются один раз на пакет, а не на заявку. Возвращает ответы
+    покупателям и сводку администраторам [(chat_id, text, reply_markup)].
+    """
+    started = time.perf_counter()
+    stock = bot_data['stock']
+    flash_sales = bot_data['flash_sales']
+    users = load_users()
+    products = load_products()
+
+    if product_id not in products:
+        stock.remove_product(product_id)
+        flash_sales.enabled.discard(product_id)
+        return [
+            (chat_id, "❌ Товар больше не доступен.", get_main_keyboard(int(user_id)))
+            for user_id, chat_id in batch
+        ]
+
+    product = products[product_id]
+    orders = load_orders()
+    next_order_id = generate_task_id(orders)
+    decisions = []  # (user_id, chat_id, решение, номер заказа)
+    entries = []
+
+    for user_id, chat_id in batch:
+        if user_id not in users:
+            decisions.append((user_id, chat_id, 'unregistered', None))
+        elif product['quantity'] > 0 and product['sold'] >= product['quantity']:
+            decisions.append((user_id, chat_id, 'sold_out', None))
+        elif users[user_id].points < product['price']:
+            decisions.append((user_id, chat_id, 'no_points', None))
+        else:
+            order_id = str(next_order_id)
+            next_order_id += 1
+            if product['quantity'] > 0:
+                product['sold'] += 1
+            orders[order_id] = OrderRecord(
+                user_id=user_id,
+                product_id=product_id,
+                product_name=product['name'],
+                price=product['price'],
+                order_time=utc_now_iso(),
+                status='completed'
+            )
+            entries.append(apply_points(users, user_id, -product['price'], 'purchase', ref=order_id))
+            decisions.append((user_id, chat_id, 'ok', order_id))
+
+    sold = [order_id for _, _, outcome, order_id in decisions if outcome == 'ok']
+    if sold:
+        uow = UnitOfWork()
+        save_products(products, uow)
+        save_orders(orders, uow)
+        save_users(users, uow)
+        bot_data['points_ledger'].stage(uow, entries)
+        if not uow.commit():
+            decisions = [
+                (user_id, chat_id, 'failed' if outcome == 'ok' else outcome, None)
+                for user_id, chat_id, outcome, _ in decisions
+            ]
+            sold = []
+        else:
+            stock.update_product(product_id, product)
+            bot_data['stats'].record('orders', len(sold))
+            bot_data['stats'].record('points_spent', product['price'] * len(sold))
+
+    remaining_text = "∞" if product['quantity'] == 0 else product['quantity'] - product['sold']
+    messages = []
+    for user_id, chat_id, outcome, order_id in decisions:
+        flash_sales.outcomes[product_id, outcome] += 1
+        if outcome == 'ok':
+            text = (
+                f"🎉 <b>Поздравляем с покупкой!</b>\n\n"
+                f"🎁 <b>Товар:</b> {product['name']}\n"
+                f"📝 <b>Описание:</b> {product['description']}\n"
+                f"💰 <b>Списано:</b> {product['price']} баллов\n"
+                f"💳 <b>Остаток на балансе:</b> {users[user_id].points} баллов\n"
+                f"📦 <b>Осталось товара:</b> {remaining_text} шт.\n"
+                f"🆔 <b>Номер заказа:</b> #{order_id}\n\n"
+                f"Спасибо за покупку! 🎊"
+            )
+        elif outcome == 'sold_out':
+            text = "❌ Товар распродан: последние экземпляры достались покупателям, подтвердившим покупку раньше."
+        elif outcome == 'no_points':
+            text = (
+                f"❌ <b>Недостаточно баллов!</b>\n\n"
+                f"💰 Стоимость товара: {product['price']} баллов\n"
+                f"💳 Ваш баланс: {users[user_id].points} баллов\n"
+                f"🔻 Не хватает: {product['price'] - users[user_id].points} баллов\n\n"
+                f"Пополните баланс и попробуйте снова!"
+            )
+        elif outcome == 'unregistered':
+            text = "❌ Вы не зарегистрированы. Используйте команду /start для регистрации."
+        else:
+            text = "❌ Не удалось оформить покупку, баллы не списаны. Попробуйте позже."
+        messages.append((chat_id, text, get_main_keyboard(int(user_id))))
+
+    refused = len(decisions) - len(sold)
+    logger.info(
+        f"Флеш-распродажа товара #{product_id}: пакет из {len(batch)} заявок, продано {len(sold)}, "
+        f"отказов {refused}, осталось {remaining_text}, {(time.perf_counter() - started) * 1000:.1f} мс"
+    )
+    if sold:
+        orders_text = f"#{sold[0]}" if len(sold) == 1 else f"#{sold[0]}–#{sold[-1]}"
+        summary = (
+            f"⚡ <b>Флеш-распродажа</b>\n\n"
+            f"🎁 <b>Товар #{product_id}:</b> {product['name']}\n"
+            f"🛒 <b>Продано в пакете:</b> {len(sold)} (заказы {orders_text})\n"
+            f"❌ <b>Отказов:</b> {refused}\n"
+            f"📦 <b>Осталось:</b> {remaining_text} шт.\n"
+            f"🕒 <b>Время:</b> {datetime.now().strftime('%Y-%m-%d %H:%M')}"
+        )
+        messages.extend((admin_id, summary, None) for admin_id in current_tenant.get().admin_ids)
+    return messages
+
+async def admin_flash_sale(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Включение и выключение флеш-распродажи товара: /flash ID on|off"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет доступа.")
+        return
+
+    flash_sales = context.bot_data['flash_sales']
+    if len(context.args) != 2 or context.args[1] not in ('on', 'off'):
+        lines = [
+            "⚡ <b>Флеш-распродажи</b>\n",
+            "Покупки товара на распродаже встают в общую очередь и решаются пакетами, без броней.",
+            "Включить: /flash ID on\nВыключить: /flash ID off\n",
+        ]
+        if flash_sales.enabled:
+            lines.append("<b>Сейчас на распродаже:</b>")
+            for product_id in sorted(flash_sales.enabled, key=int):
+                lines.append(
+                    f"Товар #{product_id}: продано {flash_sales.outcomes[product_id, 'ok']}, "
+                    f"распродано для {flash_sales.outcomes[product_id, 'sold_out']}, "
+                    f"в очереди {flash_sales.pending(product_id)}"
+                )
+        else:
+            lines.append("Сейчас распродаж нет.")
+        await update.message.reply_text("\n".join(lines), parse_mode='HTML', reply_markup=get_admin_keyboard())
+        return
+
+    product_id = context.args[0].lstrip('#')
+    enabled = context.args[1] == 'on'
+    products = load_products()
+    if product_id not in products:
+        await update.message.reply_text("❌ Товар не найден.", reply_markup=get_admin_keyboard())
+        return
+
+    products[product_id]['flash_sale'] = enabled
+    save_products(products)
+    if enabled:
+        flash_sales.enabled.add(product_id)
+        # Брони прежнего режима больше не учитываются: их владельцы встанут в очередь наравне со всеми
+        context.bot_data['stock'].release_product(product_id)
+    else:
+        flash_sales.enabled.discard(product_id)
+    logger.info(f"Флеш-распродажа товара #{product_id} {'включена' if enabled else 'выключена'} администратором {update.effective_user.id}")
+
+    await update.message.reply_text(
+        f"⚡ Флеш-распродажа товара #{product_id} ({products[product_id]['name']}) "
+        f"{'включена' if enabled else 'выключена'}.",
+        reply_markup=get_admin_keyboard()
+    )
+
 async def admin_create_product_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало создания товара"""
     user_id = update.effective_user.id
@@ -837,14 +3718,27 @@ async def handle_confirm_delete_task_callback(update: Update, context: ContextTy
 
         task_info = tasks[task_id]
         del tasks[task_id]
-        save_tasks(tasks)
+        uow = UnitOfWork()
+        save_tasks(tasks, uow)
 
         # Удаляем все связанные отправки
         submissions = load_submissions()
-        to_delete = [sid for sid, sub in submissions.items() if sub.get('task_id') == task_id]
+        to_delete = [sid for sid, sub in submissions.items() if sub.task_id == task_id]
+        file_index = context.bot_data['file_index']
         for sid in to_delete:
+            unindex_submission_files(file_index, sid, submissions[sid].files)
             del submissions[sid]
-        save_submissions(submissions)
+        save_submissions(submissions, uow)
+        save_file_index(file_index, uow)
+
+        if not uow.commit():
+            context.bot_data['file_index'] = load_data(FILE_INDEX_FILE)
+            await query.edit_message_text("❌ Не удалось удалить задание. Попробуйте позже.")
+            return
+        context.bot_data['idempotency'].forget_submissions(to_delete)
+        cooldowns = context.bot_data['cooldowns']
+        cooldowns.forget_task(task_id)
+        save_reminders(cooldowns.subscribers)
 
         await query.edit_message_text(
             f"✅ <b>Задание удалено!</b>\n"
@@ -938,9 +3832,11 @@ async def admin_set_product_quantity(update: Update, context: ContextTypes.DEFAU
         'quantity': quantity,
         'sold': 0,
         'created_at': datetime.now().isoformat(),
-        'created_by': update.effective_user.id
+        'created_by': update.effective_user.id,
+        'flash_sale': False
     }
     save_products(products)
+    context.bot_data['stock'].update_product(product_id, products[product_id])
 
     # Очищаем контекст
     context.user_data.pop('product_name', None)
@@ -983,7 +3879,7 @@ async def admin_delete_product(update: Update, context: ContextTypes.DEFAULT_TYP
     # Создаем inline клавиатуру с товарами
     keyboard = []
     for product_id, product in products.items():
-        quantity_text = "∞" if product.get('quantity', 0) == 0 else f"{product.get('quantity', 0)} шт."
+        quantity_text = "∞" if product['quantity'] == 0 else f"{product['quantity']} шт."
         button_text = f"#{product_id} - {product['name'][:20]} ({quantity_text})"
         keyboard.append([InlineKeyboardButton(button_text, callback_data=f"delete_product_{product_id}")])
 
@@ -1025,7 +3921,7 @@ async def handle_delete_product_callback(update: Update, context: ContextTypes.D
             return
 
         product = products[product_id]
-        quantity_text = "без ограничений" if product.get('quantity', 0) == 0 else f"{product.get('quantity', 0)} шт."
+        quantity_text = "без ограничений" if product['quantity'] == 0 else f"{product['quantity']} шт."
 
         # Создаем клавиатуру для подтверждения удаления
         keyboard = [
@@ -1043,7 +3939,7 @@ async def handle_delete_product_callback(update: Update, context: ContextTypes.D
             f"📝 Описание: {product['description']}\n"
             f"💰 Цена: {product['price']} баллов\n"
             f"📦 Количество: {quantity_text}\n"
-            f"🛒 Продано: {product.get('sold', 0)} шт.\n\n"
+            f"🛒 Продано: {product['sold']} шт.\n\n"
             f"<b>Вы уверены, что хотите удалить этот товар?</b>\n"
             f"Эта операция необратима!",
             parse_mode='HTML',
@@ -1074,6 +3970,8 @@ async def handle_confirm_delete_callback(update: Update, context: ContextTypes.D
         # Удаляем товар
         del products[product_id]
         save_products(products)
+        context.bot_data['stock'].remove_product(product_id)
+        context.bot_data['flash_sales'].enabled.discard(product_id)
 
         await query.edit_message_text(
             f"✅ <b>Товар успешно удален!</b>\n\n"
@@ -1114,19 +4012,22 @@ async def admin_products_list(update: Update, context: ContextTypes.DEFAULT_TYPE
     products_text = "🛍️ <b>Список товаров:</b>\n\n"
 
     for product_id, product in products.items():
-        quantity_text = "∞" if product.get('quantity', 0) == 0 else f"{product.get('quantity', 0)} шт."
-        sold_text = f" | 🛒 Продано: {product.get('sold', 0)} шт." if product.get('quantity', 0) > 0 else ""
+        quantity_text = "∞" if product['quantity'] == 0 else f"{product['quantity']} шт."
+        sold_text = f" | 🛒 Продано: {product['sold']} шт." if product['quantity'] > 0 else ""
+        flash_text = " ⚡ флеш-распродажа" if product['flash_sale'] else ""
 
         products_text += (
-            f"📦 <b>Товар #{product_id}</b>\n"
+            f"📦 <b>Товар #{product_id}</b>{flash_text}\n"
             f"🎁 {product['name']}\n"
             f"📝 {product['description']}\n"
             f"💰 Цена: {product['price']} баллов\n"
             f"📦 В наличии: {quantity_text}{sold_text}\n"
-            f"📅 Добавлен: {product.get('created_at', 'Неизвестно')[:10]}\n"
+            f"📅 Добавлен: {format_local_time(product['created_at'])[:10]}\n"
             f"────────────────────\n"
         )
 
+    products_text += "\n⚡ Флеш-распродажа товара: /flash ID on|off"
+
     await update.message.reply_text(
         products_text,
         parse_mode='HTML',
@@ -1156,7 +4057,16 @@ async def admin_review_submission(update: Update, context: ContextTypes.DEFAULT_
         )
         return ConversationHandler.END
         
+    if not context.bot_data['review_leases'].extend(update.effective_user.id, submission_id):
+        await update.message.reply_text(
+            "🔒 Эту отправку сейчас проверяет другой администратор.",
+            reply_markup=get_admin_keyboard()
+        )
+        return ConversationHandler.END
+
     submission = submissions[submission_id]
+    users = load_users()
+    tasks = load_tasks()
     
     keyboard = InlineKeyboardMarkup([
         [
@@ -1167,20 +4077,37 @@ async def admin_review_submission(update: Update, context: ContextTypes.DEFAULT_
     
     submission_info = (
         f"📨 <b>Задание на проверке</b>\n"
-        f"👤 <b>Пользователь:</b> {submission['user_name']} (ID: #{submission['user_unique_id']})\n"
-        f"🎯 <b>Задание:</b> {submission['task_description']}\n"
-        f"⭐ <b>Баллы:</b> {submission['task_points']}\n"
-        f"📎 <b>Файлов отправлено:</b> {len(submission.get('files', []))}\n"
-        f"🕒 <b>Время отправки:</b> {submission['submission_time'][:16]}"
+        f"👤 <b>Пользователь:</b> {user_display_name(users, submission.user_id)} (ID: #{user_display_id(users, submission.user_id)})\n"
+        f"🎯 <b>Задание:</b> {task_display_description(tasks, submission.task_id)}\n"
+        f"⭐ <b>Баллы:</b> {submission.task_points}\n"
+        f"📎 <b>Файлов отправлено:</b> {len(submission.files)}\n"
+        f"🕒 <b>Время отправки:</b> {format_local_time(submission.submission_time)}"
     )
     
-    if submission.get('text_content'):
-        submission_info += f"\n📝 <b>Текст ответа:</b>\n{submission['text_content'][:500]}" + ("..." if len(submission['text_content']) > 500 else "")
-        
+    duplicates = [
+        other_id for other_id in find_duplicate_files(
+            context.bot_data['file_index'], submission_id, submission.files
+        )
+        if other_id in submissions
+    ]
+    if duplicates:
+        submission_info += f"\n\n⚠️ <b>Файлы уже отправлялись ({len(duplicates)}):</b>"
+        for other_id in duplicates[:5]:
+            other = submissions[other_id]
+            submission_info += (
+                f"\n• #{other_id} - {user_display_name(users, other.user_id)}, "
+                f"задание #{other.task_id}, {STATUS_TITLES.get(other.status, other.status)}"
+            )
+        if len(duplicates) > 5:
+            submission_info += f"\n• ... и еще {len(duplicates) - 5}"
+
+    if submission.text_content:
+        submission_info += f"\n📝 <b>Текст ответа:</b>\n{submission.text_content[:500]}" + ("..." if len(submission.text_content) > 500 else "")
+        
     back_keyboard = ReplyKeyboardMarkup([[KeyboardButton("🔙 Назад")]], resize_keyboard=True)
     
     # Отправляем все файлы
-    files = submission.get('files', [])
+    files = submission.files
     for i, file_data in enumerate(files):
         try:
             if file_data['type'] == 'photo':
@@ -1241,7 +4168,6 @@ async def handle_task_submission(update: Update, context: ContextTypes.DEFAULT_T
         )
         return ConversationHandler.END
 
-    user_data = users[user_id]
     task = tasks[task_id]
 
     # Сохраняем отправку задания
@@ -1266,25 +4192,26 @@ async def handle_task_submission(update: Update, context: ContextTypes.DEFAULT_T
         content = "Видео"
         file_id = update.message.video.file_id
 
-    submissions[submission_id] = {
-        'user_id': user_id,
-        'user_name': f"{user_data['first_name']} {user_data['surname']}",
-        'user_unique_id': user_data['unique_id'],
-        'task_id': task_id,
-        'task_title': task.get('title', 'Без названия'),
-        'task_description': task['description'],
-        'task_points': task['points'],
-        'task_type': task.get('type', 'once'),
-        'content_type': content_type,
-        'content': content,
-        'file_id': file_id,
-        'submission_time': datetime.now().isoformat(),
-        'status': 'pending'
-    }
+    submissions[submission_id] = SubmissionRecord(
+        user_id=user_id,
+        task_id=task_id,
+        task_points=task['points'],
+        content_type=content_type,
+        content=content,
+        file_id=file_id,
+        files=[{'type': content_type, 'file_id': file_id, 'caption': ''}] if file_id else [],
+        text_content=content if content_type == 'text' else '',
+        submission_time=utc_now_iso(),
+        status='pending'
+    )
     save_submissions(submissions)
+    context.bot_data['cooldowns'].record_attempt(
+        user_id, task_id, timestamp_of(submissions[submission_id].submission_time)
+    )
+    record_stat(context, 'submissions')
 
     # Отправляем уведомление администраторам
-    for admin_id in ADMIN_IDS:
+    for admin_id in current_tenant.get().admin_ids:
         try:
             admin_message = (
                 f"📨 <b>Новое задание на проверку!</b>\n\n 💡 <i>Для проверки перейдите в панель администратора → '📨 Проверка заданий'</i>"
@@ -1329,60 +4256,143 @@ async def handle_task_submission(update: Update, context: ContextTypes.DEFAULT_T
 
     return ConversationHandler.END
 
+def compare_and_set_status(submissions, submission_id, expected, new):
+    """Смена статуса отправки, только если текущий статус равен expected"""
+    submission = submissions.get(submission_id)
+    if submission is None or submission.status != expected:
+        return False
+    submission.status = new
+    return True
+
+STATUS_TITLES = {'pending': "на проверке", 'approved': "принято", 'rejected': "отклонено"}
+
+def review_result_text(submission_id, status):
+    if status == 'approved':
+        return f"✅ Отправка #{submission_id} уже принята."
+    if status == 'rejected':
+        return f"❌ Отправка #{submission_id} уже отклонена."
+    return f"ℹ️ Статус отправки #{submission_id}: {status}."
+
+def remember_review(cache, submission_id, result, callback_id=None):
+    """Итог проверки для повторных нажатий любой из кнопок этой отправки"""
+    for action in ('approve', 'reject'):
+        cache.put(('submission', submission_id, action), result)
+    if callback_id is not None:
+        cache.put(('callback', callback_id), result)
+
 async def handle_submission_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка callback от кнопок принятия/отклонения"""
     query = update.callback_query
-    await query.answer()
     data = query.data
     submission_id = data.split('_')[1]
     action = data.split('_')[0]
+    new_status = {'approve': 'approved', 'reject': 'rejected'}.get(action)
+
+    if new_status is None or not is_admin(query.from_user.id):
+        await query.answer()
+        return
+
+    # Повторные нажатия и решение второго администратора отвечаются из кэша без чтения файлов
+    cache = context.bot_data['idempotency']
+    cached = cache.get(('callback', query.id)) or cache.get(('submission', submission_id, action))
+    if cached is not None:
+        await query.answer(cached)
+        return ConversationHandler.END
+    leases = context.bot_data['review_leases']
+    if not leases.extend(query.from_user.id, submission_id):
+        await query.answer("🔒 Эту отправку сейчас проверяет другой администратор.", show_alert=True)
+        return ConversationHandler.END
+    cache.put(('callback', query.id), "⏳ Решение уже обрабатывается")
+    cache.put(('submission', submission_id, action), "⏳ Решение уже обрабатывается")
+
+    await query.answer()
     submissions = load_submissions()
     users = load_users()
     
     if submission_id not in submissions:
+        cache.discard(('submission', submission_id, action))
         await query.edit_message_text("❌ Отправка не найдена.")
         return
 
     submission = submissions[submission_id]
-    user_id = submission['user_id']
-    
+    user_id = submission.user_id
+    user_name = user_display_name(users, user_id)
+    tasks = load_tasks()
+    task = tasks.get(submission.task_id)
+    task_description = task_display_description(tasks, submission.task_id)
+
+    if action == 'approve' and user_id not in users:
+        cache.discard(('submission', submission_id, action))
+        await query.edit_message_text("❌ Пользователь не найден.")
+        return ConversationHandler.END
+
+    # Решение применяется, только если отправка все еще на проверке
+    leases.release(submission_id)
+    if not compare_and_set_status(submissions, submission_id, 'pending', new_status):
+        result = review_result_text(submission_id, submission.status)
+        remember_review(cache, submission_id, result, query.id)
+        await query.edit_message_text(result)
+        return ConversationHandler.END
+
     if action == 'approve':
         if user_id in users:
-            # Начисляем баллы
-            users[user_id]['points'] += submission['task_points']
-            # И добавляем к общему заработку
-            users[user_id]['total_earned'] += submission['task_points']
-            save_users(users)
-            submission['status'] = 'approved'
-            save_submissions(submissions)
+            # Начисляем баллы (и к общему заработку)
+            entry = apply_points(
+                users, user_id, submission.task_points, 'submission',
+                ref=submission_id, admin_id=query.from_user.id
+            )
+            # Баллы, запись журнала и статус отправки сохраняются одной транзакцией
+            uow = UnitOfWork()
+            save_users(users, uow)
+            save_submissions(submissions, uow)
+            context.bot_data['points_ledger'].stage(uow, [entry])
+            if not uow.commit():
+                cache.discard(('submission', submission_id, action))
+                await query.edit_message_text("❌ Не удалось сохранить решение. Попробуйте еще раз.")
+                return ConversationHandler.END
+            remember_review(cache, submission_id, review_result_text(submission_id, 'approved'), query.id)
+            record_stat(context, 'approvals')
+            record_stat(context, 'points_credited', submission.task_points)
+            task_type = task['type'] if task is not None else None
+            if task_type is not None:
+                context.bot_data['cooldowns'].record_approval(
+                    user_id, submission.task_id, task_type, timestamp_of(submission.submission_time)
+                )
             try:
                 await context.bot.send_message(
                     chat_id=user_id,
                     text=f"🎉 <b>Ваше задание принято!</b>\n"
-                         f"🎯 Задание: {submission['task_description']}\n"
-                         f"⭐ Начислено баллов: +{submission['task_points']}\n"
-                         f"💰 Теперь у вас: {users[user_id]['points']} баллов\n"
+                         f"🎯 Задание: {task_description}\n"
+                         f"⭐ Начислено баллов: +{submission.task_points}\n"
+                         f"💰 Теперь у вас: {users[user_id].points} баллов\n"
                          f"Поздравляем! 🎊",
-                    parse_mode='HTML'
+                    parse_mode='HTML',
+                    reply_markup=get_reminder_keyboard(submission.task_id) if task_type == 'daily' else None
                 )
             except Exception as e:
                 logger.error(f"Не удалось уведомить пользователя {user_id}: {e}")
             await query.edit_message_text(
                 f"✅ <b>Задание принято!</b>\n"
-                f"👤 Пользователь: {submission['user_name']}\n"
-                f"🎯 Задание: {submission['task_description']}\n"
-                f"⭐ Начислено баллов: {submission['task_points']}\n"
-                f"💰 Новый баланс: {users[user_id]['points']}",
+                f"👤 Пользователь: {user_name}\n"
+                f"🎯 Задание: {task_description}\n"
+                f"⭐ Начислено баллов: {submission.task_points}\n"
+                f"💰 Новый баланс: {users[user_id].points}",
                 parse_mode='HTML'
             )
     elif action == 'reject':
-        submission['status'] = 'rejected'
-        save_submissions(submissions)
+        uow = UnitOfWork()
+        save_submissions(submissions, uow)
+        if not uow.commit():
+            cache.discard(('submission', submission_id, action))
+            await query.edit_message_text("❌ Не удалось сохранить решение. Попробуйте еще раз.")
+            return ConversationHandler.END
+        remember_review(cache, submission_id, review_result_text(submission_id, 'rejected'), query.id)
+        record_stat(context, 'rejections')
         try:
             await context.bot.send_message(
                 chat_id=user_id,
                 text=f"❌ <b>Ваше задание отклонено</b>\n"
-                     f"🎯 Задание: {submission['task_description']}\n"
+                     f"🎯 Задание: {task_description}\n"
                      f"💡 Попробуйте выполнить задание еще раз или выберите другое задание.",
                 parse_mode='HTML'
             )
@@ -1390,8 +4400,8 @@ async def handle_submission_callback(update: Update, context: ContextTypes.DEFAU
             logger.error(f"Не удалось уведомить пользователя {user_id}: {e}")
         await query.edit_message_text(
             f"❌ <b>Задание отклонено</b>\n"
-            f"👤 Пользователь: {submission['user_name']}\n"
-            f"🎯 Задание: {submission['task_description']}",
+            f"👤 Пользователь: {user_name}\n"
+            f"🎯 Задание: {task_description}",
             parse_mode='HTML'
         )
 
@@ -1410,26 +4420,41 @@ async def admin_pending_submissions(update: Update, context: ContextTypes.DEFAUL
         return ConversationHandler.END
 
     submissions = load_submissions()
-    pending_subs = {k: v for k, v in submissions.items() if v['status'] == 'pending'}
+    pending_ids = sorted((k for k, v in submissions.items() if v.status == 'pending'), key=submission_sort_key)
 
-    if not pending_subs:
+    if not pending_ids:
         await update.message.reply_text(
             "✅ Заданий на проверке нет.",
             reply_markup=get_admin_keyboard()
         )
         return ConversationHandler.END
 
+    # Администратор получает только закрепленные за ним отправки, остальные видят другие
+    claimed = context.bot_data['review_leases'].claim(user_id, pending_ids, REVIEW_CLAIM_SIZE)
+    if not claimed:
+        await update.message.reply_text(
+            f"🔒 Все {len(pending_ids)} отправок на проверке сейчас разобраны другими администраторами.\n"
+            f"Попробуйте через несколько минут.",
+            reply_markup=get_admin_keyboard()
+        )
+        return ConversationHandler.END
+
+    users = load_users()
+    tasks = load_tasks()
+
     # Создаем клавиатуру с заданиями на проверке
     keyboard = []
-    for sub_id, submission in pending_subs.items():
+    for sub_id in claimed:
+        submission = submissions[sub_id]
         keyboard.append([KeyboardButton(
-            f"#{sub_id} - {submission['user_name']} - {submission['task_description'][:30]}..."
+            f"#{sub_id} - {user_display_name(users, submission.user_id)} - {task_display_description(tasks, submission.task_id)[:30]}..."
         )])
 
     keyboard.append([KeyboardButton("🔙 Назад")])
 
     await update.message.reply_text(
-        f"📨 <b>Задания на проверке:</b> {len(pending_subs)}\n\n"
+        f"📨 <b>Задания на проверке:</b> {len(pending_ids)}\n"
+        f"🔒 Закреплено за вами на {REVIEW_LEASE_SECONDS / 60:.0f} мин: {len(claimed)}\n\n"
         "Выберите задание для оценки:",
         parse_mode='HTML',
         reply_markup=ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
@@ -1437,6 +4462,314 @@ async def admin_pending_submissions(update: Update, context: ContextTypes.DEFAUL
 
     return ADMIN_REVIEW_SELECT
 
+async def admin_bulk_review_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Массовая проверка: выбор отправок по заданию, пользователю или всех сразу"""
+    user_id = update.effective_user.id
+
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет доступа.")
+        return
+
+    submissions = load_submissions()
+    pending = [submission for submission in submissions.values() if submission.status == 'pending']
+
+    if not pending:
+        await update.message.reply_text(
+            "✅ Заданий на проверке нет.",
+            reply_markup=get_admin_keyboard()
+        )
+        return
+
+    users = load_users()
+    tasks = load_tasks()
+    by_task = Counter(submission.task_id for submission in pending)
+    by_user = Counter(submission.user_id for submission in pending)
+
+    keyboard = [[InlineKeyboardButton(f"📋 Все на проверке ({len(pending)})", callback_data="bulk_all")]]
+    for task_id, count in by_task.most_common(BULK_REVIEW_FILTER_LIMIT):
+        title = task_display_title(tasks, task_id)
+        keyboard.append([InlineKeyboardButton(f"🎯 #{task_id} {title} ({count})", callback_data=f"bulk_task_{task_id}")])
+    for pending_user_id, count in by_user.most_common(BULK_REVIEW_FILTER_LIMIT):
+        keyboard.append([InlineKeyboardButton(
+            f"👤 {user_display_name(users, pending_user_id)} ({count})", callback_data=f"bulk_user_{pending_user_id}"
+        )])
+
+    await update.message.reply_text(
+        f"📦 <b>Массовая проверка</b>\n\n"
+        f"📨 На проверке: {len(pending)}\n"
+        f"Выберите, какие отправки показать:",
+        parse_mode='HTML',
+        reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+def bulk_review_page_ids(state):
+    """Отправки текущей страницы массовой проверки (номер страницы приводится к допустимому)"""
+    pages = max(1, math.ceil(len(state['ids']) / BULK_REVIEW_PAGE_SIZE))
+    state['page'] = min(state['page'], pages - 1)
+    start = state['page'] * BULK_REVIEW_PAGE_SIZE
+    return state['ids'][start:start + BULK_REVIEW_PAGE_SIZE]
+
+def lease_bulk_review_page(state, leases, admin_id):
+    """Аренда только показанной страницы (не больше REVIEW_CLAIM_SIZE), аренды прежней снимаются"""
+    page_ids = bulk_review_page_ids(state)
+    release_bulk_review_leases(state, leases, admin_id, keep=page_ids[:REVIEW_CLAIM_SIZE])
+    state['leased'] = {sid for sid in page_ids[:REVIEW_CLAIM_SIZE] if leases.extend(admin_id, sid)}
+    state['locked'] = leases.held_by_others(admin_id).intersection(page_ids)
+
+def release_bulk_review_leases(state, leases, admin_id, keep=()):
+    """Снятие аренд массовой проверки, которые все еще принадлежат этому администратору"""
+    for sid in state['leased'].difference(keep):
+        if leases.holder(sid) == admin_id:
+            leases.release(sid)
+    state['leased'] = state['leased'].intersection(keep)
+
+def bulk_review_page(state):
+    """Текст и клавиатура текущей страницы массовой проверки"""
+    ids = state['ids']
+    selected = state['selected']
+    page_ids = bulk_review_page_ids(state)
+    page = state['page']
+    pages = max(1, math.ceil(len(ids) / BULK_REVIEW_PAGE_SIZE))
+
+    text = (
+        f"📦 <b>Массовая проверка:</b> {state['title']}\n"
+        f"Отправок: {len(ids)}, выбрано: {len(selected)}\n\n"
+        + "\n\n".join(
+            state['rows'][sid] + ("\n🔒 Сейчас у другого администратора" if sid in state['locked'] else "")
+            for sid in page_ids
+        )
+    )
+
+    keyboard = []
+    toggles = [
+        InlineKeyboardButton(f"{'✅' if sid in selected else '⬜'} #{sid}", callback_data=f"bulk_toggle_{sid}")
+        for sid in page_ids
+    ]
+    for start in range(0, len(toggles), 2):
+        keyboard.append(toggles[start:start + 2])
+    keyboard.append([
+        InlineKeyboardButton("◀️", callback_data=f"bulk_page_{max(page - 1, 0)}"),
+        InlineKeyboardButton(f"{page + 1}/{pages}", callback_data="bulk_noop"),
+        InlineKeyboardButton("▶️", callback_data=f"bulk_page_{min(page + 1, pages - 1)}"),
+    ])
+    keyboard.append([
+        InlineKeyboardButton("☑️ Вся страница", callback_data="bulk_pageall"),
+        InlineKeyboardButton(f"☑️ Все ({len(ids)})", callback_data="bulk_selectall"),
+    ])
+    keyboard.append([
+        InlineKeyboardButton(f"✅ Принять ({len(selected)})", callback_data="bulk_apply_approve"),
+        InlineKeyboardButton(f"❌ Отклонить ({len(selected)})", callback_data="bulk_apply_reject"),
+    ])
+    keyboard.append([InlineKeyboardButton("🔙 Отмена", callback_data="bulk_cancel")])
+    return text, InlineKeyboardMarkup(keyboard)
+
+def bulk_review_state(filter_type, filter_value, file_index, leases, admin_id):
+    """Отправки на проверке по фильтру и их описания для страниц (файлы читаются один раз).
+
+    Отправки, закрепленные за другими администраторами, пропускаются. Сама
+    выборка не закрепляется: аренду берет показ страницы (lease_bulk_review_page).
+    """
+    submissions = load_submissions()
+    held_by_others = leases.held_by_others(admin_id)
+    users = load_users()
+    tasks = load_tasks()
+
+    ids = []
+    rows = {}
+    for sid, submission in submissions.items():
+        if submission.status != 'pending':
+            continue
+        if filter_type == 'task' and submission.task_id != filter_value:
+            continue
+        if filter_type == 'user' and submission.user_id != filter_value:
+            continue
+        if sid in held_by_others:
+            continue
+        ids.append(sid)
+        text_content = submission.text_content
+        files = submission.files
+        files_count = len(files)
+        duplicate_mark = " · ⚠️ повтор файла" if find_duplicate_files(file_index, sid, files) else ""
+        rows[sid] = (
+            f"<b>#{sid}</b> 👤 {html.escape(user_display_name(users, submission.user_id))} "
+            f"(#{user_display_id(users, submission.user_id)})\n"
+            f"🎯 {html.escape(task_display_title(tasks, submission.task_id))} · ⭐ {submission.task_points} · 📎 {files_count}{duplicate_mark}"
+            + (f"\n💬 {html.escape(text_content[:80])}" if text_content else "")
+        )
+    ids.sort(key=submission_sort_key)
+
+    if filter_type == 'task':
+        title = f"задание #{filter_value} {html.escape(task_display_title(tasks, filter_value))}"
+    elif filter_type == 'user':
+        title = html.escape(user_display_name(users, filter_value))
+    else:
+        title = "все задания"
+    return {'ids': ids, 'rows': rows, 'selected': set(), 'leased': set(), 'locked': set(), 'page': 0, 'title': title}
+
+async def handle_bulk_review_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Кнопки массовой проверки: фильтр, выбор, страницы и применение решения"""
+    query = update.callback_query
+    if not is_admin(query.from_user.id):
+        await query.answer("❌ У вас нет доступа.")
+        return
+
+    parts = query.data.split('_', 2)
+    action = parts[1]
+    argument = parts[2] if len(parts) > 2 else None
+    state = context.user_data.get('bulk_review')
+
+    if action == 'noop':
+        await query.answer()
+        return
+    if action in ('all', 'task', 'user'):
+        state = bulk_review_state(
+            action, argument, context.bot_data['file_index'], context.bot_data['review_leases'], query.from_user.id
+        )
+        context.user_data['bulk_review'] = state
+        if not state['ids']:
+            await query.answer()
+            await query.edit_message_text("✅ По этому фильтру отправок на проверке нет.")
+            return
+    elif state is None:
+        await query.answer("Сессия проверки устарела, начните заново.")
+        return
+    elif action == 'cancel':
+        release_bulk_review_leases(state, context.bot_data['review_leases'], query.from_user.id)
+        context.user_data.pop('bulk_review', None)
+        await query.answer()
+        await query.edit_message_text("❌ Массовая проверка отменена.")
+        return
+    elif action == 'apply':
+        await apply_bulk_review(query, context, state, approve=argument == 'approve')
+        return
+    elif action == 'toggle':
+        state['selected'] ^= {argument}
+    elif action == 'page':
+        state['page'] = int(argument)
+    elif action in ('pageall', 'selectall'):
+        if action == 'pageall':
+            targets = set(bulk_review_page_ids(state))
+        else:
+            targets = set(state['ids'])
+        # Повторное нажатие снимает выбор
+        if targets <= state['selected']:
+            state['selected'] -= targets
+        else:
+            state['selected'] |= targets
+
+    await query.answer()
+    lease_bulk_review_page(state, context.bot_data['review_leases'], query.from_user.id)
+    text, reply_markup = bulk_review_page(state)
+    try:
+        await query.edit_message_text(text, parse_mode='HTML', reply_markup=reply_markup)
+    except BadRequest as e:
+        # Например, листание за последнюю страницу не меняет сообщение
+        if 'not modified' not in str(e):
+            raise
+
+async def apply_bulk_review(query, context, state, approve):
+    """Решение по всем выбранным отправкам одной транзакцией и пакетная рассылка уведомлений"""
+    if not state['selected']:
+        await query.answer("Ничего не выбрано.")
+        return
+    await query.answer()
+
+    users = load_users()
+    submissions = load_submissions()
+    tasks = load_tasks()
+    applied = {}
+    ledger_entries = []
+    skipped = 0
+    leases = context.bot_data['review_leases']
+    held_by_others = leases.held_by_others(query.from_user.id)
+    for sid in state['selected']:
+        # Отправку мог закрепить за собой другой администратор, пока эта страница была не на экране
+        if sid in held_by_others:
+            skipped += 1
+            continue
+        submission = submissions.get(sid)
+        # Отправку могли уже проверить по одной, пока шла массовая проверка
+        if submission is None or (approve and submission.user_id not in users):
+            skipped += 1
+            continue
+        if not compare_and_set_status(submissions, sid, 'pending', 'approved' if approve else 'rejected'):
+            skipped += 1
+            continue
+        if approve:
+            ledger_entries.append(apply_points(
+                users, submission.user_id, submission.task_points, 'submission',
+                ref=sid, admin_id=query.from_user.id
+            ))
+        applied[sid] = submission
+
+    uow = UnitOfWork()
+    if approve:
+        save_users(users, uow)
+        context.bot_data['points_ledger'].stage(uow, ledger_entries)
+    save_submissions(submissions, uow)
+    if not uow.commit():
+        await query.edit_message_text("❌ Не удалось сохранить решения. Попробуйте еще раз.")
+        return
+    context.user_data.pop('bulk_review', None)
+    release_bulk_review_leases(state, leases, query.from_user.id)
+    for sid in applied:
+        leases.release(sid)
+    cache = context.bot_data['idempotency']
+    for sid in applied:
+        remember_review(cache, sid, review_result_text(sid, 'approved' if approve else 'rejected'))
+
+    points_total = sum(submission.task_points for submission in applied.values())
+    if approve:
+        record_stat(context, 'approvals', len(applied))
+        record_stat(context, 'points_credited', points_total)
+        cooldowns = context.bot_data['cooldowns']
+        for submission in applied.values():
+            task = tasks.get(submission.task_id)
+            if task is not None:
+                cooldowns.record_approval(
+                    submission.user_id, submission.task_id, task['type'],
+                    timestamp_of(submission.submission_time)
+                )
+    else:
+        record_stat(context, 'rejections', len(applied))
+
+    # Одно уведомление на пользователя со всеми его заданиями
+    by_user = {}
+    for submission in applied.values():
+        by_user.setdefault(submission.user_id, []).append(submission)
+    messages = []
+    for user_id, user_submissions in by_user.items():
+        titles = "\n".join(
+            f"🎯 {html.escape(task_display_title(tasks, submission.task_id))}"
+            for submission in user_submissions
+        )
+        if approve:
+            earned = sum(submission.task_points for submission in user_submissions)
+            text = (
+                f"🎉 <b>Принято заданий: {len(user_submissions)}</b>\n{titles}\n"
+                f"⭐ Начислено баллов: +{earned}\n"
+                f"💰 Теперь у вас: {users[user_id].points} баллов"
+            )
+        else:
+            text = (
+                f"❌ <b>Отклонено заданий: {len(user_submissions)}</b>\n{titles}\n"
+                f"💡 Попробуйте выполнить задание еще раз или выберите другое задание."
+            )
+        messages.append((user_id, text, None))
+    context.application.create_task(send_batched(context.bot, messages))
+
+    logger.info(
+        f"Администратор {query.from_user.id} массово {'принял' if approve else 'отклонил'} "
+        f"{len(applied)} отправок, пропущено {skipped}"
+    )
+    await query.edit_message_text(
+        (f"✅ <b>Принято отправок: {len(applied)}</b>\n⭐ Начислено баллов: {points_total}\n"
+         if approve else f"❌ <b>Отклонено отправок: {len(applied)}</b>\n")
+        + (f"⏭️ Пропущено (уже проверены или у других администраторов): {skipped}\n" if skipped else "")
+        + f"📨 Уведомления отправляются {len(messages)} пользователям.",
+        parse_mode='HTML'
+    )
+
 async def submit_task_select(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка выбора задания"""
     text = update.message.text
@@ -1459,12 +4792,17 @@ async def submit_task_select(update: Update, context: ContextTypes.DEFAULT_TYPE)
     user_id = str(update.effective_user.id)
     task = tasks[task_id]
     
-    can_submit, message = await check_task_availability(user_id, task_id, task)
+    can_submit, message = check_task_availability(context.bot_data['cooldowns'], user_id, task_id, task)
     if not can_submit:
         await update.message.reply_text(
             message,
             reply_markup=get_main_keyboard()
         )
+        if task['type'] == 'daily':
+            await update.message.reply_text(
+                "Хотите получить уведомление, когда задание снова станет доступно?",
+                reply_markup=get_reminder_keyboard(task_id)
+            )
         return ConversationHandler.END
 
     context.user_data['selected_task'] = task_id
@@ -1472,13 +4810,13 @@ async def submit_task_select(update: Update, context: ContextTypes.DEFAULT_TYPE)
     context.user_data['files'] = []
     context.user_data['text_content'] = ""
 
-    task_type = task.get('type', 'once')
+    task_type = task['type']
     type_text = "одноразовое" if task_type == "once" else "ежедневное"
 
     await update.message.reply_text(
         f"📤 <b>Отправка задания:</b>\n"
         f"🎯 Задание #{task_id} ({type_text})\n"
-        f"📝 <b>Название:</b> {task.get('title', 'Без названия')}\n"
+        f"📝 <b>Название:</b> {task['title']}\n"
         f"📄 <b>Описание:</b> {task['description']}\n"
         f"⭐ <b>Награда:</b> {task['points']} баллов\n\n"
         f"📎 Вы можете прикрепить несколько файлов, фото, видео или написать текстовый ответ.\n"
@@ -1491,38 +4829,82 @@ async def submit_task_select(update: Update, context: ContextTypes.DEFAULT_TYPE)
     )
     return USER_SEND_TASK_CONTENT
     
-async def check_task_availability(user_id: str, task_id: str, task: dict) -> tuple:
-    """Проверяет, может ли пользователь выполнить задание"""
-    submissions = load_submissions()
-    task_type = task.get('type', 'once')
-    
-    if task_type == 'once':
-        # Проверяем, есть ли уже принятая отправка этого задания
-        for submission in submissions.values():
-            if (submission['user_id'] == user_id and 
-                submission['task_id'] == task_id and 
-                submission['status'] == 'approved'):
-                return False, "❌ Вы уже выполнили это одноразовое задание!"
-                
-    elif task_type == 'daily':
-        # Проверяем отправки за последние 24 часа
-        now = datetime.now()
-        for submission in submissions.values():
-            if (submission['user_id'] == user_id and 
-                submission['task_id'] == task_id and 
-                submission['status'] == 'approved'):
-                
-                submission_time = datetime.fromisoformat(submission['submission_time'])
-                time_diff = now - submission_time
-                
-                if time_diff.total_seconds() < 24 * 3600:
-                    hours_left = 24 - (time_diff.total_seconds() / 3600)
-                    return False, (
-                        f"⏰ Вы уже выполняли это задание сегодня!\n"
-                        f"Следующая попытка будет доступна через {hours_left:.1f} часов"
-                    )
-    
-    return True, ""
+def check_task_availability(cooldowns, user_id: str, task_id: str, task: dict) -> tuple:
+    """Проверяет, может ли пользователь выполнить задание (по индексу CooldownIndex)"""
+    seconds_left = cooldowns.seconds_left(user_id, task_id)
+    if seconds_left == 0:
+        return True, ""
+    if seconds_left == math.inf:
+        return False, "❌ Вы уже выполнили это одноразовое задание!"
+    return False, (
+        f"⏰ Вы уже выполняли это задание сегодня!\n"
+        f"Следующая попытка будет доступна через {seconds_left / 3600:.1f} часов"
+    )
+
+def get_reminder_keyboard(task_id):
+    return InlineKeyboardMarkup([[
+        InlineKeyboardButton("🔔 Напомнить, когда станет доступно", callback_data=f"remind_{task_id}")
+    ]])
+
+async def handle_remind_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Подписка на напоминание о снова доступном ежедневном задании"""
+    query = update.callback_query
+    await query.answer()
+    task_id = query.data.split('_')[1]
+    user_id = str(query.from_user.id)
+    cooldowns = context.bot_data['cooldowns']
+
+    if cooldowns.subscribe(user_id, task_id):
+        save_reminders(cooldowns.subscribers)
+        await query.edit_message_text("🔔 Напомню, когда задание снова станет доступно.")
+    else:
+        await query.edit_message_text("🟢 Задание уже доступно - можно отправлять!")
+
+async def send_batched(bot, messages, batch_size=SEND_BATCH_SIZE, pause=SEND_BATCH_PAUSE_SECONDS):
+    """Рассылка сообщений [(chat_id, text, reply_markup)] пачками, возвращает число доставленных"""
+    async def send(chat_id, text, reply_markup):
+        for attempt in range(2):
+            try:
+                await bot.send_message(chat_id=chat_id, text=text, parse_mode='HTML', reply_markup=reply_markup)
+                return True
+            except RetryAfter as e:
+                logger.warning(f"Лимит Bot API при рассылке, пауза {e.retry_after} с")
+                await asyncio.sleep(e.retry_after)
+            except TelegramError as e:
+                logger.error(f"Не удалось отправить сообщение {chat_id}: {e}")
+                return False
+        return False
+
+    delivered = 0
+    for start in range(0, len(messages), batch_size):
+        if start:
+            await asyncio.sleep(pause)
+        results = await asyncio.gather(*(send(*message) for message in messages[start:start + batch_size]))
+        delivered += sum(results)
+    return delivered
+
+async def send_cooldown_reminders(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: напоминания о снова доступных ежедневных заданиях"""
+    cooldowns = context.bot_data['cooldowns']
+    due = cooldowns.pop_due()
+    if not due:
+        return
+    save_reminders(cooldowns.subscribers)
+
+    tasks = load_tasks()
+    messages = [
+        (
+            user_id,
+            f"🔔 <b>Задание снова доступно!</b>\n"
+            f"🎯 Задание #{task_id} - {tasks[task_id]['title']}\n"
+            f"Нажмите «📤 Отправить задание», чтобы выполнить его.",
+            None
+        )
+        for user_id, task_id in due
+        if task_id in tasks
+    ]
+    delivered = await send_batched(context.bot, messages)
+    logger.info(f"Напоминания о заданиях: отправлено {delivered} из {len(messages)}")
 
 async def handle_task_content(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка контента задания (можно несколько файлов)"""
@@ -1550,6 +4932,22 @@ async def handle_task_content(update: Update, context: ContextTypes.DEFAULT_TYPE
         # Переходим к финальной отправке
         return await finalize_task_submission(update, context)
 
+    # Размер отправки ограничивается до чтения данных
+    if update.message.effective_attachment is not None and len(context.user_data.get('files', [])) >= MAX_FILES_PER_SUBMISSION:
+        await update.message.reply_text(
+            f"❌ В одну отправку можно прикрепить не больше {MAX_FILES_PER_SUBMISSION} файлов.\n"
+            f"Нажмите <b>✅ Завершить отправку</b> или отмените отправку.",
+            parse_mode='HTML'
+        )
+        return USER_SEND_TASK_CONTENT
+    if text and len(context.user_data.get('text_content', '')) + len(text) > MAX_SUBMISSION_TEXT_LENGTH:
+        await update.message.reply_text(
+            f"❌ Текст ответа не может быть длиннее {MAX_SUBMISSION_TEXT_LENGTH} символов.\n"
+            f"Нажмите <b>✅ Завершить отправку</b> или отмените отправку.",
+            parse_mode='HTML'
+        )
+        return USER_SEND_TASK_CONTENT
+
     user_id = str(update.effective_user.id)
     users = load_users()
     tasks = load_tasks()
@@ -1578,6 +4976,7 @@ async def handle_task_content(update: Update, context: ContextTypes.DEFAULT_TYPE
         files.append({
             'type': 'photo',
             'file_id': file_id,
+            'file_unique_id': update.message.photo[-1].file_unique_id,
             'caption': update.message.caption or ''
         })
         context.user_data['files'] = files
@@ -1594,6 +4993,7 @@ async def handle_task_content(update: Update, context: ContextTypes.DEFAULT_TYPE
         files.append({
             'type': 'document',
             'file_id': file_id,
+            'file_unique_id': update.message.document.file_unique_id,
             'file_name': file_name,
             'caption': update.message.caption or ''
         })
@@ -1610,6 +5010,7 @@ async def handle_task_content(update: Update, context: ContextTypes.DEFAULT_TYPE
         files.append({
             'type': 'video',
             'file_id': file_id,
+            'file_unique_id': update.message.video.file_unique_id,
             'caption': update.message.caption or ''
         })
         context.user_data['files'] = files
@@ -1679,36 +5080,94 @@ async def finalize_task_submission(update: Update, context: ContextTypes.DEFAULT
     else:
         content_type = "text"
 
-    submissions[submission_id] = {
-        'user_id': user_id,
-        'user_name': f"{user_data['first_name']} {user_data['surname']}",
-        'user_unique_id': user_data['unique_id'],
-        'task_id': task_id,
-        'task_title': task.get('title', 'Без названия'),
-        'task_description': task['description'],
-        'task_points': task['points'],
-        'task_type': task.get('type', 'once'),
-        'content_type': content_type,
-        'content': text_content,
-        'files': files,  # Сохраняем все файлы
-        'text_content': text_content,
-        'submission_time': datetime.now().isoformat(),
-        'status': 'pending'
-    }
-    save_submissions(submissions)
+    # Текстовый ответ, подходящий под правила задания, принимается сразу
+    rules = auto_review_rules(task)
+    auto_approved = rules is not None and not files and rules.matches(text_content)
+    # После неверного ответа автопроверка не принимает следующие: иначе ответ
+    # можно подбирать перебором, а каждая ошибка добавляет отправку в очередь проверки
+    if auto_approved and context.bot_data['cooldowns'].has_unresolved_attempt(user_id, task_id):
+        auto_approved = False
+        logger.info(f"Ответ на задание #{task_id} подходит под автопроверку, но у пользователя {user_id} уже есть неверные попытки")
+    review = {'status': 'approved', 'reviewed_by': 'auto'} if auto_approved else {'status': 'pending'}
+
+    submissions[submission_id] = SubmissionRecord(
+        user_id=user_id,
+        task_id=task_id,
+        task_points=task['points'],
+        content_type=content_type,
+        files=files,  # Сохраняем все файлы
+        text_content=text_content,
+        submission_time=utc_now_iso(),
+        **review
+    )
+    file_index = context.bot_data['file_index']
+    duplicates = find_duplicate_files(file_index, submission_id, files)
+    index_submission_files(file_index, submission_id, files)
+    uow = UnitOfWork()
+    save_submissions(submissions, uow)
+    save_file_index(file_index, uow)
+    if auto_approved:
+        # Баллы начисляются в той же транзакции, что и сохранение отправки
+        entry = apply_points(users, user_id, task['points'], 'auto_review', ref=submission_id)
+        save_users(users, uow)
+        context.bot_data['points_ledger'].stage(uow, [entry])
+    if not uow.commit():
+        unindex_submission_files(file_index, submission_id, files)
+        await update.message.reply_text(
+            "❌ Не удалось сохранить отправку. Попробуйте завершить отправку еще раз.",
+            reply_markup=ReplyKeyboardMarkup([
+                [KeyboardButton("✅ Завершить отправку")],
+                [KeyboardButton("🔙 Отмена")]
+            ], resize_keyboard=True)
+        )
+        return USER_SEND_TASK_CONTENT
+    record_stat(context, 'submissions')
+    if not auto_approved:
+        context.bot_data['cooldowns'].record_attempt(
+            user_id, task_id, timestamp_of(submissions[submission_id].submission_time)
+        )
+    if duplicates:
+        logger.warning(f"Отправка #{submission_id} повторяет файлы отправок {', '.join(duplicates)}")
+
+    if auto_approved:
+        logger.info(f"Отправка #{submission_id} принята автопроверкой (задание #{task_id})")
+        record_stat(context, 'approvals')
+        record_stat(context, 'points_credited', task['points'])
+        task_type = task['type']
+        context.bot_data['cooldowns'].record_approval(
+            user_id, task_id, task_type, timestamp_of(submissions[submission_id].submission_time)
+        )
+        context.user_data.pop('selected_task', None)
+        context.user_data.pop('files', None)
+        context.user_data.pop('text_content', None)
+        await update.message.reply_text(
+            f"🎉 <b>Ответ верный, задание принято!</b>\n\n"
+            f"🎯 Задание: {task['title']}\n"
+            f"⭐ Начислено баллов: +{task['points']}\n"
+            f"💰 Теперь у вас: {user_data.points} баллов",
+            parse_mode='HTML',
+            reply_markup=get_main_keyboard()
+        )
+        if task_type == 'daily':
+            await update.message.reply_text(
+                "⏰ Напомнить, когда задание снова станет доступно?",
+                reply_markup=get_reminder_keyboard(task_id)
+            )
+        return ConversationHandler.END
 
     # Отправляем уведомление администраторам
-    for admin_id in ADMIN_IDS:
+    for admin_id in current_tenant.get().admin_ids:
         try:
             admin_message = (
                 f"📨 <b>Новое задание на проверку!</b>\n\n"
-                f"👤 Пользователь: {user_data['first_name']} {user_data['surname']} (ID: #{user_data['unique_id']})\n"
-                f"🎯 Задание: {task.get('title', 'Без названия')}\n"
+                f"👤 Пользователь: {user_data.first_name} {user_data.surname} (ID: #{user_data.unique_id})\n"
+                f"🎯 Задание: {task['title']}\n"
                 f"📝 Описание: {task['description']}\n"
                 f"⭐ Баллы: {task['points']}\n"
                 f"📎 Файлов отправлено: {len(files)}\n"
-                f"📝 Текста символов: {len(text_content)}\n\n"
-                f"💡 <i>Для проверки перейдите в панель администратора → '📨 Проверка заданий'</i>"
+                f"📝 Текста символов: {len(text_content)}\n"
+                + (f"⚠️ Файлы уже отправлялись: #{', #'.join(duplicates)}\n" if duplicates else "")
+                + "\n💡 <i>Для проверки перейдите в панель администратора → '📨 Проверка заданий'</i>"
             )
 
             # Отправляем все файлы по одному
@@ -1758,7 +5217,7 @@ async def finalize_task_submission(update: Update, context: ContextTypes.DEFAULT
     # Показываем подтверждение пользователю
     confirmation_text = (
         f"✅ <b>Задание успешно отправлено на проверку!</b>\n\n"
-        f"🎯 Задание: {task.get('title', 'Без названия')}\n"
+        f"🎯 Задание: {task['title']}\n"
         f"📎 Отправлено файлов: {len(files)}\n"
     )
     
@@ -1872,6 +5331,12 @@ async def admin_set_task_points(update: Update, context: ContextTypes.DEFAULT_TY
     )
     return ADMIN_CREATE_TASK_TYPE
 
+def get_task_rules_keyboard():
+    return ReplyKeyboardMarkup([
+        [KeyboardButton("⏭ Без автопроверки")],
+        [KeyboardButton("🔙 Отмена")]
+    ], resize_keyboard=True)
+
 async def admin_create_task_type(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка выбора типа задания и сохранение"""
     text = update.message.text
@@ -1894,14 +5359,52 @@ async def admin_create_task_type(update: Update, context: ContextTypes.DEFAULT_T
         return ADMIN_CREATE_TASK_TYPE
 
     # Определяем тип задания
-    task_type = "once" if text == "✅ Одноразовое задание" else "daily"
+    context.user_data['task_type'] = "once" if text == "✅ Одноразовое задание" else "daily"
+
+    await update.message.reply_text(
+        "🤖 <b>Автопроверка ответов</b>\n\n"
+        "Текстовые ответы без файлов, подходящие под правила, будут приняты сразу, "
+        "остальные попадут на обычную проверку. Отправьте правила, по одному на строку:\n\n"
+        "<code>ответ: лампа</code> - точный ответ (регистр и лишние пробелы не важны, строк может быть несколько)\n"
+        "<code>regex: \\d{4}</code> - регулярное выражение, под которое подходит весь ответ\n"
+        "<code>слова: свет, лампа</code> - ответ должен содержать все слова\n"
+        "<code>макс: 100</code> - максимальная длина ответа\n\n"
+        "Или нажмите «⏭ Без автопроверки».",
+        parse_mode='HTML',
+        reply_markup=get_task_rules_keyboard()
+    )
+    return ADMIN_CREATE_TASK_RULES
+
+async def admin_create_task_rules(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Правила автопроверки и сохранение задания"""
+    text = update.message.text
+
+    if text == "🔙 Отмена":
+        await update.message.reply_text(
+            "❌ Создание задания отменено.",
+            reply_markup=get_admin_keyboard()
+        )
+        return ConversationHandler.END
+
+    auto_review = None
+    if text != "⏭ Без автопроверки":
+        try:
+            auto_review = parse_auto_review_rules(text)
+        except ValueError as e:
+            await update.message.reply_text(
+                f"❌ {html.escape(str(e))}\nИсправьте правила и отправьте их еще раз:",
+                parse_mode='HTML',
+                reply_markup=get_task_rules_keyboard()
+            )
+            return ADMIN_CREATE_TASK_RULES
 
     # Получаем данные из контекста
+    task_type = context.user_data.get('task_type')
     task_title = context.user_data.get('task_title')
     task_description = context.user_data.get('task_description')
     task_points = context.user_data.get('task_points')
 
-    if not all([task_title, task_description, task_points]):
+    if not all([task_title, task_description, task_points, task_type]):
         await update.message.reply_text(
             "❌ Ошибка: данные задания не найдены. Начните заново.",
             reply_markup=get_admin_keyboard()
@@ -1920,6 +5423,8 @@ async def admin_create_task_type(update: Update, context: ContextTypes.DEFAULT_T
         'created_at': datetime.now().isoformat(),
         'created_by': update.effective_user.id
     }
+    if auto_review:
+        tasks[task_id]['auto_review'] = auto_review
     save_tasks(tasks)
 
     type_text = "одноразовое" if task_type == "once" else "ежедневное"
@@ -1930,8 +5435,9 @@ async def admin_create_task_type(update: Update, context: ContextTypes.DEFAULT_T
         f"📝 Название: {task_title}\n"
         f"📄 Описание: {task_description}\n"
         f"⭐ Баллы: {task_points}\n"
-        f"🔄 Тип: {type_text}\n\n"
-        f"Теперь пользователи могут видеть это задание и отправлять его на проверку.",
+        f"🔄 Тип: {type_text}\n"
+        + (f"🤖 Автопроверка: {html.escape(describe_auto_review(auto_review))}\n" if auto_review else "")
+        + "\nТеперь пользователи могут видеть это задание и отправлять его на проверку.",
         parse_mode='HTML',
         reply_markup=get_admin_keyboard()
     )
@@ -1940,6 +5446,7 @@ async def admin_create_task_type(update: Update, context: ContextTypes.DEFAULT_T
     context.user_data.pop('task_title', None)
     context.user_data.pop('task_description', None)
     context.user_data.pop('task_points', None)
+    context.user_data.pop('task_type', None)
 
     return ConversationHandler.END
 
@@ -1963,16 +5470,17 @@ async def admin_tasks_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
     tasks_text = "📋 <b>Список заданий:</b>\n\n"
 
     for task_id, task in tasks.items():
-        task_type = task.get('type', 'once')
+        task_type = task['type']
         type_icon = "✅" if task_type == "once" else "🔄"
         type_text = "Одноразовое" if task_type == "once" else "Ежедневное"
         
         tasks_text += (
             f"{type_icon} <b>Задание #{task_id}</b> ({type_text})\n"
-            f"📝 <b>Название:</b> {task.get('title', 'Без названия')}\n"
+            f"📝 <b>Название:</b> {task['title']}\n"
             f"📄 <b>Описание:</b> {task['description']}\n"
             f"⭐ <b>Баллы:</b> {task['points']}\n"
-            f"📅 <b>Создано:</b> {task.get('created_at', 'Неизвестно')[:10]}\n"
+            + (f"🤖 <b>Автопроверка:</b> {html.escape(describe_auto_review(task['auto_review']))}\n" if task.get('auto_review') else "")
+            + f"📅 <b>Создано:</b> {format_local_time(task['created_at'])[:10]}\n"
             f"────────────────────\n"
         )
 
@@ -1996,14 +5504,14 @@ async def submit_task_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     keyboard = []
     for task_id, task in tasks.items():
-        task_type = task.get('type', 'once')
+        task_type = task['type']
         type_icon = "✅" if task_type == "once" else "🔄"
         
         # Проверяем доступность задания
-        can_submit, _ = await check_task_availability(user_id, task_id, task)
+        can_submit, _ = check_task_availability(context.bot_data['cooldowns'], user_id, task_id, task)
         status_icon = "🟢" if can_submit else "🔴"
         
-        button_text = f"{status_icon} {type_icon} Задание #{task_id} - {task.get('title', 'Без названия')}"
+        button_text = f"{status_icon} {type_icon} Задание #{task_id} - {task['title']}"
         keyboard.append([KeyboardButton(button_text)])
     
     keyboard.append([KeyboardButton("🔙 Отмена")])
@@ -2043,7 +5551,7 @@ async def admin_fix_id_start(update: Update, context: ContextTypes.DEFAULT_TYPE)
     keyboard = []
     for uid, user_data in users.items():
         keyboard.append([KeyboardButton(
-            f"#{user_data['unique_id']} - {user_data['first_name']} {user_data['surname']}"
+            f"#{user_data.unique_id} - {user_data.first_name} {user_data.surname}"
         )])
 
     keyboard.append([KeyboardButton("🔙 Отмена")])
@@ -2082,9 +5590,9 @@ async def admin_fix_id_select_user(update: Update, context: ContextTypes.DEFAULT
     selected_user = None
 
     for uid, user_data in users.items():
-        if user_data['unique_id'] == user_unique_id:
+        if user_data.unique_id == user_unique_id:
             selected_user = user_data
-            selected_user['telegram_id'] = uid
+            context.user_data['selected_user_id'] = uid
             break
 
     if not selected_user:
@@ -2099,9 +5607,9 @@ async def admin_fix_id_select_user(update: Update, context: ContextTypes.DEFAULT
 
     await update.message.reply_text(
         f"👤 <b>Выбран пользователь:</b>\n\n"
-        f"📝 Имя: {selected_user['first_name']}\n"
-        f"📝 Фамилия: {selected_user['surname']}\n"
-        f"🆔 Текущий ID: #{selected_user['unique_id']}\n\n"
+        f"📝 Имя: {selected_user.first_name}\n"
+        f"📝 Фамилия: {selected_user.surname}\n"
+        f"🆔 Текущий ID: #{selected_user.unique_id}\n\n"
         "Введите новый ID (только число):",
         parse_mode='HTML',
         reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🔙 Отмена")]], resize_keyboard=True)
@@ -2145,22 +5653,22 @@ async def admin_fix_id_set_new(update: Update, context: ContextTypes.DEFAULT_TYP
 
     # Проверяем, не занят ли новый ID другим пользователем
     for uid, user_data in users.items():
-        if user_data['unique_id'] == new_id and uid != selected_user['telegram_id']:
+        if user_data.unique_id == new_id and uid != context.user_data.get('selected_user_id'):
             await update.message.reply_text(
-                f"❌ ID #{new_id} уже занят пользователем {user_data['first_name']} {user_data['surname']}.\n"
+                f"❌ ID #{new_id} уже занят пользователем {user_data.first_name} {user_data.surname}.\n"
                 f"Пожалуйста, выберите другой ID:",
                 reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🔙 Отмена")]], resize_keyboard=True)
             )
             return ADMIN_FIX_ID_SET_NEW
 
     # Обновляем ID пользователя
-    old_id = selected_user['unique_id']
-    users[selected_user['telegram_id']]['unique_id'] = new_id
+    old_id = selected_user.unique_id
+    users[context.user_data['selected_user_id']].unique_id = new_id
     save_users(users)
 
     await update.message.reply_text(
         f"✅ <b>ID успешно изменен!</b>\n\n"
-        f"👤 Пользователь: {selected_user['first_name']} {selected_user['surname']}\n"
+        f"👤 Пользователь: {selected_user.first_name} {selected_user.surname}\n"
         f"🆔 Старый ID: #{old_id}\n"
         f"🆕 Новый ID: #{new_id}",
         parse_mode='HTML',
@@ -2194,7 +5702,7 @@ async def admin_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ У вас нет доступа.")
         return
 
-    users = load_users()
+    users = (await context.bot_data['storage'].read_store.snapshot('users')).users
 
     if not users:
         await update.message.reply_text(
@@ -2207,10 +5715,10 @@ async def admin_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     for uid, user_data in users.items():
         users_list += (
-            f"👤 {user_data['first_name']} {user_data['surname']}\n"
-            f"🆔 ID: #{user_data['unique_id']}\n"
-            f"⭐ Баллы: {user_data['points']}\n"
-            f"📅 Регистрация: {user_data.get('registered_at', 'Неизвестно')[:10]}\n"
+            f"👤 {user_data.first_name} {user_data.surname}\n"
+            f"🆔 ID: #{user_data.unique_id}\n"
+            f"⭐ Баллы: {user_data.points}\n"
+            f"📅 Регистрация: {format_local_time(user_data.registered_at)[:10]}\n"
             f"────────────────────\n"
         )
 
@@ -2220,6 +5728,43 @@ async def admin_users_list(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=get_admin_keyboard()
     )
 
+async def admin_points_ledger(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """История баллов пользователя и сверка баланса с журналом: /ledger ID"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет доступа.")
+        return
+
+    try:
+        unique_id = int(context.args[0].lstrip('#'))
+    except (IndexError, ValueError):
+        await update.message.reply_text(
+            "🧾 История баллов пользователя: /ledger ID\n\nПример: /ledger 12",
+            reply_markup=get_admin_keyboard()
+        )
+        return
+
+    users = load_users()
+    telegram_id = next((uid for uid, user in users.items() if user.unique_id == unique_id), None)
+    if telegram_id is None:
+        await update.message.reply_text("❌ Пользователь не найден.", reply_markup=get_admin_keyboard())
+        return
+
+    user = users[telegram_id]
+    ledger = context.bot_data['points_ledger']
+    points, earned = ledger.totals(telegram_id)
+    if (points, earned) == (user.points, user.total_earned):
+        check = "✅ Баланс совпадает с журналом"
+    else:
+        check = f"⚠️ Расхождение: по журналу {points} баллов, заработано {earned}"
+    entries = ledger.history(telegram_id)
+    await update.message.reply_text(
+        f"🧾 <b>Баллы пользователя #{unique_id}</b> {html.escape(user_display_name(users, telegram_id))}\n"
+        f"💰 Баллы: {user.points}, ⭐ заработано: {user.total_earned}\n{check}\n\n"
+        + ("\n".join(format_ledger_entries(entries)) if entries else "Операций пока не было."),
+        parse_mode='HTML',
+        reply_markup=get_admin_keyboard()
+    )
+
 async def admin_add_points_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало процесса добавления баллов"""
     user_id = update.effective_user.id
@@ -2241,7 +5786,7 @@ async def admin_add_points_start(update: Update, context: ContextTypes.DEFAULT_T
     keyboard = []
     for uid, user_data in users.items():
         keyboard.append([KeyboardButton(
-            f"#{user_data['unique_id']} - {user_data['first_name']} {user_data['surname']} ({user_data['points']} баллов)"
+            f"#{user_data.unique_id} - {user_data.first_name} {user_data.surname} ({user_data.points} баллов)"
         )])
 
     keyboard.append([KeyboardButton("🔙 Отмена")])
@@ -2280,9 +5825,9 @@ async def admin_select_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
     selected_user = None
 
     for uid, user_data in users.items():
-        if user_data['unique_id'] == user_unique_id:
+        if user_data.unique_id == user_unique_id:
             selected_user = user_data
-            selected_user['telegram_id'] = uid
+            context.user_data['selected_user_id'] = uid
             break
 
     if not selected_user:
@@ -2297,10 +5842,10 @@ async def admin_select_user(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     await update.message.reply_text(
         f"👤 <b>Выбран пользователь:</b>\n\n"
-        f"📝 Имя: {selected_user['first_name']}\n"
-        f"📝 Фамилия: {selected_user['surname']}\n"
-        f"🆔 ID: #{selected_user['unique_id']}\n"
-        f"⭐ Текущие баллы: {selected_user['points']}\n\n"
+        f"📝 Имя: {selected_user.first_name}\n"
+        f"📝 Фамилия: {selected_user.surname}\n"
+        f"🆔 ID: #{selected_user.unique_id}\n"
+        f"⭐ Текущие баллы: {selected_user.points}\n\n"
         "Введите количество баллов для добавления:",
         parse_mode='HTML',
         reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🔙 Отмена")]], resize_keyboard=True)
@@ -2341,20 +5886,28 @@ async def admin_add_points_finish(update: Update, context: ContextTypes.DEFAULT_
         return ConversationHandler.END
 
     users = load_users()
-    telegram_id = selected_user['telegram_id']
+    telegram_id = context.user_data.get('selected_user_id')
 
     if telegram_id in users:
-        users[telegram_id]['points'] += points
-        # И добавляем к общему заработку
-        users[telegram_id]['total_earned'] += points
-        save_users(users)
+        # Начисление (и к общему заработку) вместе с записью в журнал баллов
+        entry = apply_points(users, telegram_id, points, 'admin', admin_id=update.effective_user.id)
+        uow = UnitOfWork()
+        save_users(users, uow)
+        context.bot_data['points_ledger'].stage(uow, [entry])
+        if not uow.commit():
+            await update.message.reply_text(
+                "❌ Не удалось сохранить начисление. Попробуйте еще раз.",
+                reply_markup=get_admin_keyboard()
+            )
+            return ConversationHandler.END
+        record_stat(context, 'points_credited', points)
 
-        new_points = users[telegram_id]['points']
+        new_points = users[telegram_id].points
 
         await update.message.reply_text(
             f"✅ <b>Баллы успешно добавлены!</b>\n\n"
-            f"👤 Пользователь: {selected_user['first_name']} {selected_user['surname']}\n"
-            f"🆔 ID: #{selected_user['unique_id']}\n"
+            f"👤 Пользователь: {selected_user.first_name} {selected_user.surname}\n"
+            f"🆔 ID: #{selected_user.unique_id}\n"
             f"⭐ Добавлено баллов: +{points}\n"
             f"💰 Новый баланс: {new_points}",
             parse_mode='HTML',
@@ -2382,6 +5935,184 @@ async def admin_add_points_finish(update: Update, context: ContextTypes.DEFAULT_
 
     return ConversationHandler.END
 
+def split_award_line(line):
+    """Поля строки начисления: через пробелы ("12 50 За хакатон") или CSV (",", ";", табуляция)"""
+    parts = line.split(maxsplit=2)
+    if len(parts) >= 2 and parts[0].lstrip('#').isdigit() and parts[1].lstrip('+-').isdigit():
+        return parts
+    for delimiter in (';', '\t', ','):
+        if delimiter in line:
+            return [field.strip() for field in next(csv.reader([line], delimiter=delimiter))]
+    return parts
+
+def parse_points_awards(text, users):
+    """Разбор списка "уникальный_ID баллы [комментарий]" с проверкой по индексу unique_id.
+
+    Возвращает начисления {telegram_id: [баллы, [комментарии]]} и список ошибок;
+    повторяющиеся ID суммируются.
+    """
+    by_unique_id = {user.unique_id: telegram_id for telegram_id, user in users.items()}
+    awards = {}
+    errors = []
+    for number, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        parts = split_award_line(line)
+        raw_id = parts[0].lstrip('#')
+        # Первая строка CSV может быть заголовком
+        if number == 1 and not raw_id.isdigit():
+            continue
+        try:
+            unique_id = int(raw_id)
+            points = int(parts[1])
+        except (IndexError, ValueError):
+            errors.append(f"строка {number}: ожидается «ID баллы [комментарий]»")
+            continue
+        if points <= 0:
+            errors.append(f"строка {number}: количество баллов должно быть больше 0")
+            continue
+        telegram_id = by_unique_id.get(unique_id)
+        if telegram_id is None:
+            errors.append(f"строка {number}: пользователь #{unique_id} не найден")
+            continue
+        award = awards.setdefault(telegram_id, [0, []])
+        award[0] += points
+        if len(parts) > 2 and parts[2].strip():
+            award[1].append(parts[2].strip())
+    return awards, errors
+
+async def admin_bulk_points_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начисление баллов нескольким пользователям по списку"""
+    user_id = update.effective_user.id
+
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет доступа.")
+        return ConversationHandler.END
+
+    await update.message.reply_text(
+        "⭐ <b>Начисление баллов списком</b>\n\n"
+        "Отправьте список сообщением или CSV-файлом, по строке на пользователя:\n"
+        "<code>уникальный_ID баллы [комментарий]</code>\n\n"
+        "Например:\n"
+        "<code>12 50 За участие в хакатоне\n"
+        "#15 30</code>\n\n"
+        "В CSV поля разделяются запятой, точкой с запятой или табуляцией.",
+        parse_mode='HTML',
+        reply_markup=ReplyKeyboardMarkup([[KeyboardButton("🔙 Отмена")]], resize_keyboard=True)
+    )
+    return ADMIN_BULK_POINTS_INPUT
+
+async def admin_bulk_points_input(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Проверка списка начислений и подтверждение"""
+    document = update.message.document
+    if document:
+        if document.file_size and document.file_size > BULK_POINTS_MAX_FILE_BYTES:
+            await update.message.reply_text("❌ Файл слишком большой. Отправьте список до 1 МБ.")
+            return ADMIN_BULK_POINTS_INPUT
+        tg_file = await document.get_file()
+        content = await tg_file.download_as_bytearray()
+        text = bytes(content).decode('utf-8-sig', errors='replace')
+    else:
+        text = update.message.text
+
+    users = load_users()
+    awards, errors = parse_points_awards(text, users)
+
+    if errors:
+        shown = "\n".join(errors[:20])
+        more = f"\n... и еще {len(errors) - 20}" if len(errors) > 20 else ""
+        await update.message.reply_text(
+            f"❌ <b>Список не принят, ошибок: {len(errors)}</b>\n\n{html.escape(shown)}{more}\n\n"
+            f"Исправьте список и отправьте его снова.",
+            parse_mode='HTML'
+        )
+        return ADMIN_BULK_POINTS_INPUT
+    if not awards:
+        await update.message.reply_text("❌ В списке нет ни одного начисления. Отправьте список снова.")
+        return ADMIN_BULK_POINTS_INPUT
+
+    context.user_data['bulk_awards'] = awards
+    lines = [
+        f"#{users[telegram_id].unique_id} {html.escape(users[telegram_id].name)}: +{points}"
+        for telegram_id, (points, _) in list(awards.items())[:15]
+    ]
+    if len(awards) > 15:
+        lines.append(f"... и еще {len(awards) - 15}")
+
+    await update.message.reply_text(
+        f"⭐ <b>Проверьте начисление</b>\n\n"
+        f"👥 Пользователей: {len(awards)}\n"
+        f"⭐ Всего баллов: {sum(points for points, _ in awards.values())}\n\n"
+        + "\n".join(lines),
+        parse_mode='HTML',
+        reply_markup=ReplyKeyboardMarkup([
+            [KeyboardButton("✅ Начислить")],
+            [KeyboardButton("🔙 Отмена")]
+        ], resize_keyboard=True)
+    )
+    return ADMIN_BULK_POINTS_CONFIRM
+
+async def admin_bulk_points_confirm(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Начисление всех баллов одной записью и пакетная рассылка уведомлений"""
+    if update.message.text != "✅ Начислить":
+        await update.message.reply_text("Нажмите «✅ Начислить» или «🔙 Отмена».")
+        return ADMIN_BULK_POINTS_CONFIRM
+
+    awards = context.user_data.pop('bulk_awards', {})
+    users = load_users()
+    credited = {}
+    ledger_entries = []
+    for telegram_id, (points, reasons) in awards.items():
+        # Пользователя могли удалить, пока список ждал подтверждения
+        if telegram_id not in users:
+            continue
+        ledger_entries.append(apply_points(
+            users, telegram_id, points, 'bulk_points',
+            admin_id=update.effective_user.id, note="; ".join(reasons) or None
+        ))
+        credited[telegram_id] = (points, reasons)
+    uow = UnitOfWork()
+    save_users(users, uow)
+    context.bot_data['points_ledger'].stage(uow, ledger_entries)
+    if not uow.commit():
+        await update.message.reply_text(
+            "❌ Не удалось сохранить начисления. Попробуйте еще раз.",
+            reply_markup=get_admin_keyboard()
+        )
+        return ConversationHandler.END
+
+    total_points = sum(points for points, _ in credited.values())
+    record_stat(context, 'points_credited', total_points)
+
+    messages = []
+    for telegram_id, (points, reasons) in credited.items():
+        reason_text = "".join(f"💬 {html.escape(reason)}\n" for reason in reasons)
+        messages.append((
+            telegram_id,
+            f"🎁 <b>Вам начислены баллы!</b>\n\n"
+            f"⭐ Добавлено: +{points} баллов\n"
+            f"{reason_text}"
+            f"💰 Теперь у вас: {users[telegram_id].points} баллов",
+            None
+        ))
+    context.application.create_task(send_batched(context.bot, messages))
+
+    logger.info(
+        f"Администратор {update.effective_user.id} начислил списком {total_points} баллов "
+        f"{len(credited)} пользователям"
+    )
+    await update.message.reply_text(
+        f"✅ <b>Баллы начислены!</b>\n\n"
+        f"👥 Пользователей: {len(credited)}\n"
+        f"⭐ Всего баллов: {total_points}\n"
+        + (f"⏭️ Пропущено (пользователь удален): {len(awards) - len(credited)}\n" if len(awards) != len(credited) else "")
+        + "📨 Уведомления отправляются.",
+        parse_mode='HTML',
+        reply_markup=get_admin_keyboard()
+    )
+    return ConversationHandler.END
+
 async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Статистика для администратора"""
     user_id = update.effective_user.id
@@ -2390,17 +6121,16 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("❌ У вас нет доступа.")
         return
 
-    users = load_users()
-    tasks = load_tasks()
-    submissions = load_submissions()
+    snapshot = await context.bot_data['storage'].read_store.snapshot('users', 'tasks', 'submissions')
+    users, tasks, submissions = snapshot.users, snapshot.tasks, snapshot.submissions
 
     total_users = len(users)
-    total_points = sum(user['points'] for user in users.values())
+    total_points = sum(user.points for user in users.values())
     total_tasks = len(tasks)
 
-    pending_subs = len([s for s in submissions.values() if s['status'] == 'pending'])
-    approved_subs = len([s for s in submissions.values() if s['status'] == 'approved'])
-    rejected_subs = len([s for s in submissions.values() if s['status'] == 'rejected'])
+    pending_subs = len([s for s in submissions.values() if s.status == 'pending'])
+    approved_subs = len([s for s in submissions.values() if s.status == 'approved'])
+    rejected_subs = len([s for s in submissions.values() if s.status == 'rejected'])
 
     stats_text = (
         "📊 <b>Статистика системы</b>\n\n"
@@ -2410,7 +6140,8 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"📋 Всего заданий: {total_tasks}\n"
         f"📨 Отправок на проверке: {pending_subs}\n"
         f"✅ Принятых заданий: {approved_subs}\n"
-        f"❌ Отклоненных заданий: {rejected_subs}"
+        f"❌ Отклоненных заданий: {rejected_subs}\n\n"
+        + format_stats_trends(context.bot_data['stats'])
     )
 
     await update.message.reply_text(
@@ -2419,6 +6150,362 @@ async def admin_stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
         reply_markup=get_admin_keyboard()
     )
 
+def format_stats_trends(stats, now=None):
+    """Динамика событий за 24 часа, 7 и 30 дней по счетчикам StatsRollup"""
+    now = datetime.now(timezone.utc) if now is None else now
+    today = now.date()
+    periods = (
+        stats.last_hours(24, now),
+        stats.totals(today - timedelta(days=6), today),
+        stats.totals(today - timedelta(days=29), today),
+    )
+    lines = ["📈 <b>Динамика (24 ч / 7 дн / 30 дн, UTC):</b>"]
+    for event in STAT_EVENTS:
+        lines.append(f"{STAT_EVENT_TITLES[event]}: " + " / ".join(str(period[event]) for period in periods))
+    lines.append("\nПроизвольный период: /stats_range ГГГГ-ММ-ДД ГГГГ-ММ-ДД")
+    return "\n".join(lines)
+
+async def admin_stats_range(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Статистика за произвольный период по дневным счетчикам"""
+    user_id = update.effective_user.id
+
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет доступа.")
+        return
+
+    args = context.args or []
+    try:
+        date_from = datetime.strptime(args[0], '%Y-%m-%d').date()
+        date_to = datetime.strptime(args[1], '%Y-%m-%d').date() if len(args) > 1 else date_from
+    except (IndexError, ValueError):
+        await update.message.reply_text(
+            "📊 Статистика за период (UTC):\n"
+            "/stats_range ГГГГ-ММ-ДД [ГГГГ-ММ-ДД]\n\n"
+            "Пример: /stats_range 2025-11-01 2025-11-30",
+            reply_markup=get_admin_keyboard()
+        )
+        return
+    if date_to < date_from:
+        date_from, date_to = date_to, date_from
+
+    stats = context.bot_data['stats']
+    totals = stats.totals(date_from, date_to)
+    lines = [f"📊 <b>Статистика за {date_from} - {date_to} (UTC)</b>\n"]
+    for event in STAT_EVENTS:
+        lines.append(f"{STAT_EVENT_TITLES[event]}: {totals[event]}")
+
+    # По дням - только для периодов до месяца, чтобы сообщение не превышало лимит
+    if (date_to - date_from).days < 31:
+        lines.append("\n<b>По дням:</b>")
+        for day, counters in stats.daily_series(date_from, date_to):
+            values = " ".join(
+                f"{STAT_EVENT_TITLES[event].split()[0]}{counters[event]}"
+                for event in STAT_EVENTS if counters.get(event)
+            )
+            lines.append(f"{day}: {values or '-'}")
+
+    await update.message.reply_text(
+        "\n".join(lines),
+        parse_mode='HTML',
+        reply_markup=get_admin_keyboard()
+    )
+
+def update_rate_kind(update):
+    """Вид апдейта для ограничения частоты или None, если не ограничивается"""
+    if update.callback_query is not None:
+        return 'callback'
+    message = update.effective_message
+    if message is None:
+        return None
+    return 'upload' if message.effective_attachment is not None else 'menu'
+
+async def rate_limit_updates(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Группа -1: апдейты сверх лимита отбрасываются до обработчиков и чтения данных"""
+    user = update.effective_user
+    kind = update_rate_kind(update)
+    if user is None or kind is None or is_admin(user.id):
+        return
+    limiter = context.bot_data['rate_limiter']
+    if limiter.allow(user.id, kind):
+        return
+
+    if limiter.should_notify(user.id, kind):
+        logger.warning(
+            f"Пользователь {user.id} превысил лимит ({kind}), "
+            f"всего отброшено апдейтов: {limiter.dropped_by_user[user.id]}"
+        )
+        text = f"⏳ Слишком много запросов. Подождите {limiter.retry_after(user.id, kind)} с и повторите."
+        try:
+            if update.callback_query is not None:
+                await update.callback_query.answer(text)
+            else:
+                await update.effective_message.reply_text(text)
+        except TelegramError as e:
+            logger.error(f"Не удалось предупредить пользователя {user.id} о лимите: {e}")
+    raise ApplicationHandlerStop
+
+async def admin_rate_limits(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Счетчики ограничения частоты и чаще всего ограничиваемые пользователи"""
+    user_id = update.effective_user.id
+
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет доступа.")
+        return
+
+    limiter = context.bot_data['rate_limiter']
+    lines = ["🚦 <b>Ограничение частоты запросов</b> (с запуска бота)\n"]
+    for kind, (rate, burst) in limiter.limits.items():
+        lines.append(
+            f"{RATE_KIND_TITLES.get(kind, kind)}: пропущено {limiter.passed[kind]}, "
+            f"отброшено {limiter.dropped[kind]} (лимит {rate:g}/с, запас {burst:g})"
+        )
+
+    top = limiter.dropped_by_user.most_common(10)
+    if top:
+        users = load_users()
+        lines.append("\n<b>Чаще всего ограничивались:</b>")
+        for telegram_id, dropped in top:
+            lines.append(
+                f"#{user_display_id(users, str(telegram_id))} "
+                f"{html.escape(user_display_name(users, str(telegram_id)))} - {dropped}"
+            )
+    else:
+        lines.append("\nНикого не ограничивали.")
+
+    await update.message.reply_text(
+        "\n".join(lines),
+        parse_mode='HTML',
+        reply_markup=get_admin_keyboard()
+    )
+
+# Экспорт данных: коллекция -> (файл, поле времени для фильтра по датам, колонки)
+EXPORT_COLLECTIONS = {
+    'users': (DATA_FILE, 'registered_at', (
+        'telegram_id', 'unique_id', 'first_name', 'surname', 'points', 'total_earned', 'registered_at',
+    )),
+    'submissions': (SUBMISSIONS_FILE, 'submission_time', (
+        'submission_id', 'user_id', 'user_unique_id', 'user_name', 'task_id', 'task_title',
+        'task_points', 'status', 'submission_time', 'content_type', 'files_count', 'text_content',
+    )),
+    'orders': (ORDERS_FILE, 'order_time', (
+        'order_id', 'user_id', 'user_unique_id', 'user_name', 'product_id', 'product_name',
+        'price', 'status', 'order_time',
+    )),
+}
+EXPORT_FORMATS = ('csv', 'jsonl')
+# Ограничение Bot API на размер документа, отправляемого ботом
+EXPORT_MAX_DOCUMENT_BYTES = 50 * 1024 * 1024
+
+def parse_export_args(args):
+    """Разбор аргументов /export: коллекция [csv|jsonl] [с ГГГГ-ММ-ДД] [по ГГГГ-ММ-ДД] [статус]"""
+    if not args or args[0] not in EXPORT_COLLECTIONS:
+        raise ValueError("Укажите коллекцию: users, submissions или orders.")
+
+    options = {'collection': args[0], 'fmt': 'csv', 'date_from': None, 'date_to': None, 'status': None}
+    dates = []
+    for arg in args[1:]:
+        if arg in EXPORT_FORMATS:
+            options['fmt'] = arg
+            continue
+        try:
+            datetime.strptime(arg, '%Y-%m-%d')
+            dates.append(arg)
+            continue
+        except ValueError:
+            pass
+        if options['status'] is not None:
+            raise ValueError(f"Непонятный аргумент: {arg}")
+        options['status'] = arg
+
+    if len(dates) > 2:
+        raise ValueError("Укажите не больше двух дат: начало и конец периода.")
+    if dates:
+        options['date_from'] = dates[0]
+        options['date_to'] = dates[1] if len(dates) == 2 else None
+    if options['status'] and options['collection'] == 'users':
+        raise ValueError("У пользователей нет статуса, фильтр по статусу недоступен.")
+    return options
+
+def record_fields(record):
+    """Поля записи как словарь (для выгрузки); для отсутствующей записи - пустой"""
+    if record is None:
+        return {}
+    return record.to_dict() if isinstance(record, Record) else record
+
+def export_user_row(telegram_id, user, users, catalog):
+    return {
+        'telegram_id': telegram_id,
+        'unique_id': user.get('unique_id'),
+        'first_name': user.get('first_name'),
+        'surname': user.get('surname'),
+        'points': user.get('points'),
+        'total_earned': user.get('total_earned'),
+        'registered_at': user.get('registered_at'),
+    }
+
+def export_submission_row(submission_id, submission, users, catalog):
+    user = record_fields(users.get(submission.get('user_id')))
+    task = catalog.get(submission.get('task_id'), {})
+    return {
+        'submission_id': submission_id,
+        'user_id': submission.get('user_id'),
+        'user_unique_id': user.get('unique_id'),
+        'user_name': user.get('name') or submission.get('user_name'),
+        'task_id': submission.get('task_id'),
+        'task_title': task.get('title') or submission.get('task_title'),
+        'task_points': submission.get('task_points'),
+        'status': submission.get('status'),
+        'submission_time': submission.get('submission_time'),
+        'content_type': submission.get('content_type'),
+        'files_count': len(submission.get('files') or []),
+        'text_content': submission.get('text_content'),
+    }
+
+def export_order_row(order_id, order, users, catalog):
+    user = record_fields(users.get(order.get('user_id')))
+    product = catalog.get(order.get('product_id'), {})
+    return {
+        'order_id': order_id,
+        'user_id': order.get('user_id'),
+        'user_unique_id': user.get('unique_id'),
+        'user_name': user.get('name') or order.get('user_name'),
+        'product_id': order.get('product_id'),
+        'product_name': order.get('product_name') or product.get('name'),
+        'price': order.get('price'),
+        'status': order.get('status'),
+        'order_time': order.get('order_time'),
+    }
+
+EXPORT_ROW_BUILDERS = {
+    'users': (export_user_row, None),
+    'submissions': (export_submission_row, 'tasks'),
+    'orders': (export_order_row, 'products'),
+}
+
+def export_snapshot_names(collection):
+    """Коллекции снимка чтения, нужные для выгрузки collection"""
+    catalog = EXPORT_ROW_BUILDERS[collection][1]
+    return tuple(dict.fromkeys(name for name in (collection, 'users', catalog) if name))
+
+def iter_export_rows(snapshot, collection, date_from=None, date_to=None, status=None):
+    """Строки выгрузки по одной: итоговая таблица целиком в памяти не собирается.
+
+    Записи берутся из снимка чтения (все коллекции одной версии), имена
+    пользователей, заданий и товаров подставляются из того же снимка.
+    """
+    _, time_field, _ = EXPORT_COLLECTIONS[collection]
+    build_row, catalog_name = EXPORT_ROW_BUILDERS[collection]
+    records = getattr(snapshot, collection)
+    users = snapshot.users
+    catalog = getattr(snapshot, catalog_name) if catalog_name else {}
+
+    for record_id, record in records.items():
+        record = record_fields(record)
+        # Даты хранятся в ISO-формате, поэтому достаточно сравнить префикс ГГГГ-ММ-ДД
+        day = str(record.get(time_field) or '')[:10]
+        if date_from and day < date_from:
+            continue
+        if date_to and day > date_to:
+            continue
+        if status and record.get('status') != status:
+            continue
+        yield build_row(record_id, record, users, catalog)
+
+def write_export(path, rows, fmt, columns):
+    """Запись строк в gzip-файл по мере генерации, возвращает их количество"""
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            writer = csv.DictWriter(f, fieldnames=columns)
+            writer.writeheader()
+            for row in rows:
+                writer.writerow(row)
+                count += 1
+        else:
+            for row in rows:
+                f.write(json.dumps(row, ensure_ascii=False) + '\n')
+                count += 1
+    return count
+
+def export_to_file(snapshot, collection, fmt='csv', date_from=None, date_to=None, status=None):
+    """Выгрузка коллекции из снимка чтения во временный файл; вызывается в отдельном потоке"""
+    fd, path = tempfile.mkstemp(prefix=f'export_{collection}_', suffix=f'.{fmt}.gz')
+    os.close(fd)
+    try:
+        rows = iter_export_rows(snapshot, collection, date_from, date_to, status)
+        count = write_export(path, rows, fmt, EXPORT_COLLECTIONS[collection][2])
+    except Exception:
+        os.remove(path)
+        raise
+    return path, count
+
+async def admin_export(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Выгрузка пользователей, отправок или заказов в сжатый CSV/JSONL файл"""
+    user_id = update.effective_user.id
+
+    if not is_admin(user_id):
+        await update.message.reply_text("❌ У вас нет доступа.")
+        return
+
+    usage = (
+        "📤 <b>Экспорт данных</b>\n\n"
+        "/export коллекция [формат] [с] [по] [статус]\n\n"
+        "• коллекция: users, submissions, orders\n"
+        "• формат: csv (по умолчанию) или jsonl\n"
+        "• с / по: даты в формате ГГГГ-ММ-ДД\n"
+        "• статус: pending, approved, rejected (отправки), completed (заказы)\n\n"
+        "Пример: /export submissions csv 2025-11-01 2025-11-30 approved"
+    )
+    try:
+        options = parse_export_args(context.args or [])
+    except ValueError as e:
+        message = usage if not context.args else f"❌ {e}\n\n{usage}"
+        await update.message.reply_text(message, parse_mode='HTML', reply_markup=get_admin_keyboard())
+        return
+
+    await update.message.reply_text("⏳ Готовлю выгрузку...")
+
+    # Снимок не меняется, пока файл пишется в отдельном потоке, и не задерживает записи
+    try:
+        snapshot = await context.bot_data['storage'].read_store.snapshot(*export_snapshot_names(options['collection']))
+        path, count = await asyncio.to_thread(export_to_file, snapshot, **options)
+    except Exception as e:
+        logger.error(f"Ошибка экспорта {options['collection']}: {e}")
+        await update.message.reply_text("❌ Не удалось подготовить выгрузку.", reply_markup=get_admin_keyboard())
+        return
+
+    try:
+        size = os.path.getsize(path)
+        logger.info(f"Экспорт {options['collection']}: {count} записей, {size} байт")
+        if count == 0:
+            await update.message.reply_text("📭 Нет записей по заданным фильтрам.", reply_markup=get_admin_keyboard())
+            return
+        if size > EXPORT_MAX_DOCUMENT_BYTES:
+            await update.message.reply_text(
+                "❌ Файл выгрузки больше 50 МБ. Сузьте период или добавьте фильтр по статусу.",
+                reply_markup=get_admin_keyboard()
+            )
+            return
+
+        filters_text = []
+        if options['date_from']:
+            filters_text.append(f"с {options['date_from']}")
+        if options['date_to']:
+            filters_text.append(f"по {options['date_to']}")
+        if options['status']:
+            filters_text.append(f"статус {options['status']}")
+        filename = f"{options['collection']}_{datetime.now().strftime('%Y%m%d_%H%M')}.{options['fmt']}.gz"
+        with open(path, 'rb') as f:
+            await context.bot.send_document(
+                chat_id=update.effective_chat.id,
+                document=f,
+                filename=filename,
+                caption=f"📤 {options['collection']}: {count} записей" + (f" ({', '.join(filters_text)})" if filters_text else ""),
+                reply_markup=get_admin_keyboard()
+            )
+    finally:
+        os.remove(path)
+
 async def admin_reset_users_start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Начало процесса сброса пользователей"""
     user_id = update.effective_user.id
@@ -2438,16 +6525,20 @@ async def admin_reset_users_start(update: Update, context: ContextTypes.DEFAULT_
 
     # Показываем подтверждение с информацией
     users_count = len(users)
-    total_points = sum(user['points'] for user in users.values())
+    total_points = sum(user.points for user in users.values())
 
     confirmation_text = (
         f"⚠️ <b>ВНИМАНИЕ! ОПАСНАЯ ОПЕРАЦИЯ!</b>\n\n"
         f"Вы собираетесь удалить ВСЕХ пользователей:\n"
         f"👥 Количество пользователей: {users_count}\n"
         f"⭐ Всего баллов в системе: {total_points}\n\n"
-        f"<b>Эта операция необратима!</b>\n\n"
-        f"Для подтверждения введите: <code>ПОДТВЕРЖДАЮ СБРОС</code>\n"
-        f"Для отмены нажмите кнопку \"🔙 Отмена\""
+        + (
+            "Перед сбросом сохраняется снимок данных, вернуть их можно командой /restore.\n\n"
+            if context.bot_data['storage'].snapshot_dir is not None
+            else "⚠️ Хранилище не поддерживает снимки: данные нельзя будет вернуть.\n\n"
+        )
+        + "Для подтверждения введите: <code>ПОДТВЕРЖДАЮ СБРОС</code>\n"
+        "Для отмены нажмите кнопку \"🔙 Отмена\""
     )
 
     keyboard = [[KeyboardButton("🔙 Отмена")]]
@@ -2479,10 +6570,22 @@ async def admin_reset_users_confirm(update: Update, context: ContextTypes.DEFAUL
         )
         return ADMIN_CONFIRM_RESET
 
+    # Снимок перед сбросом: без него сброс не выполняется (если хранилище поддерживает снимки)
+    try:
+        async with context.bot_data['snapshot_lock']:
+            snapshot = await create_snapshot(context.bot_data, 'reset', force=True)
+    except Exception as e:
+        logger.error(f"Не удалось создать снимок перед сбросом: {e}")
+        await update.message.reply_text(
+            "❌ Не удалось сохранить снимок данных, сброс отменен.",
+            reply_markup=get_admin_keyboard()
+        )
+        return ConversationHandler.END
+
     # Сохраняем информацию о сбросе для логов
     users = load_users()
     users_count = len(users)
-    total_points = sum(user['points'] for user in users.values())
+    total_points = sum(user.points for user in users.values())
 
     # Сбрасываем пользователей
     save_users({})
@@ -2491,6 +6594,17 @@ async def admin_reset_users_confirm(update: Update, context: ContextTypes.DEFAUL
     save_tasks({})
     save_submissions({})
     save_orders({})
+    # Номера отправок начнутся заново: прежние решения и закрепления к ним не относятся
+    context.bot_data['idempotency'] = IdempotencyCache()
+    context.bot_data['review_leases'] = ReviewLeases()
+    context.bot_data['cooldowns'] = CooldownIndex()
+    save_reminders(set())
+    context.bot_data['stats'] = StatsRollup()
+    save_stats(context.bot_data['stats'])
+    context.bot_data['file_index'] = {}
+    save_file_index({})
+    open_points_ledger({})
+    context.bot_data['points_ledger'] = PointsLedger.load()
 
     logger.warning(
         f"Администратор {update.effective_user.id} сбросил всех пользователей. Удалено: {users_count} пользователей, {total_points} баллов")
@@ -2500,13 +6614,141 @@ async def admin_reset_users_confirm(update: Update, context: ContextTypes.DEFAUL
         f"🗑️ Удалено пользователей: {users_count}\n"
         f"⭐ Удалено баллов: {total_points}\n"
         f"📋 Очищены задания и заказы\n\n"
-        f"Система полностью сброшена.",
+        f"Система полностью сброшена."
+        + (f"\n💾 Снимок до сброса: <code>{snapshot['id']}</code> (/restore {snapshot['id']})" if snapshot else ""),
         parse_mode='HTML',
         reply_markup=get_admin_keyboard()
     )
 
     return ConversationHandler.END
 
+def format_snapshot_line(snapshot):
+    changed = ", ".join(name.replace('_data.json', '').replace('.json', '') for name in snapshot['changed'])
+    return (
+        f"<code>{snapshot['id']}</code> - {format_local_time(snapshot['created_at'])}, "
+        f"{SNAPSHOT_REASON_TITLES.get(snapshot['reason'], snapshot['reason'])}"
+        + (f", изменено: {changed}" if changed else "")
+    )
+
+async def reply_snapshots_unavailable(update, context):
+    """Ответ на команды снимков, если хранилище их не поддерживает; True - ответ отправлен"""
+    storage = context.bot_data['storage']
+    if storage.snapshot_dir is not None:
+        return False
+    await update.message.reply_text(
+        f"❌ Снимки данных недоступны для хранилища {storage.name}.",
+        reply_markup=get_admin_keyboard()
+    )
+    return True
+
+async def admin_snapshot(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Снимок данных по команде администратора"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет доступа.")
+        return
+    if await reply_snapshots_unavailable(update, context):
+        return
+
+    try:
+        async with context.bot_data['snapshot_lock']:
+            snapshot = await create_snapshot(context.bot_data, 'manual', force=True)
+    except Exception as e:
+        logger.error(f"Не удалось создать снимок данных: {e}")
+        await update.message.reply_text("❌ Не удалось создать снимок данных.", reply_markup=get_admin_keyboard())
+        return
+
+    await update.message.reply_text(
+        f"💾 <b>Снимок создан</b>\n{format_snapshot_line(snapshot)}",
+        parse_mode='HTML',
+        reply_markup=get_admin_keyboard()
+    )
+
+async def admin_restore(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Список снимков или подтверждение восстановления выбранного"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("❌ У вас нет доступа.")
+        return
+
+    if await reply_snapshots_unavailable(update, context):
+        return
+
+    snapshots = load_snapshot_manifest(context.bot_data['storage'].snapshot_dir)['snapshots']
+    if not context.args:
+        if not snapshots:
+            await update.message.reply_text(
+                "📭 Снимков данных пока нет. Создать снимок: /snapshot",
+                reply_markup=get_admin_keyboard()
+            )
+            return
+        lines = [f"💾 <b>Снимки данных</b> (хранятся {SNAPSHOT_RETENTION_DAYS:g} дн., последние 15):\n"]
+        lines.extend(format_snapshot_line(snapshot) for snapshot in reversed(snapshots[-15:]))
+        lines.append("\nВосстановить: /restore ID\nНовый снимок: /snapshot")
+        await update.message.reply_text("\n".join(lines), parse_mode='HTML', reply_markup=get_admin_keyboard())
+        return
+
+    snapshot_id = context.args[0]
+    snapshot = next((item for item in snapshots if item['id'] == snapshot_id), None)
+    if snapshot is None:
+        await update.message.reply_text(
+            f"❌ Снимок {html.escape(snapshot_id)} не найден. Список снимков: /restore",
+            reply_markup=get_admin_keyboard()
+        )
+        return
+
+    await update.message.reply_text(
+        f"⚠️ <b>Восстановление данных</b>\n\n{format_snapshot_line(snapshot)}\n\n"
+        f"Пользователи, задания, отправки, товары и заказы будут заменены данными снимка. "
+        f"Текущие данные перед этим сохранятся в новый снимок.",
+        parse_mode='HTML',
+        reply_markup=InlineKeyboardMarkup([[
+            InlineKeyboardButton("✅ Восстановить", callback_data=f"snapshot_restore_{snapshot_id}"),
+            InlineKeyboardButton("❌ Отмена", callback_data="snapshot_cancel"),
+        ]])
+    )
+
+async def handle_snapshot_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Восстановление снимка после подтверждения"""
+    query = update.callback_query
+    await query.answer()
+    if not is_admin(query.from_user.id):
+        return
+    if query.data == "snapshot_cancel":
+        await query.edit_message_text("❌ Восстановление отменено.")
+        return
+
+    snapshot_id = query.data[len("snapshot_restore_"):]
+    storage = context.bot_data['storage']
+    async with context.bot_data['snapshot_lock']:
+        # Сначала снимок текущих данных: ротация в нем не удалит восстанавливаемый снимок
+        try:
+            backup = await create_snapshot(context.bot_data, 'restore', force=True)
+        except Exception as e:
+            logger.error(f"Не удалось создать снимок перед восстановлением: {e}")
+            await query.edit_message_text("❌ Не удалось сохранить текущие данные, восстановление отменено.")
+            return
+        snapshots = load_snapshot_manifest(storage.snapshot_dir)['snapshots']
+        snapshot = next((item for item in snapshots if item['id'] == snapshot_id), None)
+        if snapshot is None:
+            await query.edit_message_text(f"❌ Снимок {snapshot_id} не найден.")
+            return
+        try:
+            files = await asyncio.to_thread(read_snapshot_files, storage.snapshot_dir, snapshot)
+        except Exception as e:
+            logger.error(f"Не удалось прочитать снимок {snapshot_id}: {e}")
+            await query.edit_message_text(f"❌ Снимок {snapshot_id} поврежден, данные не изменены.")
+            return
+        if not apply_snapshot_files(storage, files):
+            await query.edit_message_text("❌ Не удалось записать данные снимка, данные не изменены.")
+            return
+        load_runtime_state(context.bot_data)
+
+    logger.warning(f"Администратор {query.from_user.id} восстановил снимок {snapshot_id}")
+    await query.edit_message_text(
+        f"✅ <b>Данные восстановлены из снимка</b> <code>{snapshot_id}</code>\n"
+        f"💾 Данные до восстановления: <code>{backup['id']}</code> (/restore {backup['id']})",
+        parse_mode='HTML'
+    )
+
 async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработка нажатий на кнопки"""
     user_id = update.effective_user.id
@@ -2557,6 +6799,10 @@ async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await admin_delete_task(update, context)
     elif text == "📊 Статистика":
         await admin_stats(update, context)
+    elif text == "📤 Экспорт данных":
+        await admin_export(update, context)
+    elif text == "📦 Массовая проверка":
+        await admin_bulk_review_start(update, context)
 
     elif text == "🔙 Главное меню":
         await update.message.reply_text(
@@ -2567,6 +6813,7 @@ async def handle_buttons(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
 async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Отмена для обычных пользователей"""
+    context.bot_data['stock'].release(str(update.effective_user.id))
     await update.message.reply_text(
         "❌ Действие отменено.",
         reply_markup=get_main_keyboard(update.effective_user.id)
@@ -2581,15 +6828,180 @@ async def admin_cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     )
     return ConversationHandler.END
 
-def main():
-    """Запуск бота"""
-    TOKEN = '8549336941:AAHUqok5bUKTypT-X8UGtXdkih8CDTNnHJ4'
-    application = Application.builder().token(TOKEN).build()
+async def flush_stats(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: сохранение изменившихся счетчиков статистики и индекса журнала баллов"""
+    stats = context.bot_data['stats']
+    stats.prune()
+    if stats.dirty:
+        save_stats(stats)
+    ledger = context.bot_data['points_ledger']
+    ledger.refresh()
+    if ledger.dirty:
+        save_points_ledger_index(ledger)
+
+async def report_user_data(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: сколько памяти context.user_data держат пользователи и диалоги.
+
+    Пустые записи (пользователь вне диалогов) освобождаются: PTB заводит
+    словарь user_data на каждого, кто хоть раз писал боту.
+    """
+    application = context.application
+    tenant = current_tenant.get()
+    per_user = Counter()
+    per_flow = Counter()
+    flow_users = {}
+    empty = []
+    for user_id, data in application.user_data.items():
+        if not data:
+            empty.append(user_id)
+            continue
+        for key, value in data.items():
+            size = user_data_size(value)
+            flow = user_data_flow(key)
+            per_user[user_id] += size
+            per_flow[flow] += size
+            flow_users.setdefault(flow, set()).add(user_id)
+    for user_id in empty:
+        application.drop_user_data(user_id)
+
+    for key in [key for key in metrics.user_data_bytes if key[0] == tenant.name]:
+        del metrics.user_data_bytes[key]
+    for flow, size in per_flow.items():
+        metrics.user_data_bytes[tenant.name, flow] = size
+    if not per_user and not empty:
+        return
+    flows = ", ".join(
+        f"{flow} {size / 1024:.1f} КБ ({len(flow_users[flow])} польз.)" for flow, size in per_flow.most_common()
+    )
+    top = ", ".join(f"{user_id} {size / 1024:.1f} КБ" for user_id, size in per_user.most_common(5))
+    logger.info(
+        f"Память user_data: {len(per_user)} польз., {sum(per_user.values()) / 1024:.1f} КБ"
+        + (f"; по диалогам: {flows}; больше всех: {top}" if per_user else "")
+        + f"; освобождено пустых записей: {len(empty)}"
+    )
+
+async def scheduled_snapshot(context: ContextTypes.DEFAULT_TYPE):
+    """Периодическая задача: снимок изменившихся коллекций"""
+    try:
+        async with context.bot_data['snapshot_lock']:
+            await create_snapshot(context.bot_data, 'schedule')
+    except Exception as e:
+        storage_logger.error(f"❌ Не удалось создать снимок данных: {e}")
+
+def load_runtime_state(bot_data):
+    """Индексы и кэши в памяти по файлам данных (при запуске и после восстановления снимка)"""
+    with startup_report.phase('данные'):
+        submissions, tasks, reminders = load_submissions(), load_tasks(), load_reminders()
+        products = load_products()
+    with startup_report.phase('индексы'):
+        cooldowns = CooldownIndex.build(submissions, tasks)
+        cooldowns.restore_subscribers(reminders)
+        bot_data['cooldowns'] = cooldowns
+        logger.info(f"Индекс пауз заданий: {len(cooldowns.available_at)} записей, подписок {len(cooldowns.subscribers)}")
+
+        bot_data['stats'] = load_stats()
+        bot_data['idempotency'] = IdempotencyCache()
+        bot_data['review_leases'] = ReviewLeases()
+        bot_data['stock'] = StockReservations.build(products)
+        # Очереди распродаж переживают восстановление снимка: их обработчики уже запущены
+        bot_data.setdefault('flash_sales', FlashSales()).refresh(products)
+        bot_data['file_index'] = load_file_index()
+        bot_data['points_ledger'] = PointsLedger.load()
+
+async def post_init(application: Application):
+    """Индексы в памяти строятся один раз при запуске"""
+    storage = application.bot_data['storage']
+    with using_tenant(application.bot_data['tenant']):
+        load_runtime_state(application.bot_data)
+    application.bot_data['rate_limiter'] = RateLimiter(parse_rate_limits(RATE_LIMITS))
+    application.bot_data['snapshot_lock'] = asyncio.Lock()
+
+    application.job_queue.run_repeating(
+        tenant_job(send_cooldown_reminders),
+        interval=REMINDER_INTERVAL_SECONDS,
+        first=REMINDER_INTERVAL_SECONDS,
+        name='cooldown_reminders'
+    )
+    application.job_queue.run_repeating(
+        tenant_job(flush_stats),
+        interval=STATS_FLUSH_INTERVAL_SECONDS,
+        first=STATS_FLUSH_INTERVAL_SECONDS,
+        name='flush_stats'
+    )
+    application.job_queue.run_repeating(
+        tenant_job(report_user_data),
+        interval=USER_DATA_REPORT_INTERVAL_SECONDS,
+        first=USER_DATA_REPORT_INTERVAL_SECONDS,
+        name='user_data_report'
+    )
+    if storage.snapshot_dir is not None:
+        application.job_queue.run_repeating(
+            tenant_job(scheduled_snapshot),
+            interval=SNAPSHOT_INTERVAL_SECONDS,
+            first=SNAPSHOT_INTERVAL_SECONDS,
+            name='snapshots'
+        )
+
+async def post_shutdown(application: Application):
+    """Несохраненные счетчики статистики и индекс журнала баллов записываются при остановке"""
+    storage = application.bot_data['storage']
+    with using_tenant(application.bot_data['tenant']):
+        stats = application.bot_data.get('stats')
+        if stats is not None and stats.dirty:
+            save_stats(stats)
+        ledger = application.bot_data.get('points_ledger')
+        if ledger is not None and ledger.dirty:
+            save_points_ledger_index(ledger)
+    storage.close()
+
+class SharedRequest(HTTPXRequest):
+    """Пул соединений к Bot API, общий для ботов всех сообществ процесса.
+
+    Каждое Application при запуске и остановке вызывает initialize() и
+    shutdown() своего запроса; пул закрывается только с последним из них.
+    Длинные опросы getUpdates идут через отдельные запросы каждого бота и
+    соединения общего пула не занимают.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.users = 0
+
+    async def initialize(self):
+        self.users += 1
+        await super().initialize()
+
+    async def shutdown(self):
+        self.users -= 1
+        if self.users <= 0:
+            await super().shutdown()
+
+def build_application(tenant, request):
+    """Application сообщества tenant со всеми обработчиками; данные готовятся сразу"""
+    builder = (
+        Application.builder()
+        .token(tenant.token)
+        .request(request)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+    )
+    if tenant.api_base_url:
+        builder.base_url(tenant.api_base_url)
+        logger.info(f"Сообщество {tenant.name}: используется Bot API {tenant.api_base_url}")
+    if tenant.api_base_file_url:
+        builder.base_file_url(tenant.api_base_file_url)
+    application = builder.build()
+    application.bot_data['tenant'] = tenant
+    application.bot_data['storage'] = tenant.storage
+    logger.info(f"Сообщество {tenant.name}: хранилище данных {tenant.storage.name}")
 
     # Инициализация файлов при запуске
-    initialize_files()
+    with startup_report.phase('данные'), using_tenant(tenant):
+        initialize_files()
+    handlers_started = time.perf_counter()
 
-    user_conv_handler = ConversationHandler(
+    user_conv_handler = conversation(
+        'registration',
         entry_points=[CommandHandler('start', start)],
         states={
             WAITING_FOR_FIRST_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, register_first_name)],
@@ -2598,7 +7010,8 @@ def main():
         fallbacks=[CommandHandler('cancel', cancel)]
     )
 
-    admin_product_conv_handler = ConversationHandler(
+    admin_product_conv_handler = conversation(
+        'product_create',
         entry_points=[MessageHandler(filters.Regex('^🛍️ Добавить товар$'), admin_create_product_start)],
         states={
             ADMIN_CREATE_PRODUCT_NAME: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_create_product_name)],
@@ -2609,7 +7022,8 @@ def main():
         fallbacks=[CommandHandler('cancel', admin_cancel)]
     )
 
-    user_buy_conv_handler = ConversationHandler(
+    user_buy_conv_handler = conversation(
+        'shop',
         entry_points=[MessageHandler(filters.Regex('^🛍️ Магазин$'), shop)],
         states={
             USER_BUY_PRODUCT: [MessageHandler(filters.TEXT & ~filters.COMMAND, buy_product)],
@@ -2618,7 +7032,8 @@ def main():
         fallbacks=[CommandHandler('cancel', cancel)]
     )
 
-    admin_points_conv_handler = ConversationHandler(
+    admin_points_conv_handler = conversation(
+        'points',
         entry_points=[MessageHandler(filters.Regex('^⭐ Добавить баллы$'), admin_add_points_start)],
         states={
             ADMIN_SELECT_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_select_user)],
@@ -2627,18 +7042,38 @@ def main():
         fallbacks=[CommandHandler('cancel', admin_cancel)]
     )
 
-    admin_task_conv_handler = ConversationHandler(
+    admin_bulk_points_conv_handler = conversation(
+        'bulk_points',
+        entry_points=[MessageHandler(filters.Regex('^⭐ Баллы списком$'), admin_bulk_points_start)],
+        states={
+            ADMIN_BULK_POINTS_INPUT: [
+                MessageHandler(filters.Regex('^🔙 Отмена$'), admin_cancel),
+                MessageHandler(filters.Document.ALL, admin_bulk_points_input),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, admin_bulk_points_input)
+            ],
+            ADMIN_BULK_POINTS_CONFIRM: [
+                MessageHandler(filters.Regex('^🔙 Отмена$'), admin_cancel),
+                MessageHandler(filters.TEXT & ~filters.COMMAND, admin_bulk_points_confirm)
+            ]
+        },
+        fallbacks=[CommandHandler('cancel', admin_cancel)]
+    )
+
+    admin_task_conv_handler = conversation(
+        'task_create',
         entry_points=[MessageHandler(filters.Regex('^📝 Создать задание$'), admin_create_task_start)],
         states={
             ADMIN_CREATE_TASK_TITLE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_create_task_title)],
             ADMIN_CREATE_TASK: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_create_task_description)],
             ADMIN_SET_TASK_POINTS: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_set_task_points)],
-            ADMIN_CREATE_TASK_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_create_task_type)]
+            ADMIN_CREATE_TASK_TYPE: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_create_task_type)],
+            ADMIN_CREATE_TASK_RULES: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_create_task_rules)]
         },
         fallbacks=[CommandHandler('cancel', admin_cancel)]
     )
 
-    admin_fix_id_conv_handler = ConversationHandler(
+    admin_fix_id_conv_handler = conversation(
+        'fix_id',
         entry_points=[MessageHandler(filters.Regex('^🆔 Исправить ID$'), admin_fix_id_start)],
         states={
             ADMIN_FIX_ID_SELECT_USER: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_fix_id_select_user)],
@@ -2647,7 +7082,8 @@ def main():
         fallbacks=[CommandHandler('cancel', admin_cancel)]
     )
 
-    admin_reset_conv_handler = ConversationHandler(
+    admin_reset_conv_handler = conversation(
+        'reset',
         entry_points=[MessageHandler(filters.Regex('^🗑️ Сбросить пользователей$'), admin_reset_users_start)],
         states={
             ADMIN_CONFIRM_RESET: [MessageHandler(filters.TEXT & ~filters.COMMAND, admin_reset_users_confirm)]
@@ -2655,7 +7091,8 @@ def main():
         fallbacks=[CommandHandler('cancel', admin_cancel)]
     )
 
-    admin_review_conv_handler = ConversationHandler(
+    admin_review_conv_handler = conversation(
+    'review',
     entry_points=[MessageHandler(filters.Regex('^📨 Проверка заданий$'), admin_pending_submissions)],
     states={
         ADMIN_REVIEW_SELECT: [
@@ -2666,7 +7103,8 @@ def main():
     fallbacks=[CommandHandler('cancel', admin_cancel)]
 )
 
-    user_task_conv_handler = ConversationHandler(
+    user_task_conv_handler = conversation(
+    'task_submission',
     entry_points=[MessageHandler(filters.Regex('^📤 Отправить задание$'), submit_task_start)],
     states={
         USER_SELECT_TASK: [
@@ -2682,8 +7120,11 @@ def main():
     fallbacks=[CommandHandler('cancel', cancel)]
 )
 
+    # Ограничение частоты срабатывает раньше всех остальных групп
+    application.add_handler(TypeHandler(Update, rate_limit_updates), group=-1)
     application.add_handler(user_conv_handler)
     application.add_handler(admin_points_conv_handler)
+    application.add_handler(admin_bulk_points_conv_handler)
     application.add_handler(admin_task_conv_handler)
     application.add_handler(admin_fix_id_conv_handler)
     application.add_handler(admin_review_conv_handler)
@@ -2702,16 +7143,105 @@ def main():
     application.add_handler(CallbackQueryHandler(handle_confirm_delete_task_callback, pattern='^confirm_del_task_'))
     application.add_handler(CallbackQueryHandler(lambda u, c: u.callback_query.edit_message_text("❌ Удаление отменено.", reply_markup=get_admin_keyboard()), pattern='^cancel_delete_task$'))
 
+    application.add_handler(CallbackQueryHandler(handle_remind_callback, pattern='^remind_'))
+    application.add_handler(CallbackQueryHandler(handle_bulk_review_callback, pattern='^bulk_'))
+    application.add_handler(CallbackQueryHandler(handle_snapshot_callback, pattern='^snapshot_'))
     application.add_handler(CallbackQueryHandler(handle_submission_callback))
     application.add_handler(CommandHandler('admin', admin_panel))
+    application.add_handler(CommandHandler('export', admin_export))
+    application.add_handler(CommandHandler('stats_range', admin_stats_range))
+    application.add_handler(CommandHandler('throttled', admin_rate_limits))
+    application.add_handler(CommandHandler('history', points_history))
+    application.add_handler(CommandHandler('ledger', admin_points_ledger))
+    application.add_handler(CommandHandler('snapshot', admin_snapshot))
+    application.add_handler(CommandHandler('restore', admin_restore))
+    application.add_handler(CommandHandler('flash', admin_flash_sale))
     application.add_handler(MessageHandler(
         filters.Regex(
-            r'^(👤 Профиль|🛍️ Магазин|📊 Рейтинг участников|📤 Отправить задание|👨‍💼 Панель администратора|👥 Список пользователей|⭐ Добавить баллы|📝 Создать задание|📋 Список заданий|📨 Проверка заданий|🛍️ Добавить товар|📦 Список товаров|🗑️ Удалить товар|🆔 Исправить ID|🗑️ Сбросить пользователей|📊 Статистика|🔙 Главное меню|🔙 Назад|🔙 Отмена|🛒 Купить товар #\d+|✅ Да, купить товар|❌ Нет, отменить|🔙 Назад к товарам)$'),
+            r'^(👤 Профиль|🛍️ Магазин|📊 Рейтинг участников|📤 Отправить задание|👨‍💼 Панель администратора|👥 Список пользователей|⭐ Добавить баллы|📝 Создать задание|📋 Список заданий|📨 Проверка заданий|🛍️ Добавить товар|📦 Список товаров|🗑️ Удалить товар|🆔 Исправить ID|🗑️ Сбросить пользователей|📊 Статистика|📤 Экспорт данных|📦 Массовая проверка|🔙 Главное меню|🔙 Назад|🔙 Отмена|🛒 Купить товар #\d+|✅ Да, купить товар|❌ Нет, отменить|🔙 Назад к товарам)$'),
         handle_buttons
     ))
 
-    logger.info("Бот запущен!")
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    instrument_handlers(application)
+    startup_report.record('обработчики', handlers_started)
+    return application
+
+async def stop_application(application):
+    """Остановка в том же порядке, что и у Application.run_polling()"""
+    if application.updater.running:
+        await application.updater.stop()
+    if application.running:
+        await application.stop()
+    await application.shutdown()
+    await application.post_shutdown(application)
+
+async def run_applications(applications):
+    """Боты всех сообществ на одном event loop - до SIGINT или SIGTERM.
+
+    Сообщество, бот которого не удалось запустить (например, неверный токен),
+    пропускается, остальные работают.
+    """
+    loop = asyncio.get_running_loop()
+    # Ввод-вывод хранилищ (asyncio.to_thread) всех сообществ идет через один пул потоков
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=IO_THREADS, thread_name_prefix='bot-io'))
+    stop_event = asyncio.Event()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            # Windows: Ctrl+C прерывает stop_event.wait() исключением KeyboardInterrupt
+            pass
+
+    metrics_server = None
+    if METRICS_PORT:
+        metrics_server = await asyncio.start_server(serve_metrics, METRICS_HOST, METRICS_PORT)
+        logger.info(f"Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+
+    running = []
+    try:
+        for application in applications:
+            tenant = application.bot_data['tenant']
+            try:
+                await application.initialize()
+                await application.post_init(application)
+                await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
+                await application.start()
+            except Exception as e:
+                logger.error(f"Сообщество {tenant.name} не запущено: {e}")
+                try:
+                    await stop_application(application)
+                except Exception as stop_error:
+                    logger.error(f"Сообщество {tenant.name}: ошибка остановки: {stop_error}")
+                continue
+            running.append(application)
+            metrics.tenants.append(tenant.name)
+
+        if not running:
+            logger.error("Ни одно сообщество не запущено")
+            return
+        startup_report.log([application.bot_data['tenant'] for application in running])
+        logger.info(f"Бот запущен! Сообществ: {len(running)}")
+        await stop_event.wait()
+    finally:
+        for application in reversed(running):
+            try:
+                await stop_application(application)
+            except Exception as e:
+                logger.error(f"Сообщество {application.bot_data['tenant'].name}: ошибка остановки: {e}")
+        if metrics_server is not None:
+            metrics_server.close()
+            await metrics_server.wait_closed()
+
+def main():
+    """Запуск ботов всех сообществ в одном процессе"""
+    setup_logging()
+    tenants = load_tenants()
+    request = SharedRequest(connection_pool_size=HTTP_POOL_SIZE)
+    applications = [build_application(tenant, request) for tenant in tenants]
+    try:
+        asyncio.run(run_applications(applications))
+    except KeyboardInterrupt:
+        pass
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,640 @@
+"""Локальная имитация Telegram Bot API для end-to-end тестов производительности.
+
+Сервер реализует подмножество методов Bot API, которое использует bot.py
+(getUpdates, sendMessage, sendPhoto/Document/Video, sendMediaGroup,
+editMessageText, answerCallbackQuery, getFile и служебные getMe/deleteWebhook),
+поддерживает keep-alive соединения и умеет имитировать задержку сети,
+случайные ошибки сервера и ответы 429 (flood wait).
+
+Запуск:
+    python fake_bot_api.py --port 8081 --latency-ms 30 --flood-rate 0.01
+
+Бот направляется на сервер через переменные окружения:
+    BOT_API_BASE_URL=http://127.0.0.1:8081/bot
+    BOT_API_BASE_FILE_URL=http://127.0.0.1:8081/file/bot
+
+Служебные эндпоинты (для генератора нагрузки и тестов):
+    POST /fake/updates  - добавить апдейт(ы) в очередь getUpdates
+    GET  /fake/sent     - исходящие сообщения бота (?chat_id=&after=&timeout=)
+    GET  /fake/stats    - счетчики запросов, соединений и сбоев
+    POST /fake/config   - изменить задержку/вероятности сбоев на лету
+    POST /fake/files    - задать содержимое файла (?file_id=), тело - байты файла
+    POST /fake/reset    - очистить очереди и статистику
+"""
+import argparse
+import asyncio
+import email.parser
+import email.policy
+import itertools
+import json
+import logging
+import random
+import time
+from collections import defaultdict, deque
+from urllib.parse import parse_qsl, urlsplit
+
+logger = logging.getLogger('fake_bot_api')
+
+BOT_USER = {
+    'id': 7000000001,
+    'is_bot': True,
+    'first_name': 'Fake Lampa Bot',
+    'username': 'fake_lampa_bot',
+    'can_join_groups': False,
+    'can_read_all_group_messages': False,
+    'supports_inline_queries': False,
+}
+
+# Параметры, которые PTB передает в виде JSON-строк внутри формы
+JSON_PARAMS = {
+    'reply_markup', 'media', 'entities', 'caption_entities', 'allowed_updates',
+    'link_preview_options', 'reply_parameters',
+}
+INT_PARAMS = {'chat_id', 'message_id', 'offset', 'limit', 'timeout', 'reply_to_message_id'}
+
+# Методы, на которых не имитируются сбои, иначе бот не сможет даже запуститься
+CONTROL_METHODS = {'getme', 'getupdates', 'deletewebhook', 'getwebhookinfo', 'close', 'logout'}
+
+FLOOD_WINDOW = 1.0
+
+
+def make_user(user_id, first_name=None):
+    return {'id': user_id, 'is_bot': False, 'first_name': first_name or f"User{user_id}"}
+
+
+def make_text_update(user_id, text, first_name=None):
+    """Апдейт с текстовым сообщением от пользователя (update_id назначает сервер)"""
+    message = {
+        'message_id': 0,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': make_user(user_id, first_name),
+        'text': text,
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return {'message': message}
+
+
+def make_photo_update(user_id, file_id, file_unique_id=None, caption=None):
+    """Апдейт с фотографией от пользователя"""
+    message = {
+        'message_id': 0,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': make_user(user_id),
+        'photo': [{
+            'file_id': file_id,
+            'file_unique_id': file_unique_id or f"u{file_id}",
+            'width': 1280,
+            'height': 960,
+        }],
+    }
+    if caption:
+        message['caption'] = caption
+    return {'message': message}
+
+
+def make_document_update(user_id, file_id, file_name, file_unique_id=None):
+    """Апдейт с документом от пользователя"""
+    return {'message': {
+        'message_id': 0,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': make_user(user_id),
+        'document': {
+            'file_id': file_id,
+            'file_unique_id': file_unique_id or f"u{file_id}",
+            'file_name': file_name,
+        },
+    }}
+
+
+def make_callback_update(user_id, data, message_id=1):
+    """Апдейт с нажатием inline-кнопки"""
+    return {'callback_query': {
+        'id': f"cq{user_id}{time.monotonic_ns()}",
+        'from': make_user(user_id),
+        'chat_instance': str(user_id),
+        'data': data,
+        'message': {
+            'message_id': message_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': BOT_USER,
+            'text': '...',
+        },
+    }}
+
+
+class ApiError(Exception):
+    """Ошибка в формате Bot API"""
+
+    def __init__(self, status, description, parameters=None):
+        super().__init__(description)
+        self.status = status
+        self.description = description
+        self.parameters = parameters
+
+
+class FakeBotApi:
+    """Состояние имитируемого Bot API"""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, flood_rate=0.0,
+                 flood_retry_after=1, chat_rate=0, global_rate=0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.flood_rate = flood_rate
+        self.flood_retry_after = flood_retry_after
+        self.chat_rate = chat_rate
+        self.global_rate = global_rate
+        self.random = random.Random(seed)
+        self.reset()
+
+    def reset(self):
+        self.update_ids = itertools.count(1)
+        self.updates = []
+        self.updates_changed = asyncio.Condition()
+        self.sent = []
+        self.sent_changed = asyncio.Condition()
+        self.message_ids = defaultdict(lambda: itertools.count(1))
+        self.file_ids = itertools.count(1)
+        # Содержимое файлов для getFile и скачивания по /file/bot<токен>/<путь>
+        self.files = {}
+        self.chat_windows = defaultdict(deque)
+        self.global_window = deque()
+        self.stats = {
+            'connections_opened': 0,
+            'connections_active': 0,
+            'requests': 0,
+            'methods': defaultdict(int),
+            'latency_ms_total': defaultdict(float),
+            'errors_injected': 0,
+            'floods_injected': 0,
+            'rate_limited': 0,
+            'started_at': time.time(),
+        }
+
+    def config(self):
+        return {
+            'latency_ms': self.latency_ms,
+            'jitter_ms': self.jitter_ms,
+            'error_rate': self.error_rate,
+            'flood_rate': self.flood_rate,
+            'flood_retry_after': self.flood_retry_after,
+            'chat_rate': self.chat_rate,
+            'global_rate': self.global_rate,
+        }
+
+    def apply_config(self, values):
+        for key in self.config():
+            if key in values:
+                setattr(self, key, type(getattr(self, key))(values[key]))
+        return self.config()
+
+    # ---- очереди апдейтов и исходящих сообщений ----
+
+    async def push_updates(self, updates):
+        async with self.updates_changed:
+            accepted = []
+            for update in updates:
+                update = dict(update)
+                update['update_id'] = next(self.update_ids)
+                message = update.get('message')
+                if message is not None and not message.get('message_id'):
+                    message['message_id'] = next(self.message_ids[message['chat']['id']])
+                self.updates.append(update)
+                accepted.append(update['update_id'])
+            self.updates_changed.notify_all()
+        return accepted
+
+    async def get_updates(self, offset=0, limit=100, timeout=0):
+        async with self.updates_changed:
+            if offset:
+                # Как и настоящий API, подтвержденные апдейты удаляются
+                self.updates = [u for u in self.updates if u['update_id'] >= offset]
+            if not self.updates and timeout:
+                try:
+                    await asyncio.wait_for(self.updates_changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            return self.updates[:limit]
+
+    async def record_sent(self, method, chat_id, message):
+        async with self.sent_changed:
+            self.sent.append({
+                'seq': len(self.sent) + 1,
+                'method': method,
+                'chat_id': chat_id,
+                'time': time.time(),
+                'message': message,
+            })
+            self.sent_changed.notify_all()
+
+    async def wait_sent(self, chat_id=None, after=0, timeout=0.0):
+        def matching():
+            return [
+                item for item in self.sent[after:]
+                if chat_id is None or item['chat_id'] == chat_id
+            ]
+
+        deadline = time.monotonic() + timeout
+        async with self.sent_changed:
+            found = matching()
+            while not found and time.monotonic() < deadline:
+                try:
+                    await asyncio.wait_for(self.sent_changed.wait(), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    break
+                found = matching()
+            return found
+
+    # ---- имитация сети и ограничений ----
+
+    def _rate_limited(self, chat_id):
+        now = time.monotonic()
+        windows = []
+        if self.global_rate:
+            windows.append((self.global_window, self.global_rate))
+        if self.chat_rate and chat_id is not None:
+            windows.append((self.chat_windows[chat_id], self.chat_rate))
+        for window, limit in windows:
+            while window and now - window[0] > FLOOD_WINDOW:
+                window.popleft()
+            if len(window) >= limit:
+                return True
+        for window, _ in windows:
+            window.append(now)
+        return False
+
+    async def simulate(self, method, params):
+        delay = self.latency_ms + (self.random.uniform(0, self.jitter_ms) if self.jitter_ms else 0)
+        if delay:
+            await asyncio.sleep(delay / 1000)
+
+        if method.lower() in CONTROL_METHODS:
+            return
+
+        if self._rate_limited(params.get('chat_id')):
+            self.stats['rate_limited'] += 1
+            self._raise_flood()
+        if self.flood_rate and self.random.random() < self.flood_rate:
+            self.stats['floods_injected'] += 1
+            self._raise_flood()
+        if self.error_rate and self.random.random() < self.error_rate:
+            self.stats['errors_injected'] += 1
+            raise ApiError(500, "Internal Server Error: injected by fake_bot_api")
+
+    def _raise_flood(self):
+        raise ApiError(
+            429,
+            f"Too Many Requests: retry after {self.flood_retry_after}",
+            {'retry_after': self.flood_retry_after},
+        )
+
+    # ---- методы Bot API ----
+
+    def _message(self, chat_id, **fields):
+        message = {
+            'message_id': next(self.message_ids[chat_id]),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private' if isinstance(chat_id, int) and chat_id > 0 else 'group'},
+            'from': BOT_USER,
+        }
+        message.update({k: v for k, v in fields.items() if v is not None})
+        return message
+
+    def _file(self, value, uploads):
+        """file_id из параметра: строка или загруженный multipart-файл"""
+        if isinstance(value, str) and value.startswith('attach://'):
+            value = uploads.get(value[len('attach://'):], value)
+        if isinstance(value, dict):
+            # Загруженный файл получает новый file_id, как в настоящем API
+            n = next(self.file_ids)
+            return f"fake_file_{n}", f"fake_unique_{n}"
+        return value, f"u{value}"
+
+    def _media_fields(self, kind, value, uploads, file_name=None):
+        file_id, unique_id = self._file(value, uploads)
+        if kind == 'photo':
+            return {'photo': [{'file_id': file_id, 'file_unique_id': unique_id, 'width': 1280, 'height': 960}]}
+        if kind == 'video':
+            return {'video': {'file_id': file_id, 'file_unique_id': unique_id,
+                              'width': 1280, 'height': 720, 'duration': 1}}
+        document = {'file_id': file_id, 'file_unique_id': unique_id}
+        if isinstance(value, dict) and value.get('filename'):
+            document['file_name'] = value['filename']
+        elif file_name:
+            document['file_name'] = file_name
+        return {'document': document}
+
+    def _chat_id(self, params):
+        if 'chat_id' not in params:
+            raise ApiError(400, "Bad Request: chat_id is empty")
+        return params['chat_id']
+
+    async def call(self, method, params, uploads):
+        name = method.lower()
+        if name == 'getme':
+            return BOT_USER
+        if name in ('deletewebhook', 'close', 'logout', 'setmycommands'):
+            return True
+        if name == 'getwebhookinfo':
+            return {'url': '', 'has_custom_certificate': False, 'pending_update_count': len(self.updates)}
+        if name == 'getupdates':
+            return await self.get_updates(
+                int(params.get('offset') or 0),
+                int(params.get('limit') or 100),
+                float(params.get('timeout') or 0),
+            )
+        if name == 'sendmessage':
+            chat_id = self._chat_id(params)
+            if not params.get('text'):
+                raise ApiError(400, "Bad Request: message text is empty")
+            message = self._message(chat_id, text=params['text'], reply_markup=self._inline(params))
+            await self.record_sent(method, chat_id, message)
+            return message
+        if name in ('sendphoto', 'senddocument', 'sendvideo'):
+            chat_id = self._chat_id(params)
+            kind = name[len('send'):]
+            if kind not in params:
+                raise ApiError(400, f"Bad Request: there is no {kind} in the request")
+            message = self._message(chat_id, caption=params.get('caption'), **self._media_fields(kind, params[kind], uploads))
+            await self.record_sent(method, chat_id, message)
+            return message
+        if name == 'sendmediagroup':
+            chat_id = self._chat_id(params)
+            media = params.get('media') or []
+            if not 2 <= len(media) <= 10:
+                raise ApiError(400, "Bad Request: wrong number of messages in media group")
+            group_id = str(time.monotonic_ns())
+            messages = []
+            for item in media:
+                message = self._message(
+                    chat_id,
+                    media_group_id=group_id,
+                    caption=item.get('caption'),
+                    **self._media_fields(item.get('type', 'document'), item.get('media'), uploads),
+                )
+                await self.record_sent(method, chat_id, message)
+                messages.append(message)
+            return messages
+        if name == 'editmessagetext':
+            if params.get('inline_message_id'):
+                return True
+            chat_id = self._chat_id(params)
+            message = {
+                'message_id': params.get('message_id'),
+                'date': int(time.time()),
+                'edit_date': int(time.time()),
+                'chat': {'id': chat_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': params.get('text'),
+            }
+            if self._inline(params):
+                message['reply_markup'] = self._inline(params)
+            await self.record_sent(method, chat_id, message)
+            return message
+        if name == 'getfile':
+            file_id = params.get('file_id')
+            if file_id not in self.files:
+                raise ApiError(400, "Bad Request: invalid file_id")
+            return {
+                'file_id': file_id,
+                'file_unique_id': f"u{file_id}",
+                'file_size': len(self.files[file_id]),
+                'file_path': f"documents/{file_id}",
+            }
+        if name == 'answercallbackquery':
+            if not params.get('callback_query_id'):
+                raise ApiError(400, "Bad Request: query is too old and response timeout expired or query ID is invalid")
+            return True
+        raise ApiError(404, "Not Found")
+
+    @staticmethod
+    def _inline(params):
+        markup = params.get('reply_markup')
+        if isinstance(markup, dict) and 'inline_keyboard' in markup:
+            return markup
+        return None
+
+
+# ---- HTTP ----
+
+def decode_params(content_type, body):
+    """Разбор тела запроса: JSON, urlencoded или multipart/form-data"""
+    params, uploads = {}, {}
+    if not body:
+        return params, uploads
+    if content_type.startswith('application/json'):
+        params = json.loads(body)
+    elif content_type.startswith('multipart/form-data'):
+        parser = email.parser.BytesParser(policy=email.policy.HTTP)
+        message = parser.parsebytes(b"Content-Type: " + content_type.encode() + b"\r\n\r\n" + body)
+        for part in message.iter_parts():
+            name = part.get_param('name', header='content-disposition')
+            filename = part.get_filename()
+            payload = part.get_payload(decode=True) or b''
+            if filename is not None:
+                uploads[name] = {'filename': filename, 'size': len(payload)}
+                params[name] = uploads[name]
+            else:
+                params[name] = payload.decode('utf-8')
+    else:
+        params = dict(parse_qsl(body.decode('utf-8'), keep_blank_values=True))
+
+    for key, value in list(params.items()):
+        if not isinstance(value, str):
+            continue
+        if key in JSON_PARAMS:
+            params[key] = json.loads(value)
+        elif key in INT_PARAMS and value.lstrip('-').isdigit():
+            params[key] = int(value)
+    return params, uploads
+
+
+class FakeBotApiServer:
+    """Минимальный HTTP/1.1 сервер с keep-alive поверх asyncio"""
+
+    def __init__(self, api, host='127.0.0.1', port=8081):
+        self.api = api
+        self.host = host
+        self.port = port
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self.handle_connection, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info(f"Fake Bot API слушает http://{self.host}:{self.port}")
+        return self
+
+    async def stop(self):
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
+
+    async def handle_connection(self, reader, writer):
+        stats = self.api.stats
+        stats['connections_opened'] += 1
+        stats['connections_active'] += 1
+        try:
+            while True:
+                request = await self.read_request(reader)
+                if request is None:
+                    break
+                method, target, headers, body = request
+                status, payload = await self.dispatch(method, target, headers, body)
+                if isinstance(payload, bytes):
+                    data, content_type = payload, 'application/octet-stream'
+                else:
+                    data, content_type = json.dumps(payload, ensure_ascii=False).encode('utf-8'), 'application/json'
+                keep_alive = headers.get('connection', '').lower() != 'close'
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: {content_type}\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    f"Connection: {'keep-alive' if keep_alive else 'close'}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.CancelledError):
+            # Отмена при остановке сервера - штатное закрытие соединения
+            pass
+        finally:
+            stats['connections_active'] -= 1
+            writer.close()
+
+    @staticmethod
+    async def read_request(reader):
+        line = await reader.readline()
+        if not line:
+            return None
+        method, target, _ = line.decode('latin-1').split(' ', 2)
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            key, _, value = line.decode('latin-1').partition(':')
+            headers[key.strip().lower()] = value.strip()
+        if headers.get('transfer-encoding', '').lower() == 'chunked':
+            body = b''
+            while True:
+                size = int((await reader.readline()).strip() or b'0', 16)
+                if not size:
+                    await reader.readline()
+                    break
+                body += await reader.readexactly(size)
+                await reader.readline()
+        else:
+            body = await reader.readexactly(int(headers.get('content-length', 0)))
+        return method, target, headers, body
+
+    async def dispatch(self, http_method, target, headers, body):
+        url = urlsplit(target)
+        path = url.path.strip('/')
+        query = dict(parse_qsl(url.query))
+        try:
+            if path.startswith('fake/'):
+                result = await self.control(path[len('fake/'):], http_method, query, body)
+                return 200, {'ok': True, 'result': result}
+            if path.startswith('file/bot'):
+                # /file/bot<токен>/documents/<file_id>
+                file_id = path.rsplit('/', 1)[-1]
+                if file_id not in self.api.files:
+                    raise ApiError(404, "Not Found")
+                return 200, self.api.files[file_id]
+            if not path.startswith('bot') or '/' not in path:
+                raise ApiError(404, "Not Found")
+            _, api_method = path.split('/', 1)
+            params, uploads = decode_params(headers.get('content-type', ''), body)
+            params.update({k: v for k, v in query.items() if k not in params})
+            started = time.monotonic()
+            self.api.stats['requests'] += 1
+            self.api.stats['methods'][api_method] += 1
+            await self.api.simulate(api_method, params)
+            result = await self.api.call(api_method, params, uploads)
+            self.api.stats['latency_ms_total'][api_method] += (time.monotonic() - started) * 1000
+            return 200, {'ok': True, 'result': result}
+        except ApiError as e:
+            payload = {'ok': False, 'error_code': e.status, 'description': e.description}
+            if e.parameters:
+                payload['parameters'] = e.parameters
+            return e.status, payload
+        except (ValueError, KeyError) as e:
+            return 400, {'ok': False, 'error_code': 400, 'description': f"Bad Request: {e}"}
+
+    async def control(self, action, http_method, query, body):
+        api = self.api
+        if action == 'updates' and http_method == 'POST':
+            updates = json.loads(body)
+            if isinstance(updates, dict):
+                updates = [updates]
+            return {'update_ids': await api.push_updates(updates), 'sent_seq': len(api.sent)}
+        if action == 'sent':
+            chat_id = int(query['chat_id']) if 'chat_id' in query else None
+            return await api.wait_sent(chat_id, int(query.get('after', 0)), float(query.get('timeout', 0)))
+        if action == 'stats':
+            stats = dict(api.stats)
+            stats['methods'] = dict(stats['methods'])
+            stats['avg_latency_ms'] = {
+                m: round(total / stats['methods'][m], 2)
+                for m, total in stats.pop('latency_ms_total').items()
+            }
+            stats['pending_updates'] = len(api.updates)
+            stats['sent_total'] = len(api.sent)
+            stats['config'] = api.config()
+            return stats
+        if action == 'files' and http_method == 'POST':
+            api.files[query['file_id']] = body
+            return True
+        if action == 'config' and http_method == 'POST':
+            return api.apply_config(json.loads(body or b'{}'))
+        if action == 'reset' and http_method == 'POST':
+            api.reset()
+            return True
+        raise ApiError(404, "Not Found")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Локальная имитация Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0.0, help="базовая задержка каждого запроса")
+    parser.add_argument('--jitter-ms', type=float, default=0.0, help="случайная добавка к задержке")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument('--flood-rate', type=float, default=0.0, help="доля случайных ответов 429")
+    parser.add_argument('--flood-retry-after', type=int, default=1, help="retry_after в ответах 429")
+    parser.add_argument('--chat-rate', type=int, default=0, help="лимит сообщений в секунду на чат (0 - без лимита)")
+    parser.add_argument('--global-rate', type=int, default=0, help="общий лимит сообщений в секунду (0 - без лимита)")
+    parser.add_argument('--seed', type=int, default=None)
+    return parser.parse_args(argv)
+
+
+async def serve(args):
+    api = FakeBotApi(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        flood_rate=args.flood_rate,
+        flood_retry_after=args.flood_retry_after,
+        chat_rate=args.chat_rate,
+        global_rate=args.global_rate,
+        seed=args.seed,
+    )
+    server = await FakeBotApiServer(api, args.host, args.port).start()
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.stop()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
+    try:
+        asyncio.run(serve(parse_args()))
+    except KeyboardInterrupt:
+        pass
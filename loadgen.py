@@ -0,0 +1,306 @@
+"""Генератор нагрузки для end-to-end замеров бота через fake_bot_api.py.
+
+Виртуальные пользователи проходят сценарии (регистрация, просмотр меню,
+отправка задания с фото), а задержка каждого шага измеряется от момента
+отправки апдейта до первого ответа бота в этот чат.
+
+С флагом --spawn генератор сам поднимает fake Bot API и запускает bot.py
+с временным каталогом данных:
+    python loadgen.py --spawn --users 50 --concurrency 10 --scenario all
+
+--storage выбирает хранилище запущенного бота (json, memory, sqlite): memory
+показывает задержки без дискового ввода-вывода.
+
+Сценарий flashsale - флеш-распродажа: после регистрации администратор
+начисляет всем баллы, выставляет товар из --flash-stock экземпляров и
+включает для него распродажу (/flash), пользователи открывают подтверждение
+покупки, а затем все разом нажимают «Да». В отчете - сколько покупок прошло,
+сколько покупателей получили «распродано» и не продано ли больше остатка:
+    python loadgen.py --spawn --users 200 --concurrency 50 --scenario flashsale
+
+Иначе используется уже запущенный сервер (--server) и бот.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+
+import fake_bot_api
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ADMIN_ID = 424081501
+FIRST_USER_ID = 10_000_000
+
+
+class Client:
+    """Обертка над служебными эндпоинтами fake Bot API"""
+
+    def __init__(self, server, reply_timeout):
+        self.http = httpx.AsyncClient(base_url=server, timeout=reply_timeout + 5)
+        self.reply_timeout = reply_timeout
+        self.latencies = defaultdict(list)
+        self.failures = defaultdict(int)
+
+    async def close(self):
+        await self.http.aclose()
+
+    async def step(self, name, chat_id, update, expect=1):
+        """Отправляет апдейт и ждет expect ответов бота в чат"""
+        started = time.time()
+        response = await self.http.post('/fake/updates', json=update)
+        after = response.json()['result']['sent_seq']
+        replies = []
+        while len(replies) < expect:
+            response = await self.http.get('/fake/sent', params={
+                'chat_id': chat_id,
+                'after': after,
+                'timeout': self.reply_timeout,
+            })
+            found = response.json()['result']
+            if not found:
+                self.failures[name] += 1
+                return replies
+            replies.extend(found)
+            after = found[-1]['seq']
+        self.latencies[name].append((replies[0]['time'] - started) * 1000)
+        return replies
+
+    async def stats(self):
+        return (await self.http.get('/fake/stats')).json()['result']
+
+
+# ---- сценарии ----
+
+async def scenario_register(client, user_id):
+    await client.step('start', user_id, fake_bot_api.make_text_update(user_id, '/start'))
+    await client.step('first_name', user_id, fake_bot_api.make_text_update(user_id, f"Имя{user_id}"))
+    await client.step('surname', user_id, fake_bot_api.make_text_update(user_id, f"Фамилия{user_id}"))
+
+
+async def scenario_browse(client, user_id):
+    for button in ("👤 Профиль", "📊 Рейтинг участников"):
+        await client.step(button, user_id, fake_bot_api.make_text_update(user_id, button))
+    await client.step("🛍️ Магазин", user_id, fake_bot_api.make_text_update(user_id, "🛍️ Магазин"))
+    await client.step("🔙 Назад", user_id, fake_bot_api.make_text_update(user_id, "🔙 Назад"))
+
+
+async def scenario_submit(client, user_id):
+    await client.step('submit_start', user_id, fake_bot_api.make_text_update(user_id, "📤 Отправить задание"))
+    await client.step('submit_select', user_id, fake_bot_api.make_text_update(user_id, "Задание #1 - Нагрузочное"))
+    await client.step('submit_photo', user_id, fake_bot_api.make_photo_update(user_id, f"photo_{user_id}"))
+    await client.step('submit_finish', user_id, fake_bot_api.make_text_update(user_id, "✅ Завершить отправку"))
+
+
+SCENARIOS = {
+    'register': [scenario_register],
+    'browse': [scenario_register, scenario_browse],
+    'submit': [scenario_register, scenario_submit],
+    'all': [scenario_register, scenario_browse, scenario_submit],
+    # Распродажа идет отдельными фазами после регистрации (run_flash_sale)
+    'flashsale': [scenario_register],
+}
+
+# Товар из setup_admin_data - #1, товар распродажи - следующий
+FLASH_PRODUCT_ID = 2
+FLASH_PRICE = 5
+
+
+async def setup_admin_data(client):
+    """Администратор создает задание и товар, которые используют сценарии"""
+    steps = [
+        "📝 Создать задание",
+        "Нагрузочное",
+        "Отправьте любое фото",
+        "5",
+        "🔄 Ежедневное задание",
+        "⏭ Без автопроверки",
+        "🛍️ Добавить товар",
+        "Наклейка",
+        "Наклейка с логотипом",
+        "1",
+        "0",
+    ]
+    for text in steps:
+        await client.step('admin_setup', ADMIN_ID, fake_bot_api.make_text_update(ADMIN_ID, text))
+
+
+async def wait_for_message(client, chat_id, after):
+    await client.http.get('/fake/sent', params={'chat_id': chat_id, 'after': after, 'timeout': client.reply_timeout})
+
+
+async def setup_flash_sale(client, user_ids, stock):
+    """Баллы всем покупателям, товар распродажи и включение режима"""
+    step = lambda text: client.step('admin_setup', ADMIN_ID, fake_bot_api.make_text_update(ADMIN_ID, text))
+    await step("⭐ Баллы списком")
+    # Пользователи сценария регистрируются первыми, их уникальные ID - 1..N
+    await step("\n".join(f"{unique_id} {FLASH_PRICE * 2}" for unique_id in range(1, len(user_ids) + 1)))
+    after = (await client.stats())['sent_total']
+    await step("✅ Начислить")
+    # Уведомления о начислении не должны попасть в ответы на шаги распродажи
+    await asyncio.gather(*(wait_for_message(client, user_id, after) for user_id in user_ids))
+
+    for text in ("🛍️ Добавить товар", "Фотка с тьютором", "Распродажа", str(FLASH_PRICE), str(stock)):
+        await step(text)
+    await step(f"/flash {FLASH_PRODUCT_ID} on")
+
+
+async def open_flash_confirmation(client, user_id, semaphore):
+    async with semaphore:
+        await client.step('flash_shop', user_id, fake_bot_api.make_text_update(user_id, "🛍️ Магазин"))
+        await client.step('flash_select', user_id, fake_bot_api.make_text_update(user_id, f"🛒 Купить товар #{FLASH_PRODUCT_ID}"))
+
+
+async def confirm_flash_purchase(client, user_id):
+    replies = await client.step('flash_confirm', user_id, fake_bot_api.make_text_update(user_id, "✅ Да, купить товар"))
+    text = replies[0]['message'].get('text', '') if replies else ''
+    if 'Поздравляем с покупкой' in text:
+        return 'success'
+    if 'распродан' in text:
+        return 'sold_out'
+    return 'no_answer' if not replies else 'other'
+
+
+async def run_flash_sale(client, user_ids, stock, semaphore):
+    """Фазы распродажи; возвращает число ответов каждого вида"""
+    await setup_flash_sale(client, user_ids, stock)
+    await asyncio.gather(*(open_flash_confirmation(client, user_id, semaphore) for user_id in user_ids))
+    # Подтверждения уходят все разом, без ограничения параллельности
+    results = await asyncio.gather(*(confirm_flash_purchase(client, user_id) for user_id in user_ids))
+    return {outcome: results.count(outcome) for outcome in ('success', 'sold_out', 'other', 'no_answer')}
+
+
+def print_flash_report(outcomes, users, stock):
+    expected = min(users, stock)
+    print(
+        f"\nФлеш-распродажа: {stock} шт. на {users} покупателей - куплено {outcomes['success']}, "
+        f"«распродано» {outcomes['sold_out']}, других ответов {outcomes['other']}, без ответа {outcomes['no_answer']}"
+    )
+    if outcomes['success'] > stock:
+        print(f"ОШИБКА: продано больше остатка ({outcomes['success']} > {stock})")
+    elif outcomes['success'] != expected or outcomes['success'] + outcomes['sold_out'] != users:
+        print(f"ОШИБКА: ожидалось {expected} покупок и {users - expected} ответов «распродано»")
+
+
+async def run_user(client, scenarios, user_id, semaphore):
+    async with semaphore:
+        for scenario in scenarios:
+            await scenario(client, user_id)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def print_report(client, stats, elapsed):
+    print(f"\n{'шаг':<28}{'n':>6}{'p50 мс':>10}{'p95 мс':>10}{'p99 мс':>10}{'max мс':>10}{'сбоев':>8}")
+    for name in sorted(set(client.latencies) | set(client.failures)):
+        values = client.latencies.get(name) or [0.0]
+        print(
+            f"{name:<28}{len(client.latencies.get(name, [])):>6}"
+            f"{statistics.median(values):>10.1f}{percentile(values, 0.95):>10.1f}"
+            f"{percentile(values, 0.99):>10.1f}{max(values):>10.1f}{client.failures.get(name, 0):>8}"
+        )
+    total = sum(len(v) for v in client.latencies.values())
+    print(f"\nВсего шагов: {total} за {elapsed:.1f} с ({total / elapsed if elapsed else 0:.1f} шаг/с)")
+    print(f"Соединений к Bot API открыто: {stats['connections_opened']}, запросов: {stats['requests']}")
+    print(f"Имитировано 429: {stats['floods_injected'] + stats['rate_limited']}, ошибок 500: {stats['errors_injected']}")
+    print(f"Средняя задержка методов, мс: {stats['avg_latency_ms']}")
+
+
+async def wait_for_bot(client, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if (await client.stats())['methods'].get('getUpdates'):
+            return
+        await asyncio.sleep(0.2)
+    raise RuntimeError("Бот не подключился к fake Bot API")
+
+
+async def main(args):
+    server = None
+    bot_process = None
+    data_dir = None
+    if args.spawn:
+        api = fake_bot_api.FakeBotApi(
+            latency_ms=args.latency_ms,
+            jitter_ms=args.jitter_ms,
+            error_rate=args.error_rate,
+            flood_rate=args.flood_rate,
+        )
+        server = await fake_bot_api.FakeBotApiServer(api, '127.0.0.1', 0).start()
+        args.server = f"http://127.0.0.1:{server.port}"
+        data_dir = tempfile.TemporaryDirectory(prefix='loadgen_')
+        env = dict(
+            os.environ,
+            BOT_TOKEN='123456:fake',
+            BOT_API_BASE_URL=f"{args.server}/bot",
+            BOT_API_BASE_FILE_URL=f"{args.server}/file/bot",
+            BOT_DATA_DIR=data_dir.name,
+            STORAGE_BACKEND=args.storage,
+        )
+        bot_process = subprocess.Popen(
+            [sys.executable, os.path.join(BASE_DIR, 'bot.py')],
+            env=env,
+            stdout=subprocess.DEVNULL if not args.bot_output else None,
+            stderr=subprocess.DEVNULL if not args.bot_output else None,
+        )
+
+    client = Client(args.server, args.reply_timeout)
+    try:
+        await wait_for_bot(client)
+        await setup_admin_data(client)
+
+        scenarios = SCENARIOS[args.scenario]
+        semaphore = asyncio.Semaphore(args.concurrency)
+        user_ids = [FIRST_USER_ID + i for i in range(args.users)]
+        started = time.monotonic()
+        await asyncio.gather(*(run_user(client, scenarios, user_id, semaphore) for user_id in user_ids))
+        outcomes = None
+        if args.scenario == 'flashsale':
+            outcomes = await run_flash_sale(client, user_ids, args.flash_stock, semaphore)
+        elapsed = time.monotonic() - started
+        print_report(client, await client.stats(), elapsed)
+        if outcomes is not None:
+            print_flash_report(outcomes, args.users, args.flash_stock)
+    finally:
+        await client.close()
+        if bot_process:
+            bot_process.terminate()
+            # Ждем в потоке: боту при остановке нужен работающий fake Bot API
+            await asyncio.to_thread(bot_process.wait, 10)
+        if server:
+            await server.stop()
+        if data_dir:
+            data_dir.cleanup()
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Генератор нагрузки для бота через fake Bot API")
+    parser.add_argument('--server', default='http://127.0.0.1:8081')
+    parser.add_argument('--spawn', action='store_true', help="поднять fake Bot API и bot.py автоматически")
+    parser.add_argument('--bot-output', action='store_true', help="не скрывать вывод bot.py при --spawn")
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='all')
+    parser.add_argument('--storage', choices=['json', 'memory', 'sqlite'], default='json',
+                        help="хранилище данных бота при --spawn")
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--concurrency', type=int, default=10)
+    parser.add_argument('--flash-stock', type=int, default=10, help="экземпляров товара в сценарии flashsale")
+    parser.add_argument('--reply-timeout', type=float, default=10.0)
+    parser.add_argument('--latency-ms', type=float, default=0.0)
+    parser.add_argument('--jitter-ms', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--flood-rate', type=float, default=0.0)
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    asyncio.run(main(parse_args()))
@@ -0,0 +1,187 @@
+"""Миграция файлов данных бота.
+
+schema: обновляет файлы коллекций до текущих версий схем (bot.SCHEMA_UPGRADES) -
+дописывает недостающие поля (total_earned пользователей, quantity и sold
+товаров и т.д.), убирает из отправок и заказов копии данных пользователя,
+задания и описания товара (название и цена товара в заказе остаются: товар
+может быть удален). Файл читается и пишется потоково, по одной записи, поэтому
+память не зависит от его размера. normalize - прежнее имя той же миграции
+(нормализация отправок и заказов вошла в первую версию схемы).
+
+    python migrate_data.py schema [--data-dir DIR] [--dry-run] [--no-backup]
+
+Для каждого файла выводится число записей, размер до и после и время миграции.
+Бот при запуске обновляет устаревшие файлы сам, но загружая их целиком.
+"""
+import argparse
+import itertools
+import json
+import os
+import shutil
+import time
+
+import bot
+
+# Сколько символов файла читается за раз
+CHUNK_SIZE = 64 * 1024
+WHITESPACE = ' \t\r\n'
+
+decoder = json.JSONDecoder()
+
+
+def iter_json_object(f, chunk_size=CHUNK_SIZE):
+    """Пары (ключ, значение) JSON-объекта верхнего уровня, без чтения файла целиком.
+
+    В памяти держится только текущая запись и один кусок файла.
+    """
+    buffer = ''
+    pos = 0
+    eof = False
+
+    def fill():
+        nonlocal buffer, pos, eof
+        chunk = f.read(chunk_size)
+        eof = not chunk
+        buffer = buffer[pos:] + chunk
+        pos = 0
+
+    def peek():
+        nonlocal pos
+        while True:
+            while pos < len(buffer) and buffer[pos] in WHITESPACE:
+                pos += 1
+            if pos < len(buffer) or eof:
+                return buffer[pos] if pos < len(buffer) else ''
+            fill()
+
+    def expect(char):
+        nonlocal pos
+        found = peek()
+        if found != char:
+            raise ValueError(f"Ожидался {char!r}, а не {found or 'конец файла'!r}")
+        pos += 1
+
+    def value():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                result, end = decoder.raw_decode(buffer, pos)
+                # Число в конце куска могло оборваться: принимаем его, только если за ним что-то есть
+                if end < len(buffer) or eof:
+                    pos = end
+                    return result
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            fill()
+
+    expect('{')
+    if peek() == '}':
+        return
+    while True:
+        key = value()
+        expect(':')
+        yield key, value()
+        if peek() != ',':
+            expect('}')
+            return
+        pos += 1
+
+
+def write_json_object(f, items):
+    """Запись пар (ключ, значение) так же, как json.dump(..., ensure_ascii=False, indent=2)"""
+    empty = True
+    for key, value in items:
+        f.write('{\n  ' if empty else ',\n  ')
+        f.write(json.dumps(key, ensure_ascii=False))
+        f.write(': ')
+        # Переводы строк внутри строк экранированы, поэтому все \n здесь - отступы структуры
+        f.write(json.dumps(value, ensure_ascii=False, indent=2).replace('\n', '\n  '))
+        empty = False
+    f.write('{}' if empty else '\n}')
+
+
+def migrate_schema_file(path, dry_run=False, backup=True):
+    if not os.path.exists(path):
+        print(f"{os.path.basename(path)}: файла нет, пропущен")
+        return
+    steps = bot.schema_steps(path)
+    target = len(steps)
+    size_before = os.path.getsize(path)
+    started = time.perf_counter()
+    tmp_path = f"{path}.migrate"
+    with open(path, 'r', encoding='utf-8') as src:
+        items = iter_json_object(src)
+        first = next(items, None)
+        version = 0
+        if first is not None and first[0] == bot.SCHEMA_KEY:
+            version = first[1]
+            first = None
+        if version >= target:
+            print(f"{os.path.basename(path)}: уже версии {version}, изменений нет")
+            return
+
+        counts = {'records': 0, 'changed': 0}
+
+        def upgraded():
+            yield bot.SCHEMA_KEY, target
+            for key, record in itertools.chain([first] if first else [], items):
+                if key == bot.SCHEMA_KEY:
+                    # bot пишет версию первым ключом; в другом месте ее быть не может
+                    raise ValueError(f"ключ {bot.SCHEMA_KEY} не в начале файла")
+                new_record = bot.upgrade_record(record, version, steps)
+                counts['records'] += 1
+                counts['changed'] += new_record != record
+                yield key, new_record
+
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as dst:
+                write_json_object(dst, upgraded())
+                dst.flush()
+                os.fsync(dst.fileno())
+        except Exception:
+            os.remove(tmp_path)
+            raise
+
+    size_after = os.path.getsize(tmp_path)
+    if dry_run:
+        os.remove(tmp_path)
+    else:
+        if backup:
+            shutil.copy2(path, path + '.bak')
+        os.replace(tmp_path, path)
+    elapsed = time.perf_counter() - started
+
+    print(
+        f"{os.path.basename(path)}: версия {version} -> {target}, {counts['records']} записей "
+        f"(изменено {counts['changed']}), "
+        f"размер {size_before / 1024:.1f} -> {size_after / 1024:.1f} КБ, "
+        f"{elapsed * 1000:.1f} мс"
+        + (" [dry-run]" if dry_run else "")
+    )
+
+
+MIGRATIONS = {
+    'schema': migrate_schema_file,
+    'normalize': migrate_schema_file,
+}
+
+
+def main(args):
+    migrate = MIGRATIONS[args.migration]
+    for filename in bot.SCHEMA_UPGRADES:
+        migrate(os.path.join(args.data_dir, filename), args.dry_run, not args.no_backup)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Миграция файлов данных бота")
+    parser.add_argument('migration', choices=sorted(MIGRATIONS))
+    parser.add_argument('--data-dir', default=bot.DATA_DIR)
+    parser.add_argument('--dry-run', action='store_true', help="только показать эффект, не записывая файлы")
+    parser.add_argument('--no-backup', action='store_true', help="не сохранять копию исходного файла (.bak)")
+    return parser.parse_args(argv)
+
+
+if __name__ == '__main__':
+    main(parse_args())
@@ -0,0 +1,46 @@
+"""Application бота поверх FakeBotApiServer для тестов обработчиков"""
+import itertools
+from contextlib import asynccontextmanager
+
+from telegram import Update
+
+import bot
+import fake_bot_api
+
+update_ids = itertools.count(1)
+
+
+class BotHarness:
+    """Application сообщества и имитация Bot API, на которую оно отвечает"""
+
+    def __init__(self, application, api):
+        self.application = application
+        self.api = api
+
+    async def send(self, update):
+        """Обрабатывает апдейт и возвращает тексты ответов бота"""
+        sent_before = len(self.api.sent)
+        # Апдейт передается Application напрямую, минуя getUpdates, поэтому номер назначается здесь
+        update = dict(update, update_id=next(update_ids))
+        await self.application.process_update(Update.de_json(update, self.application.bot))
+        return [item['message'].get('text', '') for item in self.api.sent[sent_before:]]
+
+    async def text(self, user_id, text):
+        return await self.send(fake_bot_api.make_text_update(user_id, text))
+
+
+@asynccontextmanager
+async def running_bot(name, token, admin_ids, storage, request=None):
+    """Application сообщества с хранилищем storage, запущенное как в run_applications (без опроса)"""
+    api = fake_bot_api.FakeBotApi()
+    server = await fake_bot_api.FakeBotApiServer(api, '127.0.0.1', 0).start()
+    url = f"http://127.0.0.1:{server.port}"
+    tenant = bot.Tenant(name, token, admin_ids, storage, f"{url}/bot", f"{url}/file/bot")
+    application = bot.build_application(tenant, request or bot.SharedRequest())
+    try:
+        await application.initialize()
+        await application.post_init(application)
+        yield BotHarness(application, api)
+    finally:
+        await bot.stop_application(application)
+        await server.stop()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# bot.py, fake_bot_api.py и loadgen.py лежат в корне репозитория
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
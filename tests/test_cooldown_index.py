@@ -0,0 +1,50 @@
+"""Индекс пауз заданий и попыток: сроки ежедневных заданий и неверные попытки для автопроверки"""
+import math
+
+import bot
+
+DAY = bot.DAILY_COOLDOWN_SECONDS
+
+
+def submission(user_id, task_id, status, submitted_at):
+    return bot.SubmissionRecord(
+        user_id=user_id, task_id=task_id, task_points=10, content_type='text', files=[],
+        text_content='', submission_time=bot.datetime.fromtimestamp(submitted_at, bot.timezone.utc).isoformat(),
+        status=status,
+    )
+
+
+TASKS = {'1': {'type': 'daily'}, '2': {'type': 'once'}}
+
+
+def test_build_indexes_cooldowns_and_attempts():
+    submissions = {
+        '1': submission('u', '1', 'approved', 1000),
+        '2': submission('u', '2', 'approved', 1000),
+        '3': submission('v', '1', 'rejected', 1000),
+        '4': submission('w', '1', 'rejected', 1000),
+        '5': submission('w', '1', 'approved', 2000),
+    }
+    index = bot.CooldownIndex.build(submissions, TASKS, now=1500)
+    assert index.seconds_left('u', '1', now=1500) == 1000 + DAY - 1500
+    assert index.seconds_left('u', '2', now=1500) == math.inf
+    assert index.has_unresolved_attempt('v', '1')
+    # Отклоненная попытка до принятой уже не считается
+    assert not index.has_unresolved_attempt('w', '1')
+    assert not index.has_unresolved_attempt('u', '1')
+
+
+def test_attempts_follow_submission_status():
+    index = bot.CooldownIndex()
+    index.record_attempt('u', '1', 1000)
+    assert index.has_unresolved_attempt('u', '1')
+    # Отправку приняли - неверных попыток после последней принятой нет
+    index.record_approval('u', '1', 'daily', 1000, now=1000)
+    assert not index.has_unresolved_attempt('u', '1')
+    index.record_attempt('u', '1', 1000 + DAY)
+    assert index.has_unresolved_attempt('u', '1')
+    assert not index.has_unresolved_attempt('u', '2')
+
+    index.forget_task('1')
+    assert not index.has_unresolved_attempt('u', '1')
+    assert index.seconds_left('u', '1', now=1000) == 0
@@ -0,0 +1,47 @@
+"""Шаг loadgen через настоящий FakeBotApiServer; ответ бота имитирует сам тест"""
+import asyncio
+
+import httpx
+
+import fake_bot_api
+import loadgen
+
+USER_ID = 10_000_001
+
+
+async def answer_one_update(server_url):
+    """Забирает апдейт через getUpdates и отвечает в тот же чат, как это делал бы бот"""
+    async with httpx.AsyncClient(base_url=f"{server_url}/bot123:test") as bot:
+        updates = (await bot.post('/getUpdates', json={'timeout': 5})).json()['result']
+        update = updates[0]
+        await bot.post('/getUpdates', json={'offset': update['update_id'] + 1})
+        chat_id = update['message']['chat']['id']
+        await bot.post('/sendMessage', json={'chat_id': chat_id, 'text': f"echo: {update['message']['text']}"})
+        return update
+
+
+async def run_step():
+    api = fake_bot_api.FakeBotApi()
+    server = await fake_bot_api.FakeBotApiServer(api, '127.0.0.1', 0).start()
+    url = f"http://127.0.0.1:{server.port}"
+    client = loadgen.Client(url, reply_timeout=5)
+    try:
+        bot_task = asyncio.create_task(answer_one_update(url))
+        replies = await client.step('start', USER_ID, fake_bot_api.make_text_update(USER_ID, '/start'))
+        update = await bot_task
+        return update, replies, client, await client.stats()
+    finally:
+        await client.close()
+        await server.stop()
+
+
+def test_loadgen_step_round_trip():
+    update, replies, client, stats = asyncio.run(run_step())
+
+    assert update['message']['text'] == '/start'
+    assert [reply['message']['text'] for reply in replies] == ['echo: /start']
+    assert replies[0]['chat_id'] == USER_ID
+    assert len(client.latencies['start']) == 1
+    assert not client.failures
+    assert stats['methods']['sendMessage'] == 1
+    assert stats['pending_updates'] == 0
@@ -0,0 +1,46 @@
+"""Двоичные копии JsonFileStorage при загрузках из потоков ReadStore"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import bot
+
+USERS = bot.DATA_FILE
+
+
+def open_storage(path):
+    storage = bot.JsonFileStorage(str(path))
+    storage.open()
+    return storage
+
+
+def test_stale_read_does_not_replace_fresh_copy(tmp_path):
+    storage = open_storage(tmp_path)
+    storage.save(USERS, {'1': {'points': 1}})
+    stale_stat = os.stat(storage.path(USERS))
+    storage.save(USERS, {'1': {'points': 2}})
+    # Поток чтения разобрал прежнюю версию и пытается записать копию уже после записи новой
+    storage.refresh_binary_cache(USERS, {'1': {'points': 1}}, stale_stat)
+    assert bot.read_binary_cache(storage.path(USERS)) == {'1': {'points': 2}}
+    assert storage.load(USERS) == {'1': {'points': 2}}
+
+
+def test_concurrent_loads_and_writes(tmp_path):
+    storage = open_storage(tmp_path)
+    storage.save(USERS, {'version': 0})
+
+    def load(_):
+        # Без двоичной копии каждая загрузка разбирает JSON и пишет копию заново
+        try:
+            os.remove(storage.path(USERS) + bot.BINARY_CACHE_SUFFIX)
+        except FileNotFoundError:
+            pass
+        return storage.load(USERS)
+
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        loads = pool.map(load, range(200))
+        for version in range(1, 21):
+            storage.save(USERS, {'version': version})
+        assert all(data['version'] <= 20 for data in loads)
+
+    assert storage.cache_stats['hits'] + storage.cache_stats['misses'] == 200
+    assert storage.load(USERS) == {'version': 20}
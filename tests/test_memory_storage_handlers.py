@@ -0,0 +1,25 @@
+"""Настоящие обработчики бота поверх MemoryStorage: регистрация через Application и FakeBotApiServer"""
+import asyncio
+
+import bot
+from app_harness import running_bot
+
+USER_ID = 10_000_002
+ADMIN_ID = 10_000_003
+
+
+async def register_user(storage):
+    async with running_bot('test', '123:test', {ADMIN_ID}, storage) as harness:
+        return [await harness.text(USER_ID, text) for text in ('/start', 'Иван', 'Петров', '👤 Профиль')]
+
+
+def test_registration_through_memory_storage():
+    storage = bot.MemoryStorage()
+    replies = asyncio.run(register_user(storage))
+
+    assert any('Добро пожаловать' in text for text in replies[0])
+    assert any('Имя сохранено' in text for text in replies[1])
+    assert any('Регистрация успешно' in text for text in replies[2])
+    assert any('Иван' in text and 'Петров' in text for text in replies[3])
+    user = storage.load(bot.DATA_FILE)[str(USER_ID)]
+    assert (user['first_name'], user['surname'], user['points']) == ('Иван', 'Петров', 0)
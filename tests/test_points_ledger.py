@@ -0,0 +1,79 @@
+"""Журнал баллов: индекс смещений по пользователям и снимки журнала сегментами"""
+import os
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import bot
+
+LEDGER = bot.POINTS_LEDGER_FILE
+
+
+def stage_and_commit(ledger, entries):
+    uow = bot.UnitOfWork()
+    ledger.stage(uow, entries)
+    assert uow.commit()
+
+
+def test_ledger_offsets_history_and_index_reload():
+    storage = bot.MemoryStorage()
+    with bot.using_storage(storage):
+        ledger = bot.PointsLedger.load()
+        stage_and_commit(ledger, [
+            bot.ledger_entry('1', 10, 'submission', ref='s1'),
+            bot.ledger_entry('2', 5, 'submission', ref='s2'),
+        ])
+        stage_and_commit(ledger, [bot.ledger_entry('1', -4, 'purchase', ref='o1')])
+
+        assert [entry['seq'] for entry in ledger.history('1')] == [3, 1]
+        assert ledger.totals('1') == (6, 10)
+        assert len(ledger.offsets['2']) == 1
+        # Смещение указывает на начало строки пользователя в журнале
+        assert storage.read_log_lines(LEDGER, ledger.offsets['2']) == [
+            line for _, line in storage.read_log(LEDGER) if b'"ref": "s2"' in line
+        ]
+
+        bot.save_points_ledger_index(ledger)
+        # Строка, дописанная после сохранения индекса, дочитывается из хвоста при загрузке
+        stage_and_commit(ledger, [bot.ledger_entry('2', 1, 'manual')])
+        reloaded = bot.PointsLedger.load()
+        assert reloaded.offsets['2'] == [*ledger.offsets['2'], ledger.size]
+        assert reloaded.next_seq == 5
+        assert reloaded.size == storage.log_size(LEDGER)
+
+
+@pytest.mark.parametrize('backend', ['json', 'sqlite'])
+def test_snapshots_store_ledger_as_segments(tmp_path, backend):
+    storage = bot.create_storage(backend, str(tmp_path), str(tmp_path / 'bot.sqlite3'))
+    snapshot_dir = storage.snapshot_dir or str(tmp_path / 'snapshots')
+    os.makedirs(snapshot_dir, exist_ok=True)
+    storage.open()
+    started = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+    def append(lines, offset=None):
+        uow = bot.UnitOfWork()
+        uow.append(LEDGER, lines, offset=offset)
+        assert uow.commit()
+
+    def snapshot(hour):
+        manifest = bot.load_snapshot_manifest(snapshot_dir)
+        entries, changes = bot.collect_snapshot_changes(storage, manifest)
+        snapshot = bot.write_snapshot(snapshot_dir, manifest, entries, changes, 'manual', True, started + timedelta(hours=hour))
+        return snapshot, len(changes[LEDGER][0]) if LEDGER in changes else 0
+
+    with bot.using_storage(storage):
+        append([f'{{"seq": {seq}}}\n' for seq in range(1, 101)])
+        full, full_read = snapshot(0)
+        append(['{"seq": 101}\n'])
+        tail, tail_read = snapshot(1)
+        # Журнал начат заново: сегменты прежнего журнала больше не подходят
+        append(['{"seq": 1, "reset": true}\n'], offset=0)
+        reset, _ = snapshot(2)
+    storage.close()
+
+    # Следующий снимок читает и сохраняет только дописанный хвост журнала
+    assert tail_read < full_read
+    assert len(tail['files'][LEDGER]['segments']) == len(full['files'][LEDGER]['segments']) + 1
+    assert len(reset['files'][LEDGER]['segments']) == 1
+    for saved, lines in ((full, 100), (tail, 101), (reset, 1)):
+        assert bot.read_snapshot_files(snapshot_dir, saved)[LEDGER].count(b'\n') == lines
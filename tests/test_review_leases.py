@@ -0,0 +1,63 @@
+"""Аренда отправок на проверку: истечение, claim и аренда страниц массовой проверки"""
+import bot
+
+ADMIN = 1
+OTHER_ADMIN = 2
+
+
+def test_lease_expires_after_ttl():
+    leases = bot.ReviewLeases(ttl=60)
+    assert leases.extend(ADMIN, '1', now=1000)
+    assert leases.holder('1', now=1059) == ADMIN
+    assert not leases.extend(OTHER_ADMIN, '1', now=1059)
+    # Истекшая аренда перестает учитываться, отправку может взять другой администратор
+    assert leases.holder('1', now=1060) is None
+    assert leases.held_by_others(OTHER_ADMIN, now=1060) == set()
+    assert leases.extend(OTHER_ADMIN, '1', now=1060)
+    assert leases.holder('1', now=1060) == OTHER_ADMIN
+
+
+def test_claim_skips_others_and_takes_expired():
+    leases = bot.ReviewLeases(ttl=60)
+    pending = ['1', '2', '3', '4']
+    assert leases.claim(ADMIN, pending, 2, now=1000) == ['1', '2']
+    assert leases.claim(OTHER_ADMIN, pending, 2, now=1010) == ['3', '4']
+    # Свои аренды продлеваются, а не добавляются заново
+    assert leases.claim(ADMIN, pending, 2, now=1020) == ['1', '2']
+    assert leases.claim(OTHER_ADMIN, pending, 4, now=1075) == ['3', '4']
+    # Аренды ADMIN продлены до 1080, после этого claim забирает все
+    assert leases.claim(OTHER_ADMIN, pending, 4, now=1080) == ['1', '2', '3', '4']
+    assert leases.held_by_others(ADMIN, now=1080) == set(pending)
+
+
+def bulk_state(ids):
+    return {'ids': ids, 'rows': {}, 'selected': set(), 'leased': set(), 'locked': set(), 'page': 0, 'title': ''}
+
+
+def test_bulk_review_leases_only_shown_page():
+    leases = bot.ReviewLeases(ttl=60)
+    ids = [str(n) for n in range(1, bot.BULK_REVIEW_PAGE_SIZE * 2 + 1)]
+    state = bulk_state(ids)
+    bot.lease_bulk_review_page(state, leases, ADMIN)
+    first_page = set(ids[:min(bot.BULK_REVIEW_PAGE_SIZE, bot.REVIEW_CLAIM_SIZE)])
+    assert state['leased'] == first_page
+    assert leases.held_by_others(OTHER_ADMIN) == first_page
+
+    state['page'] = 1
+    bot.lease_bulk_review_page(state, leases, ADMIN)
+    # Аренды прежней страницы сняты, остальные отправки доступны другим администраторам
+    assert leases.held_by_others(OTHER_ADMIN) == state['leased']
+    assert not state['leased'] & first_page
+
+    bot.release_bulk_review_leases(state, leases, ADMIN)
+    assert leases.held_by_others(OTHER_ADMIN) == set()
+
+
+def test_bulk_review_page_marks_submissions_of_other_admins():
+    leases = bot.ReviewLeases(ttl=60)
+    leases.extend(OTHER_ADMIN, '2')
+    state = bulk_state(['1', '2'])
+    bot.lease_bulk_review_page(state, leases, ADMIN)
+    assert state['leased'] == {'1'}
+    assert state['locked'] == {'2'}
+    assert leases.holder('2') == OTHER_ADMIN
@@ -0,0 +1,48 @@
+"""Брони товаров ограниченного количества: остаток, истечение брони и ее замена"""
+import bot
+
+PRODUCTS = {
+    'lamp': {'quantity': 2, 'sold': 1},
+    'sticker': {'quantity': 0, 'sold': 7},
+}
+
+
+def test_reservation_holds_last_unit_until_ttl():
+    stock = bot.StockReservations.build(PRODUCTS)
+    stock.ttl = 30
+    assert stock.reserve('lamp', 'alice', now=1000)
+    assert stock.available('lamp', 'bob', now=1010) == 0
+    assert not stock.reserve('lamp', 'bob', now=1010)
+    # Своя бронь не мешает самому покупателю
+    assert stock.available('lamp', 'alice', now=1010) == 1
+
+    # Истекшая бронь перестает учитываться, единицу может забрать другой
+    assert stock.available('lamp', 'bob', now=1030) == 1
+    assert not stock.holds_product('alice', 'lamp', now=1030)
+    assert stock.reserve('lamp', 'bob', now=1030)
+    assert stock.holds_product('bob', 'lamp', now=1031)
+    assert stock.reserved['lamp'] == 1
+
+
+def test_renewed_reservation_is_not_released_by_old_expiry():
+    stock = bot.StockReservations.build(PRODUCTS)
+    stock.ttl = 30
+    assert stock.reserve('lamp', 'alice', now=1000)
+    assert stock.reserve('lamp', 'alice', now=1020)
+    # Запись первой брони в куче истекла, но действует продленная
+    assert stock.holds_product('alice', 'lamp', now=1040)
+    assert stock.available('lamp', 'bob', now=1040) == 0
+    assert not stock.holds_product('alice', 'lamp', now=1050)
+
+
+def test_unlimited_products_and_release():
+    stock = bot.StockReservations.build(PRODUCTS)
+    assert stock.available('sticker', 'alice') is None
+    assert stock.reserve('sticker', 'alice')
+    assert not stock.holds_product('alice', 'sticker')
+
+    assert stock.reserve('lamp', 'alice', now=1000)
+    stock.release('alice')
+    assert stock.available('lamp', 'bob', now=1001) == 1
+    stock.update_product('lamp', {'quantity': 2, 'sold': 2})
+    assert not stock.reserve('lamp', 'bob', now=1002)
@@ -0,0 +1,98 @@
+"""Журнал транзакций JsonFileStorage: восстановление после сбоя и доведение замены до конца"""
+import json
+import os
+
+import bot
+
+DOCUMENTS = {'a.json': {'x': 1}, 'users_data.json': {'u': 1}}
+
+
+def open_storage(path):
+    storage = bot.JsonFileStorage(str(path))
+    storage.open()
+    return storage
+
+
+def test_commit_replaces_documents_and_appends_lines(tmp_path):
+    storage = open_storage(tmp_path)
+    assert storage.commit(DOCUMENTS, {'log.jsonl': {'offset': None, 'lines': ['l1\n']}})
+    assert storage.load('a.json') == {'x': 1}
+    assert (tmp_path / 'log.jsonl').read_text() == 'l1\n'
+    assert not (tmp_path / bot.JOURNAL_FILE).exists()
+    assert not any(name.endswith(bot.TRANSACTION_SUFFIX) for name in os.listdir(tmp_path))
+
+
+def test_apply_failure_is_retried_and_commit_succeeds(tmp_path, monkeypatch):
+    storage = open_storage(tmp_path)
+    assert storage.commit(DOCUMENTS, {})
+    real_replace = os.replace
+    failures = []
+
+    def replace_failing_once(src, dst):
+        if src.endswith('users_data.json' + bot.TRANSACTION_SUFFIX) and not failures:
+            failures.append(src)
+            raise OSError('disk full')
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', replace_failing_once)
+    assert storage.commit({'a.json': {'x': 2}, 'users_data.json': {'u': 2}}, {'log.jsonl': {'offset': None, 'lines': ['l2\n']}})
+    assert failures
+    assert storage.load('a.json') == {'x': 2}
+    assert storage.load('users_data.json') == {'u': 2}
+    assert (tmp_path / 'log.jsonl').read_text() == 'l2\n'
+    assert not (tmp_path / bot.JOURNAL_FILE).exists()
+
+
+def test_durable_journal_never_reports_failure(tmp_path, monkeypatch):
+    storage = open_storage(tmp_path)
+    assert storage.commit(DOCUMENTS, {})
+    real_replace = os.replace
+
+    def replace_failing(src, dst):
+        if src.endswith('users_data.json' + bot.TRANSACTION_SUFFIX):
+            raise OSError('disk full')
+        return real_replace(src, dst)
+
+    monkeypatch.setattr(os, 'replace', replace_failing)
+    # Журнал записан - транзакция подтверждена, хотя замена файлов пока не удалась
+    assert storage.commit({'a.json': {'x': 2}, 'users_data.json': {'u': 2}}, {})
+    assert (tmp_path / bot.JOURNAL_FILE).exists()
+    monkeypatch.setattr(os, 'replace', real_replace)
+    # Следующая транзакция сначала доводит прерванную
+    assert storage.commit({'b.json': {'y': 1}}, {})
+    assert storage.load('users_data.json') == {'u': 2}
+    assert storage.load('b.json') == {'y': 1}
+    assert not (tmp_path / bot.JOURNAL_FILE).exists()
+
+
+def test_failure_before_journal_changes_nothing(tmp_path, monkeypatch):
+    storage = open_storage(tmp_path)
+    assert storage.commit(DOCUMENTS, {})
+    real_sync = bot.write_json_synced
+
+    def sync_failing(data, filename, indent=2):
+        if filename.endswith('users_data.json' + bot.TRANSACTION_SUFFIX):
+            raise OSError('disk full')
+        return real_sync(data, filename, indent)
+
+    monkeypatch.setattr(bot, 'write_json_synced', sync_failing)
+    assert not storage.commit({'a.json': {'x': 3}, 'users_data.json': {'u': 3}}, {})
+    assert storage.load('a.json') == {'x': 1}
+    assert not (tmp_path / bot.JOURNAL_FILE).exists()
+    assert not any(name.endswith(bot.TRANSACTION_SUFFIX) for name in os.listdir(tmp_path))
+
+
+def test_open_recovers_interrupted_transaction(tmp_path):
+    storage = open_storage(tmp_path)
+    assert storage.commit(DOCUMENTS, {'log.jsonl': {'offset': None, 'lines': ['l1\n']}})
+    # Процесс упал после записи журнала: новая версия лежит рядом, строка дописана наполовину
+    bot.write_json_synced({'x': 5}, str(tmp_path / ('a.json' + bot.TRANSACTION_SUFFIX)))
+    with open(tmp_path / 'log.jsonl', 'a') as f:
+        f.write('l2-обрыв')
+    journal = {'replaces': ['a.json'], 'appends': {'log.jsonl': {'offset': 3, 'lines': ['l2\n']}}, 'deletes': []}
+    (tmp_path / bot.JOURNAL_FILE).write_text(json.dumps(journal))
+
+    recovered = open_storage(tmp_path)
+    assert recovered.load('a.json') == {'x': 5}
+    assert (tmp_path / 'log.jsonl').read_text() == 'l1\nl2\n'
+    assert not (tmp_path / bot.JOURNAL_FILE).exists()
@@ -0,0 +1,50 @@
+"""Несколько сообществ в одном процессе: данные и администраторы не пересекаются"""
+import asyncio
+
+import bot
+from app_harness import running_bot
+
+ALPHA_ADMIN = 10_000_011
+BETA_ADMIN = 10_000_012
+STUDENT = 10_000_013
+
+
+def users_of(storage):
+    with bot.using_storage(storage):
+        return bot.load_users()
+
+
+async def register(harness, user_id, first_name, surname):
+    for text in ('/start', first_name, surname):
+        await harness.text(user_id, text)
+
+
+async def run_two_tenants(alpha_storage, beta_storage):
+    request = bot.SharedRequest()
+    async with running_bot('alpha', '1:alpha', {ALPHA_ADMIN}, alpha_storage, request) as alpha, \
+            running_bot('beta', '2:beta', {BETA_ADMIN}, beta_storage, request) as beta:
+        await register(alpha, ALPHA_ADMIN, 'Анна', 'Альфа')
+        await register(alpha, STUDENT, 'Иван', 'Петров')
+        await register(beta, ALPHA_ADMIN, 'Анна', 'Бета')
+        return {
+            'alpha_admin_in_alpha': await alpha.text(ALPHA_ADMIN, '👨‍💼 Панель администратора'),
+            'alpha_admin_in_beta': await beta.text(ALPHA_ADMIN, '👨‍💼 Панель администратора'),
+            'student_in_beta': await beta.text(STUDENT, '👤 Профиль'),
+        }
+
+
+def test_tenants_keep_separate_data_and_admins():
+    alpha_storage, beta_storage = bot.MemoryStorage(), bot.MemoryStorage()
+    replies = asyncio.run(run_two_tenants(alpha_storage, beta_storage))
+
+    alpha_users = users_of(alpha_storage)
+    beta_users = users_of(beta_storage)
+    assert set(alpha_users) == {str(ALPHA_ADMIN), str(STUDENT)}
+    assert set(beta_users) == {str(ALPHA_ADMIN)}
+    assert alpha_users[str(ALPHA_ADMIN)].surname == 'Альфа'
+    assert beta_users[str(ALPHA_ADMIN)].surname == 'Бета'
+
+    assert not any('нет доступа' in text for text in replies['alpha_admin_in_alpha'])
+    assert any('нет доступа' in text for text in replies['alpha_admin_in_beta'])
+    # Регистрация в одном сообществе не действует в другом
+    assert not any('Петров' in text for text in replies['student_in_beta'])